@@ -0,0 +1,54 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+import utilities
+
+# Disk cache for the action tables of InterferenceEnvironment
+# Tables are built once per parameter set, saved as an uncompressed .npz under
+# utilities.ACTION_TABLE_DIR and memory-mapped read-only afterwards, so every worker process
+# maps the same physical pages instead of rebuilding ~500k tuples (step = 1) on its own heap.
+
+TABLE_FORMAT_VERSION = 1 # Bump when the tables built for the same parameters change
+
+
+def table_key(params: dict) -> str:
+    # Stable short hash of the parameters a table depends on and of the table format
+    keyed = {"format_version": TABLE_FORMAT_VERSION, "params": params}
+    return hashlib.sha1(json.dumps(keyed, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def gnb_splits(max_prb, min_prb, step_size):
+    # All (first UE, second UE) splits of one virtual gNB, same order as the nested range loops
+    grid = np.arange(min_prb, max_prb - min_prb + 1, step_size)
+    first, second = np.meshgrid(grid, grid, indexing="ij")
+    valid = first + second <= max_prb
+    return np.column_stack([first[valid], second[valid]])
+
+
+def action_list(max_prb, min_prb, step_size):
+    # Cartesian product of the gNB2 and gNB3 splits -> (N, 4) [u1, u2, u3, u4]
+    splits = gnb_splits(max_prb, min_prb, step_size)
+    return np.column_stack([np.repeat(splits, len(splits), axis=0), np.tile(splits, (len(splits), 1))])
+
+
+def load_or_build(params: dict, build, cache_dir=None) -> dict:
+    """
+        Memory-mapped tables for params, built with build() -> {name: array} on a cache miss
+
+        Concurrent builders write to private temporary files and os.replace() them into place,
+        the last one wins with identical content.
+    """
+    cache_dir = utilities.ACTION_TABLE_DIR if cache_dir is None else cache_dir
+    path = os.path.join(cache_dir, f"actions_{table_key(params)}.npz")
+    if not os.path.exists(path):
+        tables = build()
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(tmp_path, params=np.array(json.dumps(params, sort_keys=True)), **tables)
+        os.replace(tmp_path, path)
+    tables = utilities.load_npz_mmap(path)
+    tables.pop("params", None)
+    return tables
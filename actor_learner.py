@@ -0,0 +1,229 @@
+import argparse
+import multiprocessing as mp
+import os
+import queue
+import time
+import uuid
+
+import numpy as np
+
+import utilities
+
+# Asynchronous actor-learner training (conf["algorithm"] = "DQN_PER_ASYNC" in main.run_experiment)
+# The actor process steps InterferenceEnvironment (against the testbed when PRE_TRAIN is False,
+# which the actor gets through the IOContext built by main.make_io)
+# with an epsilon-greedy NumPy copy of the Q-network, the learner keeps training the
+# PrioritizedDQN of off_policy.py on whatever has arrived. Transitions flow through a Queue,
+# weights are published every weight_sync_updates gradient updates through a size-1 Queue that
+# only ever holds the latest copy, so gradient updates overlap the measurement cycle instead of
+# alternating with it. Resuming an async run is not supported (main.run_experiment refuses it).
+#   python actor_learner.py --timesteps 20000 --utd_ratio 4
+
+TRANSITION_TIMEOUT = 1.0 # in seconds, learner wait when it has nothing to train on
+
+
+def _actor(conf, io, transitions, weights, stop) -> None:
+    # Runs in a spawned process: numpy + gymnasium only, no torch
+    from environment import InterferenceEnvironment
+    from numpy_policy import NumpyPolicy
+
+    config = utilities.Config()
+    config.action_step_size = conf["action_step_size"]
+    config.io = io
+    env = InterferenceEnvironment(config)
+    rng = np.random.RandomState(conf.get("seed"))
+    policy = None
+    obs, _ = env.reset(seed=conf.get("seed"))
+    episode_return, episode_length, steps = 0., 0, 0
+
+    while not stop.is_set():
+        # The learner replaces unread weights, so whatever is waiting is the latest copy
+        try:
+            policy = NumpyPolicy(weights.get_nowait())
+        except queue.Empty:
+            pass
+
+        fraction = min(1., steps / max(1, conf["exploration_fraction"] * conf["total_timesteps"]))
+        epsilon = 1. + fraction * (conf["exploration_final_eps"] - 1.)
+        if policy is None or rng.random() < epsilon:
+            action = int(rng.randint(env.action_space.n))
+        else:
+            action = int(policy.predict(obs)[0])
+
+        next_obs, reward, terminated, truncated, _ = env.step(action)
+        steps += 1
+        episode_return += reward
+        episode_length += 1
+        truncated = truncated or episode_length >= conf["episode_steps"]
+        episode = {"r": episode_return, "l": episode_length} if terminated or truncated else None
+        transitions.put((obs, next_obs, action, reward, terminated, truncated, episode))
+
+        if terminated or truncated:
+            obs, _ = env.reset()
+            episode_return, episode_length = 0., 0
+        else:
+            obs = next_obs
+    transitions.put(None)
+    env.close()
+
+
+def publish_weights(model, weights) -> None:
+    """
+        Q-network as [(W (in, out), b, activation)], the format NumpyPolicy takes
+
+        Never blocks the learner: a copy the actor has not picked up yet is dropped and replaced,
+        pickling and the transfer happen on the Queue's feeder thread
+    """
+    from numpy_policy import policy_layers
+    layers = [(np.ascontiguousarray(W.T, dtype=np.float32), b.astype(np.float32), activation)
+              for W, b, activation in policy_layers(model.policy)]
+    try:
+        weights.get_nowait()
+    except queue.Empty:
+        pass
+    try:
+        weights.put_nowait(layers)
+    except queue.Full:
+        pass # Still in flight to the actor, the next sync sends newer weights anyway
+
+
+def run_actor_learner(conf: dict) -> dict:
+    import wandb
+    from gymnasium.wrappers import TimeLimit
+    from stable_baselines3.common.logger import configure
+    from environment import InterferenceEnvironment
+    from off_policy import PrioritizedDQN
+    from callbacks import save_checkpoint, write_run_state
+    import main
+
+    conf = {**main.DEFAULT_CONF, **conf}
+    conf.setdefault("total_timesteps", conf["timesteps_per_session"] * conf["total_sessions"])
+    start_time = time.time()
+
+    i, path = main.allocate_experiment_dir()
+    run_state = {"experiment": i, "wandb_run_id": uuid.uuid4().hex[:8], "session": 0}
+    write_run_state(path, run_state)
+    run = wandb.init(project="PRB_ALLOCATION_MULTI_GNB", config=conf, sync_tensorboard=True,
+                     mode=conf["wandb_mode"], name=f"Exp_{i}_Interference_async", id=run_state["wandb_run_id"])
+
+    # Learner-side environment only provides the spaces, it is never stepped
+    config = utilities.Config()
+    config.action_step_size = conf["action_step_size"]
+    env = TimeLimit(InterferenceEnvironment(config), max_episode_steps=conf["episode_steps"])
+    model = PrioritizedDQN("MlpPolicy", env,
+                           learning_rate=conf["learning_rate"],
+                           buffer_size=conf["buffer_size"],
+                           learning_starts=conf["learning_starts"],
+                           batch_size=conf["batch_size"],
+                           target_update_interval=conf["target_update_interval"],
+                           exploration_fraction=conf["exploration_fraction"],
+                           replay_buffer_kwargs={"alpha": conf["per_alpha"], "beta": conf["per_beta"]},
+                           beta_timesteps=conf["total_timesteps"],
+                           verbose=1,
+                           device="cpu")
+    model.set_logger(configure(f"{path}/tensorboard/DQN_async", ["stdout", "csv", "tensorboard"]))
+    if conf["replay_path"] and os.path.exists(conf["replay_path"]):
+        print(f"Loaded {model.replay_buffer.load(conf['replay_path'])} transitions from {conf['replay_path']}")
+
+    context = mp.get_context("spawn")
+    transitions = context.Queue(maxsize=conf["queue_size"])
+    weights = context.Queue(maxsize=1)
+    weights.cancel_join_thread() # Unread weights are disposable, never wait on them at exit
+    stop = context.Event()
+    actor = context.Process(target=_actor, args=(conf, main.make_io(conf), transitions, weights, stop), daemon=True)
+    actor.start()
+    publish_weights(model, weights)
+
+    episodes, n_updates, last_sync, idle_s = [], 0, 0, 0.
+
+    def can_train():
+        # conf["utd_ratio"] caps gradient updates per collected step, None trains continuously
+        return model.replay_buffer.size() >= conf["learning_starts"] and \
+            (conf["utd_ratio"] is None or n_updates < conf["utd_ratio"] * model.num_timesteps)
+
+    def consume(item):
+        obs, next_obs, action, reward, terminated, truncated, episode = item
+        model.replay_buffer.add(obs[None], next_obs[None], np.array([action]), np.array([reward]),
+                                np.array([terminated or truncated]), [{"TimeLimit.truncated": truncated}])
+        model.num_timesteps += 1
+        model._on_step() # target network sync and exploration schedule
+        if episode is not None:
+            episodes.append(episode)
+            model.logger.record("rollout/ep_rew_mean", np.mean([e["r"] for e in episodes[-100:]]))
+
+    while model.num_timesteps < conf["total_timesteps"]:
+        # Drain everything that arrived, block briefly only when there is nothing to train on
+        try:
+            if can_train():
+                item = transitions.get_nowait()
+            else:
+                wait_start = time.perf_counter()
+                try:
+                    item = transitions.get(timeout=TRANSITION_TIMEOUT)
+                finally:
+                    idle_s += time.perf_counter() - wait_start
+            while item is not None:
+                consume(item)
+                item = transitions.get_nowait()
+        except queue.Empty:
+            pass
+        if not actor.is_alive() and transitions.empty():
+            raise RuntimeError(f"Actor process exited with code {actor.exitcode}")
+
+        if can_train():
+            model._update_current_progress_remaining(model.num_timesteps, conf["total_timesteps"])
+            model.train(gradient_steps=conf["learner_chunk"], batch_size=conf["batch_size"])
+            n_updates += conf["learner_chunk"]
+            if n_updates - last_sync >= conf["weight_sync_updates"]:
+                publish_weights(model, weights)
+                last_sync = n_updates
+                model.logger.record("time/learner_idle_s", idle_s)
+                model.logger.record("time/total_timesteps", model.num_timesteps)
+                model.logger.dump(model.num_timesteps)
+
+    # The actor may be blocked on a full queue: keep draining (and storing) until it signs off
+    stop.set()
+    deadline = time.monotonic() + 60
+    while actor.is_alive() and time.monotonic() < deadline:
+        try:
+            item = transitions.get(timeout=TRANSITION_TIMEOUT)
+        except queue.Empty:
+            continue
+        if item is None:
+            break
+        consume(item)
+    actor.join(timeout=5)
+    if actor.is_alive():
+        actor.terminate()
+
+    save_checkpoint(model, f"{path}/model_async", {"n_calls": model.num_timesteps, "session": 0,
+                                                   "session_start_timesteps": 0, "n_updates": n_updates})
+    model.replay_buffer.save(f"{path}/replay_buffer.npz")
+    results = {
+        "experiment": path,
+        "num_timesteps": model.num_timesteps,
+        "n_updates": n_updates,
+        "updates_per_step": n_updates / max(1, model.num_timesteps),
+        "mean_episode_reward": float(np.mean([e["r"] for e in episodes[-100:]])) if episodes else None,
+        "episodes": len(episodes),
+        "learner_idle_fraction": idle_s / (time.time() - start_time),
+        "wall_time_s": time.time() - start_time,
+    }
+    run.finish()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Asynchronous actor-learner DQN training")
+    parser.add_argument("--timesteps", type=int, default=50000, help="Environment steps to collect")
+    parser.add_argument("--utd_ratio", type=float, default=4, help="Upper bound on updates per environment step (0: none)")
+    parser.add_argument("--weight_sync_updates", type=int, default=50, help="Publish weights every N updates")
+    parser.add_argument("--hardware", action="store_true", help="Step the testbed instead of the simulator")
+    parser.add_argument("--wandb_mode", type=str, default="online", help="online / offline / disabled")
+    args = parser.parse_args()
+
+    utilities.PRE_TRAIN = not args.hardware
+    import main
+    print(run_actor_learner({**main.DEFAULT_CONF, "algorithm": "DQN_PER_ASYNC", "total_timesteps": args.timesteps,
+                             "utd_ratio": args.utd_ratio or None, "weight_sync_updates": args.weight_sync_updates,
+                             "wandb_mode": args.wandb_mode}))
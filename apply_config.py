@@ -1,14 +1,23 @@
-import json
+import numpy as np
+
 import utilities
+import file_protocol
+
+# Changed to match new srsRAN RIC resource allocation operation
+TOTAL_PRBS_PER_GNB = 52
+MIN_PRB_RATIO = 15 # <-- Need to test lower values to see if they still work
+DEDICATED_PRB_RATIO = 100
+
+def prb_to_ratio(prb_count):
+    # Convert raw PRBs to a percentage of the total carrier bandwidth (52 PRBs)
+    max_prb_ratio = (np.asarray(prb_count, dtype=float) / TOTAL_PRBS_PER_GNB) * 100
 
-def apply_config(action_dict, path_loss_config):
+    # Ensure ratio doesn't exceed 100% or drop below a functional floor, truncated like int()
+    return np.trunc(np.clip(max_prb_ratio, MIN_PRB_RATIO, 100)).astype(int)
+
+def apply_config(action_dict, path_loss_config, io=None):
     # Initialize a list to keep track of allocated resources in the desired format
     allocation_results = []
-
-    # Changed to match new srsRAN RIC resource allocation operation
-    total_prbs_per_gnb = 52
-    min_prb_ratio = 15 # <-- Need to test lower values to see if they still work
-    dedicated_prb_ratio = 100
     
     # Group path_loss data by user_id
     ''' path_loss_config: [{"user_id": task["user_id"], 
@@ -17,32 +26,31 @@ def apply_config(action_dict, path_loss_config):
                             "loss": task["path_loss"]}] '''    
     user_metadata = {item['user_id']: item for item in path_loss_config}
 
-    # Iterate through the action dictionary (gnb_1, gnb_2, gnb_3)
-    for gnb_key, users_in_gnb in action_dict.items():
-        # users_in_gnb: {user_id: prb_count}
-        for user_id, prb_count in users_in_gnb.items():
-            
-            # Convert raw PRBs to a percentage of the total carrier bandwidth (52 PRBs)
-            max_prb_ratio = (prb_count / total_prbs_per_gnb) * 100
-            
-            # Ensure ratio doesn't exceed 100% or drop below a functional floor
-            max_prb_ratio = max(min_prb_ratio, min(100, max_prb_ratio))
+    # Flatten the action dictionary (gnb_1, gnb_2, gnb_3) -> users_in_gnb: {user_id: prb_count}
+    user_ids = [user_id for users_in_gnb in action_dict.values() for user_id in users_in_gnb]
+    prb_counts = [prb_count for users_in_gnb in action_dict.values() for prb_count in users_in_gnb.values()]
+    max_prb_ratios = prb_to_ratio(prb_counts)
 
-            # Get the pathloss for this user from metadata
-            loss = user_metadata[user_id]["loss"]
+    for user_id, max_prb_ratio in zip(user_ids, max_prb_ratios):
+        # Get the pathloss for this user from metadata
+        loss = user_metadata[user_id]["loss"]
 
-            # Append results for this RNTI/User ID
-            allocation_results.append({
-                "id": user_id,
-                "min_prb_ratio": min_prb_ratio,
-                "max_prb_ratio": int(max_prb_ratio),
-                "ded_prb_ratio": dedicated_prb_ratio,
-                "pathloss": loss
-            })
+        # Append results for this RNTI/User ID
+        allocation_results.append({
+            "id": user_id,
+            "min_prb_ratio": MIN_PRB_RATIO,
+            "max_prb_ratio": int(max_prb_ratio),
+            "ded_prb_ratio": DEDICATED_PRB_RATIO,
+            "pathloss": loss
+        })
 
-    # Save the results to a JSON file
-    with open(utilities.ALLOCATION_SAVE_PATH, 'w') as json_file:
-        json.dump(allocation_results, json_file, indent=4)
+    # Publish the results atomically with the next sequence number (returned to the caller),
+    # numbered past any res.json left over from a deleted / recreated alloc.json so that a
+    # stale result can never carry the sequence number of this allocation
+    alloc_path = utilities.ALLOCATION_SAVE_PATH if io is None else io.alloc_path
+    res_path = utilities.HW_RES_PATH if io is None else io.res_path
+    seq = max(file_protocol.read_seq(alloc_path), file_protocol.read_seq(res_path)) + 1
+    return file_protocol.write_json(alloc_path, allocation_results, seq=seq)
 
 if __name__ == "__main__":
     # Example usage:
@@ -7,19 +7,173 @@ import signal
 from lib.xAppBase import xAppBase
 import json
 import subprocess
+import threading
+import queue
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import file_protocol # Deployed next to this xApp
+
+IO_DIR = "/opt/xApps" # Default namespace of alloc.json / res.json / ue_id.json, shared with the trainer
+WAIT_SLICE = 1.0 # in seconds, event waits wake up this often to notice a stopped xApp
+UE_NUMBER_OFFSET = 1 # Trainer user ids (alloc.json / res.json) are 0..4, testbed UEs 1..5 (ue_id.json, 10.45.1.<n>)
+
+# Adaptive measurement windows (see window_estimate)
+IDLE_THRESHOLD = 3   # DL throughput below this is a UE without traffic
+WARMUP_REPORTS = 1   # First report with traffic covers a partial period, dropped
+MIN_REPORTS = 5
+MAX_REPORTS = 16     # 2 s of iperf traffic at a 125 ms report period
+CI_TARGET = 0.05     # 95% confidence half-width relative to the mean, 0 never stops early
+ESTIMATOR = "top3"   # Reported dl_thp: "top3" average of the 3 highest reports (recordings / replay tables), "mean" of the traffic reports
 
 class MyXapp(xAppBase):
-    def __init__(self, config, http_server_port, rmr_port):
+    def __init__(self, config, http_server_port, rmr_port, control_workers=4, control_timeout=2.0, io_dir=IO_DIR,
+                 min_reports=MIN_REPORTS, max_reports=MAX_REPORTS, ci_target=CI_TARGET, pipelined=False,
+                 estimator=ESTIMATOR):
         super(MyXapp, self).__init__(config, http_server_port, rmr_port)
-        pass
+        # Protocol files of the trainer environment this xApp serves
+        self.paths = file_protocol.protocol_paths(io_dir)
+        # Bounded pool for concurrent RC control messages (control_workers=1 sends them serially)
+        self.control_pool = ThreadPoolExecutor(max_workers=control_workers, thread_name_prefix="rc_control")
+        self.control_timeout = control_timeout # in seconds, per control message
+        # Set by the KPM callback thread, waited on by the control loop: a phase ends with the
+        # indication that completes it instead of at the next sleep(0.1 / 0.3) poll
+        self.transfer_finished = threading.Event() # Initialization: UE being mapped stopped its transfer
+        self.measurement_done = threading.Event()  # All UEs of the allocation measured, res.json written
+        self.ready = threading.Event()             # UE mapping done, watching alloc.json
+        # Measurement window bounds and convergence target per UE
+        self.min_reports = min_reports
+        self.max_reports = max_reports
+        self.ci_target = ci_target
+        if estimator not in ("top3", "mean"):
+            raise ValueError(f"Unknown throughput estimator: {estimator}")
+        self.estimator = estimator
+        # Pipelined: a gNB's measurement waits only for its own PRB quotas, the other gNBs' are
+        # still in flight. Waiting happens on the control loop, never on the KPM callback thread
+        self.pipelined = pipelined
+        self.staged = {}
+        self.gnb_requests = queue.Queue() # Callback -> control loop: next gNB to measure, None: all done
+
+    def send_prb_quota(self, control):
+        return self.e2sm_rc.control_slice_level_prb_quota(
+            control["e2_node_id"], 
+            ue_id=control["rnti"], 
+            min_prb_ratio=control["min_prb"], 
+            max_prb_ratio=control["max_prb"], 
+            dedicated_prb_ratio=control["ded_prb"], 
+            ack_request=1
+        )
+
+    def stage_controls(self, controls):
+        """
+            Submit the PRB quota of every UE of an allocation without waiting
+
+            Returns {gnb: [(control, future)]} for collect_controls.
+        """
+        staged = {}
+        for control in controls:
+            staged.setdefault(control["gnb"], []).append((control, self.control_pool.submit(self.send_prb_quota, control)))
+        return staged
+
+    def collect_controls(self, staged):
+        """
+            Wait for submitted quota messages, control_timeout seconds for all of them together
+
+            Reports one line per gNB, returns the set of trainer UE ids whose control was acknowledged.
+        """
+        done, _ = wait([future for _, future in staged], timeout=self.control_timeout)
+        applied = set()
+        for control, future in staged:
+            if future not in done:
+                # The message may still complete, but measurement will not wait for it
+                print(f"  ✗ Control message timed out: UE {control['ue']} on gNB{control['gnb']}")
+            elif future.exception() is not None:
+                print(f"  ✗ Control message failed: UE {control['ue']} on gNB{control['gnb']}: {future.exception()!r}")
+            else:
+                applied.add(control["ue"])
+        by_gnb = {}
+        for control, _ in staged:
+            by_gnb.setdefault((control["gnb"], control["e2_node_id"]), []).append(control["ue"])
+        for (gnb, e2_node_id), ues in sorted(by_gnb.items()):
+            print(f"  gNB{gnb} ({e2_node_id}): applied {sorted(set(ues) & applied)} of {ues}")
+        return applied
+
+    def dispatch_controls(self, controls):
+        """
+            Send the PRB quota of every UE of an allocation concurrently
+
+            Messages are grouped by E2 node (one per gNB) for reporting; all of them together are
+            waited on for at most control_timeout seconds. Returns the set of trainer UE ids whose
+            control was acknowledged.
+        """
+        staged = self.stage_controls(controls)
+        return self.collect_controls([entry for gnb_staged in staged.values() for entry in gnb_staged])
+
+    def start_gnb_measurement(self, gnb):
+        # Control loop only. Pipelined: the quotas of this gNB must be in place before its traffic starts
+        if self.pipelined:
+            self.applied_ues |= self.collect_controls(self.staged.pop(gnb, []))
+        self.current_gnb = gnb
+        file_protocol.write_json(self.paths["ue_id"], {"gnb": gnb})
+
+    def result_items(self, rows):
+        return [{
+            "id": int(ue_id),
+            "dl_thp": dl_thp,
+            # 95% confidence half-width / mean of the traffic reports, None below 2 reports. It is the
+            # uncertainty of that mean, which is dl_thp only with estimator "mean" (top3 reads higher)
+            "ci_rel_mean": ci_rel,
+            "reports": reports,  # Traffic reports in the window
+            "applied": int(ue_id) in self.applied_ues, # PRB quota acknowledged for this step
+            "gnb": gnb,
+        } for ue_id, dl_thp, ci_rel, reports, gnb in rows]
+
+    @staticmethod
+    def parse_alloc_item(item):
+        # (trainer id, min, max, dedicated PRB ratio) of one alloc.json item, None if malformed
+        try:
+            ratios = [int(item.get(f"{name}_ratio", item.get(name))) for name in ("min_prb", "max_prb", "ded_prb")]
+            ue = int(item["id"])
+        except (KeyError, TypeError, ValueError, AttributeError):
+            return None
+        if not all(0 <= ratio <= 100 for ratio in ratios):
+            return None
+        return (ue, *ratios)
 
     def write_ue_id_to_file(self, ue_id):
-        with open("/opt/xApps/ue_id.json", "w") as file:
-            json.dump({"ue_id": ue_id}, file)
+        file_protocol.write_json(self.paths["ue_id"], {"ue_id": ue_id})
 
     def clear_ue_id_file(self):
-        with open("/opt/xApps/ue_id.json", "w") as file:
-            file.write("")
+        file_protocol.write_json(self.paths["ue_id"], {})
+
+    def window_estimate(self, samples):
+        """
+            Throughput estimate of one UE's measurement window, None while it should keep running
+
+            The window ends as soon as at least min_reports traffic reports give a 95% confidence
+            half-width (Student-t) within ci_target of their mean, when the traffic stops after at
+            least min_reports traffic reports, at max_reports traffic reports, or after max_reports
+            reports in total (no or too little traffic).
+            Returns (DL throughput, relative half-width of the mean or None, traffic reports); the
+            throughput is the average of the (up to) 3 highest traffic reports (as before adaptive
+            windows) or, with estimator "mean", the mean the half-width refers to.
+        """
+        traffic = [dl for dl in samples if dl >= IDLE_THRESHOLD]
+        active = traffic[WARMUP_REPORTS:] or traffic
+        n = len(active)
+        mean = sum(active) / n if n else 0.
+        ci_rel = None
+        if n >= 2 and mean > 0:
+            std = (sum((dl - mean) ** 2 for dl in active) / (n - 1)) ** 0.5
+            ci_rel = file_protocol.t_quantile_975(n - 1) * std / n ** 0.5 / mean
+
+        converged = ci_rel is not None and n >= self.min_reports and ci_rel <= self.ci_target
+        stopped = len(traffic) >= self.min_reports and samples[-1] < IDLE_THRESHOLD
+        if converged or stopped or n >= self.max_reports or len(samples) >= self.max_reports:
+            if self.estimator == "top3":
+                top = sorted(traffic, reverse=True)[:3]
+                return (sum(top) / len(top) if top else 0.), ci_rel, n
+            return mean, ci_rel, n
+        return None
 
     def my_subscription_callback(self, e2_agent_id, subscription_id, indication_hdr, indication_msg, kpm_report_style, ue_id):
         if self.initilization:
@@ -49,54 +203,46 @@ class MyXapp(xAppBase):
                 # Track when current user finishes transfer
                 if self.current_user_id is not None and self.current_user_id == ue_id:
                     if dl < 3 and self.initial_detection:
-                        self.finished_transfer = True
+                        self.transfer_finished.set()
 
         if self.log:
             meas_data = self.e2sm_kpm.extract_meas_data(indication_msg)
             for ue_id, ue_meas_data in meas_data["ueMeasData"].items():
-                # Check if UE belongs to current gNB and slice being tested
-                if ue_id in self.slice_group[self.slice]:
-                    if self.counter > 0 or self.ue_dict[ue_id]["store"]:
+                # Check if UE belongs to the gNB being tested
+                # (none while the control loop prepares the next gNB)
+                if self.current_gnb is not None and ue_id in self.gnb_slice_ue_mapping[self.current_gnb] and ue_id in self.ue_dict:
+                    if self.ue_dict[ue_id]["store"]:
                         dl = ue_meas_data["measData"]["DRB.UEThpDl"][0]
                         self.ue_dict[ue_id]["dl_thp"].append(dl)
-                        if self.counter < 0 and dl < 3:
+                        estimate = self.window_estimate(self.ue_dict[ue_id]["dl_thp"])
+                        if estimate is not None:
                             self.ue_dict[ue_id]["store"] = False
-                            
-                            # Find the top 3 values in self.ue_dict[ue_id]["dl_thp"] and average them
-                            average_top_3 = sum(sorted(self.ue_dict[ue_id]["dl_thp"], reverse=True)[:3]) / 3
+                            dl_thp, ci_rel, reports = estimate
                             key = next((k for k, v in self.user_map.items() if v == ue_id), None)
-                            self.result.append([key, average_top_3])
-                            print(f"UE {key} (E2_ID: {ue_id}), gNB{self.current_gnb}, Avg DL Thp: {average_top_3:.2f} Mbps")
+                            self.result.append([key - UE_NUMBER_OFFSET, dl_thp, ci_rel, reports, self.current_gnb])
+                            ci_text = f"mean ±{ci_rel:.1%}" if ci_rel is not None else "no CI"
+                            print(f"UE {key} (E2_ID: {ue_id}), gNB{self.current_gnb}, Avg DL Thp: {dl_thp:.2f} ({ci_text}, {reports} reports)")
 
                             self.remaining_cnt -= 1
+                            self.gnb_remaining[self.current_gnb] -= 1
                             
-                            if self.remaining_cnt % 3 == 0:
-                                # Check next gNB
-                                if self.current_gnb < 3:  # Testing with 3 gNBs
-                                    self.current_gnb += 1
-                                    
-                                self.counter = 10
-                                with open("/opt/xApps/ue_id.json", "w") as file:
-                                    json.dump({
-                                        "gnb": self.current_gnb
-                                    }, file)
-                                print(f"Switching to gNB{self.current_gnb}")
-
-            self.counter -= 1
+                            if self.remaining_cnt > 0 and self.gnb_remaining[self.current_gnb] == 0:
+                                # Every UE of this gNB is measured: the control loop starts the next
+                                # gNB with UEs in the allocation
+                                next_gnb = min(g for g, n in self.gnb_remaining.items() if n > 0)
+                                self.current_gnb = None
+                                self.gnb_requests.put(next_gnb)
+                                print(f"Switching to gNB{next_gnb}")
 
             if self.remaining_cnt == 0:
                 print("=== All UEs are done ===")
                 self.log = False
                 self.clear_ue_id_file()
-                with open("/opt/xApps/res.json", "w") as file:
-                    data = []
-                    for ue_id, ue_data in self.result:
-                        data.append({
-                            "id": int(ue_id),
-                            "dl_thp": ue_data,
-                        })
-                    json.dump(data, file)
-                    print(f"Results saved")
+                # Results carry the sequence number of the allocation they were measured for
+                file_protocol.write_json(self.paths["res"], self.result_items(self.result), seq=self.alloc_seq)
+                print(f"Results saved")
+                self.measurement_done.set()
+                self.gnb_requests.put(None)
                             
 
     @xAppBase.start_function
@@ -138,9 +284,9 @@ class MyXapp(xAppBase):
             # Reset detection variables
             self.current_user = user
             self.current_user_id = None
-            self.finished_transfer = False
             self.initial_detection = False
             self.ue_candidates = {}  # Clear candidates for this UE
+            self.transfer_finished.clear()
             
             # Signal traffic generator to start traffic for this UE
             self.write_ue_id_to_file(user+1)
@@ -149,22 +295,17 @@ class MyXapp(xAppBase):
             # Wait a bit for traffic to stabilize
             time.sleep(0.5)
             
-            # Wait for UE to be detected (with timeout)
+            # Wait for UE to be detected and finish its transfer (with timeout)
             timeout = 10  # 10 seconds timeout
-            start_time = time.time()
-            
-            while not self.finished_transfer:
-                if time.time() - start_time > timeout:
-                    print(f"WARNING: Timeout waiting for UE {user+1} detection!")
-                    print(f"  Candidates seen: {self.ue_candidates}")
-                    # Try to use the best candidate if available
-                    if self.ue_candidates:
-                        best_candidate = max(self.ue_candidates.items(), 
-                                            key=lambda x: x[1]['total_dl'])
-                        self.current_user_id = best_candidate[0]
-                        print(f"  Using best candidate: {self.current_user_id}")
-                    break
-                time.sleep(0.1)
+            if not self.transfer_finished.wait(timeout):
+                print(f"WARNING: Timeout waiting for UE {user+1} detection!")
+                print(f"  Candidates seen: {self.ue_candidates}")
+                # Try to use the best candidate if available
+                if self.ue_candidates:
+                    best_candidate = max(self.ue_candidates.items(), 
+                                        key=lambda x: x[1]['total_dl'])
+                    self.current_user_id = best_candidate[0]
+                    print(f"  Using best candidate: {self.current_user_id}")
             
             if self.current_user_id is not None:
                 self.user_map[user+1] = self.current_user_id
@@ -196,85 +337,99 @@ class MyXapp(xAppBase):
             3: [self.user_map.get(4), self.user_map.get(5)]
         }
         
+        # Reverse lookup RNTI -> gNB, built once instead of scanning the mapping for every UE
+        self.rnti_to_gnb = {rnti: gnb for gnb, ues in self.gnb_slice_ue_mapping.items() for rnti in ues if rnti is not None}
+        
         print("\n=== gNB-UE Mapping ===")
         for gnb, ues in self.gnb_slice_ue_mapping.items():
             print(f"gNB{gnb}: {ues}")
 
-        with open("/opt/xApps/alloc.json", "r") as file:
-            last_content = json.load(file)
+        alloc_watcher = file_protocol.FileWatcher(self.paths["alloc"])
         self.ue_dict = {}
         self.remaining_cnt = 0
+        self.ready.set()
         
         while self.running:
-            with open("/opt/xApps/alloc.json", "r") as file:
-                current_content = json.load(file)
-                if current_content != last_content:
-                    print("=== New allocation detected ===")
-                    with open("/opt/xApps/res.json", "w") as file:
-                        file.write("")
-                    last_content = current_content
-                    self.result = []
-                    
-                    for item in current_content:
-                        if "version" in item:
-                            continue
-                        ue_logical_id = int(item['id'])
-                        if ue_logical_id not in self.user_map:
-                            print(f"Warning: UE ID {ue_logical_id} not in user_map, skipping")
-                            continue
-                        
-                        # Determine which gNB this UE belongs to
-                        ue_gnb = None
-                        for gnb, ues in self.gnb_slice_ue_mapping.items():
-                            if self.user_map[ue_logical_id] in ues:
-                                ue_gnb = gnb
-                                break
-
-                        if ue_gnb is None:
-                            print(f"Warning: Could not determine gNB for UE {ue_logical_id}")
-                            continue
-
-                        # Get corresponding E2 node ID for gNB
-                        e2_node_id = e2_node_ids[ue_gnb - 1]
-                        
-                        # Configure UE and reset current throughput
-                        self.ue_dict[self.user_map[ue_logical_id]] = {
-                            "dl_thp":[],
-                            "store":True,
-                        }
-                        self.remaining_cnt += 1
-                        
-                        # Apply PRB quota control to specific gNB
-                        print(f"Applying PRB control: UE {ue_logical_id} (RNTI {self.user_map[ue_logical_id]}) on gNB{ue_gnb}")
-                        print(f"  E2 Node: {e2_node_id}, Min: {item['min_prb']}, Max: {item['max_prb']}, Ded: {item['ded_prb']}")
-                        
-                        try:
-                            self.e2sm_rc.control_slice_level_prb_quota(
-                                e2_node_id, 
-                                ue_id=self.user_map[int(item['id'])], 
-                                min_prb_ratio=int(item['min_prb']), 
-                                max_prb_ratio=int(item['max_prb']), 
-                                dedicated_prb_ratio=int(item['ded_prb']), 
-                                ack_request=1
-                            )
-                            print(f"  ✓ Control message sent successfully")
-                        except Exception as e:
-                            print(f"  ✗ Control message failed: {e}")
-                    
-                    # Start with first gNB, first slice and iterate
-                    self.current_gnb = 1
-                    with open("/opt/xApps/ue_id.json", "w") as file:
-                        json.dump({
-                            "gnb": self.current_gnb
-                        }, file)
-                    self.log = True
-                    self.counter = 10
-                    print(f"Starting throughput measurement at gNB{self.current_gnb}...")
-                    
-                    while self.log:
-                        time.sleep(0.3)
+            # Wait (stat polling only) for the next allocation sequence number
+            update = alloc_watcher.wait_for_next(timeout=1.0)
+            if update is None:
+                continue
+            self.alloc_seq, current_content = update
+            print(f"=== New allocation detected (seq {self.alloc_seq}) ===")
+            self.result = []
+            self.remaining_cnt = 0
+            self.gnb_remaining = {gnb: 0 for gnb in self.gnb_slice_ue_mapping}
+            
+            controls = []
+            for item in current_content:
+                if isinstance(item, dict) and "version" in item:
+                    continue
+                parsed = self.parse_alloc_item(item)
+                if parsed is None:
+                    print(f"Warning: malformed allocation item {item}, skipping")
+                    continue
+                ue, min_prb, max_prb, ded_prb = parsed
+                ue_logical_id = ue + UE_NUMBER_OFFSET
+                if ue_logical_id not in self.user_map:
+                    print(f"Warning: UE ID {ue_logical_id} not in user_map, skipping")
+                    continue
+                
+                # Determine which gNB this UE belongs to
+                ue_gnb = self.rnti_to_gnb.get(self.user_map[ue_logical_id])
+                if ue_gnb is None:
+                    print(f"Warning: Could not determine gNB for UE {ue_logical_id}")
+                    continue
+                
+                # Configure UE and reset current throughput
+                self.ue_dict[self.user_map[ue_logical_id]] = {
+                    "dl_thp":[],
+                    "store":True,
+                }
+                self.remaining_cnt += 1
+                self.gnb_remaining[ue_gnb] += 1
+                
+                # PRB quota for the E2 node of this gNB (apply_config writes *_prb_ratio keys)
+                controls.append({
+                    "ue": ue, # Trainer id, reported back in res.json
+                    "rnti": self.user_map[ue_logical_id],
+                    "gnb": ue_gnb,
+                    "e2_node_id": e2_node_ids[ue_gnb - 1],
+                    "min_prb": min_prb,
+                    "max_prb": max_prb,
+                    "ded_prb": ded_prb,
+                })
+            
+            print(f"Applying PRB control for {len(controls)} UEs")
+            if self.pipelined:
+                # Collected gNB by gNB in start_gnb_measurement
+                self.applied_ues = set()
+                self.staged = self.stage_controls(controls)
+            else:
+                self.applied_ues = self.dispatch_controls(controls)
+                print(f"PRB quotas applied for UEs {sorted(self.applied_ues)} before measurement")
+            
+            if self.remaining_cnt == 0:
+                # Nothing measurable (no mapped UE): answer right away instead of blocking the trainer
+                file_protocol.write_json(self.paths["res"], [], seq=self.alloc_seq)
+                continue
 
-            time.sleep(0.3)
+            # Start with the first gNB that has UEs in this allocation and iterate
+            self.current_gnb = None
+            self.measurement_done.clear()
+            self.gnb_requests = queue.Queue()
+            self.log = True
+            self.start_gnb_measurement(min(g for g, n in self.gnb_remaining.items() if n > 0))
+            print(f"Starting throughput measurement at gNB{self.current_gnb}...")
+            
+            # Start the gNBs the callback asks for, back to watching alloc.json as soon as it
+            # has written res.json
+            while self.running and not self.measurement_done.is_set():
+                try:
+                    gnb = self.gnb_requests.get(timeout=WAIT_SLICE)
+                except queue.Empty:
+                    continue
+                if gnb is not None:
+                    self.start_gnb_measurement(gnb)
 
 
 
@@ -286,6 +441,14 @@ if __name__ == '__main__':
     parser.add_argument("--e2_node_ids", type=str, default='gnbd_001_001_000001_0,gnbd_001_001_000002_0,gnbd_001_001_000003_0', help="E2 Node IDs for gNB1, gNB2, gNB3 (comma-separated)")
     parser.add_argument("--ran_func_id", type=int, default=3, help="E2SM RC RAN function ID")
     parser.add_argument("--ue_id", type=int, default=0, help="UE ID")
+    parser.add_argument("--control_workers", type=int, default=4, help="Concurrent RC control messages")
+    parser.add_argument("--control_timeout", type=float, default=2.0, help="Timeout per RC control message in seconds")
+    parser.add_argument("--io_dir", type=str, default=IO_DIR, help="Directory of alloc.json / res.json / ue_id.json")
+    parser.add_argument("--min_reports", type=int, default=MIN_REPORTS, help="Minimum traffic reports per UE measurement")
+    parser.add_argument("--max_reports", type=int, default=MAX_REPORTS, help="Maximum traffic reports per UE measurement")
+    parser.add_argument("--ci_target", type=float, default=CI_TARGET, help="Relative 95%% CI half-width that ends a measurement (0: never early)")
+    parser.add_argument("--estimator", type=str, default=ESTIMATOR, choices=["top3", "mean"], help="Reported DL throughput of a window")
+    parser.add_argument("--pipelined", action="store_true", help="Overlap PRB control of later gNBs with measurement of earlier ones")
 
 
     args = parser.parse_args()
@@ -300,7 +463,10 @@ if __name__ == '__main__':
     print(f"E2 Node IDs: {e2_node_ids}")
 
     # Create MyXapp
-    myXapp = MyXapp(config, args.http_server_port, args.rmr_port)
+    myXapp = MyXapp(config, args.http_server_port, args.rmr_port,
+                    control_workers=args.control_workers, control_timeout=args.control_timeout,
+                    io_dir=args.io_dir, min_reports=args.min_reports, max_reports=args.max_reports,
+                    ci_target=args.ci_target, pipelined=args.pipelined, estimator=args.estimator)
     myXapp.e2sm_rc.set_ran_func_id(ran_func_id)
 
     # Connect exit signals
@@ -0,0 +1,162 @@
+import argparse
+import csv
+import json
+import os
+import time
+
+import numpy as np
+
+import main
+import sweep
+
+# End-to-end time-to-target benchmark of run_experiment configurations
+#   python benchmark_training.py --seeds 3 --budget_steps 20000 --thresholds -80 -70 -60
+# Every (configuration, seed) trains against the simulated InterferenceEnvironment for the same
+# number of timesteps in a fresh process (sweep.run_sweep), so peak RSS is per run. A run reaches
+# a threshold when the mean reward of its last target_window episodes first gets there; the
+# report compares wall-clock time and timesteps to every threshold, throughput and peak memory.
+# Random actions score about -85 per 100-step episode, the best constant action about -52.
+
+DEFAULT_THRESHOLDS = [-80., -70., -60.]
+BUDGET_STEPS = 20000
+
+# Name -> overrides of the benchmark base configuration (a JSON dict of the same form via --configs)
+DEFAULT_CONFIGS = {
+    "ppo_default": {},
+    "ppo_short_rollout": {"n_steps": 512, "n_epochs": 10},
+    "ppo_action_step_8": {"action_step_size": 8},
+    "ppo_4_envs": {"n_envs": 4, "n_steps": 512},
+    "ppo_full_logging": {"log_tier": "full"},
+}
+
+# Benchmark base: simulated backend, scalar logging to a local WandB run, one session of the whole budget
+BASE_CONF = {"backend": "regression", "log_tier": "metrics", "wandb_mode": "offline", "total_sessions": 1}
+
+
+def benchmark_confs(configs: dict, seeds: list, budget_steps: int, thresholds: list, base_conf: dict) -> list:
+    # One run_experiment configuration per (name, seed)
+    return [{**main.DEFAULT_CONF, **base_conf, **overrides,
+             "timesteps_per_session": budget_steps, "reward_thresholds": list(thresholds),
+             "seed": seed, "benchmark_config": name}
+            for name, overrides in configs.items() for seed in seeds]
+
+
+def run_row(row: dict, thresholds: list) -> dict:
+    # Flat per-run record, time_to_target spread over one column pair per threshold
+    record = {"config": row["benchmark_config"], "seed": row["seed"], "status": row["status"],
+              "experiment": row.get("experiment"),
+              "timesteps": row.get("num_timesteps"),
+              "wall_time_s": row.get("wall_time_s"),
+              "train_time_s": row.get("train_time_s"),
+              "steps_per_s": row.get("steps_per_s"),
+              "peak_rss_mb": row.get("peak_rss_mb"),
+              "final_mean_reward": row.get("mean_episode_reward")}
+    reached = row.get("time_to_target") or {}
+    for threshold in thresholds:
+        hit = reached.get(str(threshold))
+        record[f"wall_s_to_{threshold:g}"] = hit["wall_s"] if hit else None
+        record[f"timesteps_to_{threshold:g}"] = hit["timesteps"] if hit else None
+    return record
+
+
+def censored_median(values: list):
+    # Median with unreached runs (None) counted as never, None when fewer than half reached
+    if not values:
+        return None
+    median = float(np.median([np.inf if value is None else value for value in values]))
+    return None if np.isinf(median) else median
+
+
+def summarize(runs: list, thresholds: list) -> dict:
+    """
+        Per configuration: fraction of seeds reaching each threshold, censored medians of the
+        wall time / timesteps to get there, mean throughput and final reward, largest peak RSS
+    """
+    summary = {}
+    for name in dict.fromkeys(run["config"] for run in runs):
+        ok = [run for run in runs if run["config"] == name and run["status"] == "ok"]
+        entry = {"runs": sum(run["config"] == name for run in runs), "ok": len(ok)}
+        for threshold in thresholds:
+            wall = [run[f"wall_s_to_{threshold:g}"] for run in ok]
+            steps = [run[f"timesteps_to_{threshold:g}"] for run in ok]
+            entry[f"reached_{threshold:g}"] = sum(value is not None for value in wall) / len(ok) if ok else None
+            entry[f"median_wall_s_to_{threshold:g}"] = censored_median(wall)
+            entry[f"median_timesteps_to_{threshold:g}"] = censored_median(steps)
+        for key in ["steps_per_s", "final_mean_reward", "wall_time_s"]:
+            values = [run[key] for run in ok if run[key] is not None]
+            entry[f"mean_{key}"] = float(np.mean(values)) if values else None
+        entry["max_peak_rss_mb"] = max((run["peak_rss_mb"] for run in ok), default=None)
+        summary[name] = entry
+    return summary
+
+
+def write_csv(rows: list, path: str) -> None:
+    columns = []
+    for row in rows:
+        columns.extend(key for key in row if key not in columns)
+    with open(path, "w", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def run_benchmark(configs=None, seeds=(0, 1, 2), budget_steps=BUDGET_STEPS, thresholds=DEFAULT_THRESHOLDS,
+                  base_conf=None, threads_per_job=1, max_jobs=None, out_prefix=None) -> dict:
+    """
+        Trains every configuration for every seed and writes <out_prefix>.json, _runs.csv and _summary.csv
+
+        Concurrent runs share the machine, so wall times are only comparable between runs with
+        the same threads_per_job / max_jobs; max_jobs=1 gives the cleanest timings.
+    """
+    configs = DEFAULT_CONFIGS if configs is None else configs
+    base_conf = BASE_CONF if base_conf is None else base_conf
+    os.makedirs(main.EXPERIMENT_ROOT, exist_ok=True)
+    out_prefix = out_prefix or f"{main.EXPERIMENT_ROOT}/benchmark_{time.strftime('%Y%m%d_%H%M%S')}"
+
+    confs = benchmark_confs(configs, list(seeds), budget_steps, thresholds, base_conf)
+    rows = sweep.run_sweep(confs, threads_per_job, max_jobs, f"{out_prefix}_raw.csv", fresh_processes=True)
+    # Runs back in (configuration, seed) order, whatever order they finished in
+    order = {(conf["benchmark_config"], conf["seed"]): k for k, conf in enumerate(confs)}
+    rows.sort(key=lambda row: order[(row["benchmark_config"], row["seed"])])
+    runs = [run_row(row, thresholds) for row in rows]
+    summary = summarize(runs, thresholds)
+
+    report = {"budget_steps": budget_steps, "thresholds": list(thresholds), "seeds": list(seeds),
+              "threads_per_job": threads_per_job, "base_conf": base_conf, "configs": configs,
+              "summary": summary, "runs": runs}
+    with open(f"{out_prefix}.json", "w") as file:
+        json.dump(report, file, indent=4)
+    write_csv(runs, f"{out_prefix}_runs.csv")
+    write_csv([{"config": name, **entry} for name, entry in summary.items()], f"{out_prefix}_summary.csv")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time-to-target training benchmark over run_experiment configurations")
+    parser.add_argument("--configs", type=str, default="", help="JSON dict name -> conf overrides, or path to a JSON file")
+    parser.add_argument("--seeds", type=int, default=3, help="Seeds per configuration (0..n-1)")
+    parser.add_argument("--budget_steps", type=int, default=BUDGET_STEPS, help="Training timesteps per run")
+    parser.add_argument("--thresholds", type=float, nargs="+", default=DEFAULT_THRESHOLDS, help="Mean episode rewards to time")
+    parser.add_argument("--threads_per_job", type=int, default=1, help="CPUs (and torch threads) per run")
+    parser.add_argument("--max_jobs", type=int, default=None, help="Upper bound on concurrent runs")
+    parser.add_argument("--wandb_mode", type=str, default="offline", help="online / offline / disabled")
+    parser.add_argument("--out", type=str, default="", help="Report prefix (default: ./Experiment/benchmark_<time>)")
+    args = parser.parse_args()
+
+    configs = None
+    if args.configs:
+        if os.path.exists(args.configs):
+            with open(args.configs, "r") as file:
+                configs = json.load(file)
+        else:
+            configs = json.loads(args.configs)
+    report = run_benchmark(configs, range(args.seeds), args.budget_steps, args.thresholds,
+                           {**BASE_CONF, "wandb_mode": args.wandb_mode}, args.threads_per_job, args.max_jobs,
+                           args.out or None)
+    for name, entry in report["summary"].items():
+        targets = []
+        for threshold in report["thresholds"]:
+            wall_s, reached = entry[f"median_wall_s_to_{threshold:g}"], entry[f"reached_{threshold:g}"]
+            targets.append(f"{threshold:g}: {'-' if wall_s is None else f'{wall_s:.1f} s'} ({reached or 0:.0%} of seeds)")
+        print(f"{name}: {entry['ok']}/{entry['runs']} ok, {entry['mean_steps_per_s'] or 0:.0f} steps/s, "
+              f"peak {entry['max_peak_rss_mb'] or 0:.0f} MB, time to target {', '.join(targets)}")
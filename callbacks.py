@@ -0,0 +1,196 @@
+import glob
+import json
+import os
+import pickle
+import random
+import time
+import zipfile
+from collections import deque
+
+import numpy as np
+import torch
+from stable_baselines3.common.callbacks import BaseCallback
+
+# Training-only callbacks. Kept out of main.py so importing the simulator (or main itself)
+# does not pull in torch / stable_baselines3 until a run is actually started.
+
+def _simulated_envs(model):
+    # Unwrapped InterferenceEnvironments behind the model's VecEnv (in-process VecEnvs only)
+    vec_env = model.get_env()
+    return [env.unwrapped for env in getattr(vec_env, "envs", []) if hasattr(env.unwrapped, "user_handler")]
+
+def capture_rng_state(model) -> dict:
+    return {
+        "python": random.getstate(),
+        "numpy": np.random.get_state(),
+        "torch": torch.get_rng_state(),
+        "envs": [env.user_handler.rng.get_state() for env in _simulated_envs(model)],
+    }
+
+def restore_rng_state(model, rng_state: dict) -> None:
+    random.setstate(rng_state["python"])
+    np.random.set_state(rng_state["numpy"])
+    torch.set_rng_state(rng_state["torch"])
+    for env, env_state in zip(_simulated_envs(model), rng_state["envs"]):
+        env.user_handler.rng.set_state(env_state)
+
+def save_checkpoint(model, save_file: str, learner_state: dict) -> None:
+    """
+        Save model + learner state so the run can be resumed from this point
+
+        The model zip is written to a temporary name and renamed, then the sidecar
+        <save_file>.state.pkl is written the same way. A checkpoint is only considered
+        consistent once its sidecar exists.
+    """
+    model.save(save_file + ".tmp.zip")
+    os.replace(save_file + ".tmp.zip", save_file + ".zip")
+
+    state = dict(learner_state)
+    state["num_timesteps"] = model.num_timesteps
+    state["rng"] = capture_rng_state(model)
+    with open(save_file + ".state.tmp", "wb") as file:
+        pickle.dump(state, file)
+    os.replace(save_file + ".state.tmp", save_file + ".state.pkl")
+
+def find_latest_checkpoint(path: str):
+    """
+        Latest consistent checkpoint of an experiment folder (periodic and session models)
+
+        Returns (model zip path, learner state) or (None, None)
+    """
+    candidates = glob.glob(os.path.join(path, "checkpoints", "*.state.pkl")) + \
+                 glob.glob(os.path.join(path, "*.state.pkl"))
+    latest, latest_state = None, None
+    for sidecar in candidates:
+        model_file = sidecar[:-len(".state.pkl")] + ".zip"
+        if not os.path.exists(model_file) or not zipfile.is_zipfile(model_file):
+            continue
+        try:
+            with open(sidecar, "rb") as file:
+                state = pickle.load(file)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            continue
+        if latest_state is None or state["num_timesteps"] > latest_state["num_timesteps"]:
+            latest, latest_state = model_file, state
+    return latest, latest_state
+
+def write_run_state(path: str, run_state: dict) -> None:
+    # Session index and wandb run id of an experiment, rewritten atomically
+    with open(os.path.join(path, "run_state.json.tmp"), "w") as file:
+        json.dump(run_state, file, indent=4)
+    os.replace(os.path.join(path, "run_state.json.tmp"), os.path.join(path, "run_state.json"))
+
+def read_run_state(path: str) -> dict:
+    with open(os.path.join(path, "run_state.json"), "r") as file:
+        return json.load(file)
+
+
+class CheckpointCallback(BaseCallback):
+    """
+    Custom callback for saving a model every N steps.
+
+    With replay_path set (off-policy models) the replay buffer snapshot is rewritten first,
+    so the latest checkpoint always resumes with the transitions collected up to it.
+    """
+    def __init__(self, save_freq: int, save_path: str, replay_path=None, verbose: int = 0):
+        super().__init__(verbose)
+        self.save_freq = save_freq
+        self.save_path = save_path
+        self.replay_path = replay_path
+        # Position in the session loop, stored with every checkpoint for resuming
+        self.session = 0
+        self.session_start_timesteps = 0
+
+    def learner_state(self) -> dict:
+        return {"n_calls": self.n_calls,
+                "session": self.session,
+                "session_start_timesteps": self.session_start_timesteps}
+
+    def _on_step(self) -> bool:
+        # Save the model periodically (not every single step, which is too much I/O)
+        if self.n_calls % self.save_freq == 0:
+            save_file = os.path.join(self.save_path, f"model_step_{self.n_calls}")
+            if self.replay_path is not None:
+                self.model.replay_buffer.save(self.replay_path)
+            save_checkpoint(self.model, save_file, self.learner_state())
+            if self.verbose > 0:
+                print(f"Saved model to {save_file}")
+        return True
+
+
+class QoSLoggingCallback(BaseCallback):
+    """
+    Logs the streaming QoS statistics of all environments (qos_stats.QoSStats) every N calls.
+    """
+    def __init__(self, log_freq: int, verbose: int = 0):
+        super().__init__(verbose)
+        self.log_freq = log_freq
+
+    def log_qos(self) -> None:
+        # Lifetime statistics of every environment, merged (env_method also reaches subprocess envs)
+        stats = self.training_env.env_method("qosStats")
+        merged = stats[0]
+        for other in stats[1:]:
+            merged.merge(other)
+        for name, value in merged.scalars().items():
+            self.logger.record(name, value)
+
+    def _on_step(self) -> bool:
+        if self.n_calls % self.log_freq == 0:
+            self.log_qos()
+        return True
+
+
+class MemoryCallback(BaseCallback):
+    """
+    Takes a mem_instrument.MemoryInstrument snapshot every N calls.
+    """
+    def __init__(self, instrument, snapshot_freq: int, verbose: int = 0):
+        super().__init__(verbose)
+        self.instrument = instrument
+        self.snapshot_freq = snapshot_freq
+
+    def _on_step(self) -> bool:
+        if self.n_calls % self.snapshot_freq == 0:
+            record = self.instrument.snapshot(f"step_{self.num_timesteps}", self.model)
+            if self.verbose > 0:
+                print(f"RSS {record['rss_mb']:.1f} MB (+{record['rss_growth_mb']:.1f} MB since start)")
+        return True
+
+
+class TimeToTargetCallback(BaseCallback):
+    """
+    Records when the mean reward of the last `window` episodes first reaches each threshold.
+    """
+    def __init__(self, thresholds, window: int = 20, start_time=None, verbose: int = 0):
+        super().__init__(verbose)
+        self.thresholds = sorted(thresholds)
+        self.window = window
+        self.start_time = time.time() if start_time is None else start_time # Wall clock counts from here
+        self.rewards = deque(maxlen=window)
+        self.episodes = 0
+        self.reached = {}
+
+    def results(self) -> dict:
+        # {threshold: {"timesteps", "wall_s", "episodes"} or None if never reached}
+        return {str(threshold): self.reached.get(threshold) for threshold in self.thresholds}
+
+    def _on_step(self) -> bool:
+        # Monitor adds "episode" to the info of the step that ends an episode
+        for info in self.locals["infos"]:
+            if "episode" in info:
+                self.rewards.append(info["episode"]["r"])
+                self.episodes += 1
+        if len(self.rewards) < self.window:
+            return True
+        mean_reward = float(np.mean(self.rewards))
+        for threshold in self.thresholds:
+            if threshold not in self.reached and mean_reward >= threshold:
+                self.reached[threshold] = {"timesteps": self.num_timesteps,
+                                           "wall_s": time.time() - self.start_time,
+                                           "episodes": self.episodes}
+                self.logger.record(f"time_to_target/{threshold:g}_wall_s", self.reached[threshold]["wall_s"])
+                if self.verbose > 0:
+                    print(f"Mean reward {mean_reward:.1f} >= {threshold:g} after {self.num_timesteps} steps "
+                          f"({self.reached[threshold]['wall_s']:.1f} s)")
+        return True
@@ -1,21 +1,42 @@
-import itertools
+import copy
+
 import gymnasium as gym
 from gymnasium import spaces
 import numpy as np
-import tqdm
 
 from utilities import Config # Number of UEs, positions, gNB
 from user import UsersHandler # Traffic generator + channel/path-loss source for UEs
-from apply_config import apply_config
+from apply_config import apply_config, prb_to_ratio
+import apply_config as apply_config_module # PRB ratio constants, read when the key is built
+import sim_kernel
+import utilities
+import trace_replay
+import action_table
+import scenarios
+from qos_stats import QoSStats
+from phy_model import PhyModel
+from sim_kernel import ratio_to_prb
 
 # Preliminary execution: source ./rl_env/bin/activate
 
+TOTAL_PRB = 52
+MIN_USER_PRB = 8 # Minimum amount of PRBs to be allocated and remain connected
+INTERFERENCE_PRB_THRESHOLD = 30 # Change depending on interference pattern
+
 class InterferenceEnvironment(gym.Env):
-    def __init__(self, global_config: Config) -> None:
+    def __init__(self, global_config: Config, reduce_actions=False) -> None:
         super(InterferenceEnvironment, self).__init__()
         self.gc = global_config
         self.user_handler = UsersHandler(self.gc)
         self.user_handler.initUsers()
+        self.phy_model = PhyModel(self.gc) # Gain / PRB overlap model for the SINR backend
+        # Memory-mapped scenario dataset replayed by reset() (Config.scenario_path)
+        self.scenarios = scenarios.load_scenario_set(self.gc.scenario_path, self.gc) if self.gc.scenario_path else None
+        self.next_scenario = 0
+        # Streaming QoS statistics: current episode, and everything before it (see qosStats)
+        self.qos_episode = QoSStats(self.gc)
+        self.qos_total = QoSStats(self.gc)
+        self.user_gnb = [(u["user_id"], u["gnb_id"]) for u in self.gc.user_scenarios]
 
         # Define State Space
         _, self.state = self.getState() # determine how much data environment returns
@@ -23,9 +44,37 @@ class InterferenceEnvironment(gym.Env):
         self.observation_space = spaces.Box(low=0, high=10, shape=(obs_shape,))
 
         # Action Space - create list of all possible valid resource allocations
-        self.createActionList()
+        # (built once per parameter set and shared read-only between processes, see action_table)
+        tables = action_table.load_or_build(self.actionTableParams(reduce_actions),
+                                            lambda: self.buildActionTables(reduce_actions))
+        for name, table in tables.items():
+            setattr(self, name, table)
+        self.action_reduction_ratio = len(self.action_representatives) / len(self.actions_list)
         self.action_space = spaces.Discrete(len(self.actions_list))
 
+    def actionTableParams(self, reduce_actions=False) -> dict:
+        # Everything the action tables depend on (cache key)
+        return {"max_prb": self.gc.action_max_prb, "min_prb": self.gc.action_min_prb,
+                "step_size": self.gc.action_step_size, "reduce_actions": bool(reduce_actions),
+                "topology": {"total_prb": TOTAL_PRB, "min_user_prb": MIN_USER_PRB,
+                             "interference_threshold": INTERFERENCE_PRB_THRESHOLD,
+                             "prb_per_gnb": utilities.PRB_PER_GNB,
+                             # prb_to_ratio floor and carrier size, they decide the action classes
+                             "min_prb_ratio": apply_config_module.MIN_PRB_RATIO,
+                             "ratio_total_prbs": apply_config_module.TOTAL_PRBS_PER_GNB,
+                             "users": [[u["user_id"], u["gnb_id"]] for u in self.gc.user_scenarios]}}
+
+    def buildActionTables(self, reduce_actions=False) -> dict:
+        self.createActionList()
+        self.computeActionClasses()
+        if reduce_actions:
+            # Keep one representative per class, the remaining actions are unreachable duplicates
+            self.actions_list = self.actions_list[self.action_representatives]
+            self.computeActionClasses()
+        return {"actions_list": self.actions_list, "action_prbs": self.action_prbs,
+                "action_representatives": self.action_representatives,
+                "action_class": self.action_class, "action_mask": self.action_mask}
+
     # Define all possible ways the bandwidth can be split between users
     # Output: single integer index mapping to one of the valid splits
     def createActionList(self):
@@ -42,36 +91,80 @@ class InterferenceEnvironment(gym.Env):
             1. Minimum 8 PRBs per active user (User 0, 1, 2, 3, 4)
             2. Total PRBs per gNB <= 52
         """
-        self.actions_list = []
-
         # Step size
             # step = 1 --> ~500,000 actions
             # step = 2 --> ~36,000 actions
             # step = 4 --> ~3,000 actions
-        step_size = 4
+        # Valid splits per virtual gNB: UE mins 8, UE max 44 to keep all UEs connected,
+        # combined as gNB2 (u1, u2) x gNB3 (u3, u4) -> int array (N, 4)
+        self.actions_list = action_table.action_list(self.gc.action_max_prb, self.gc.action_min_prb,
+                                                     self.gc.action_step_size)
 
-        max_prb = 52
-        min_prb = 8
-        
-        # Valid Splits for Virtual gNB2
-            # UE mins: 8, UE max: 44 to keep all UEs connected
-        gnb2_splits = []
-        for u1 in range(min_prb, max_prb - min_prb + 1, step_size):
-            remaining_for_u2 = max_prb - u1
-            for u2 in range(min_prb, remaining_for_u2 + 1, step_size):
-                gnb2_splits.append((u1, u2))
-       
-        # Valid Splits for Virtual gNB3
-        gnb3_splits = []
-        for u4 in range(min_prb, max_prb - min_prb + 1, step_size):
-            remaining_for_u5 = max_prb - u4
-            for u5 in range(min_prb, remaining_for_u5 + 1, step_size):
-                gnb3_splits.append((u4, u5))
-
-        # Combine gNB2 and gNB3 splits
-        combined_splits = list(itertools.product(gnb2_splits, gnb3_splits))
-        self.actions_list = [x[0] + x[1] for x in combined_splits]
-        
+    def decodeActions(self, action_indices=None):
+        """
+            Batched decodeActionAndCalcInterference
+
+            Returns PRBs per user as an int array (N, 5) ordered [User0, ..., User4]
+        """
+        actions = np.asarray(self.actions_list, dtype=int)
+        if action_indices is not None:
+            actions = actions[action_indices]
+        gnb2_interference = np.maximum(0, actions[:, 0] + actions[:, 1] - INTERFERENCE_PRB_THRESHOLD)
+        gnb3_interference = np.maximum(0, actions[:, 2] + actions[:, 3] - INTERFERENCE_PRB_THRESHOLD)
+        u0 = np.maximum(MIN_USER_PRB, TOTAL_PRB - gnb2_interference - gnb3_interference)
+        return np.column_stack([u0, actions])
+
+    def computeActionClasses(self):
+        """
+            Group actions that emit the same configuration
+
+            Two actions are equivalent when, after the User 0 clamp in decodeActionAndCalcInterference,
+            the integer percent conversion in apply_config and the PRB re-truncation in process_tasks,
+            every user ends up with the same allocation.
+        """
+        self.action_prbs = ratio_to_prb(prb_to_ratio(self.decodeActions()))
+        _, self.action_representatives, self.action_class = np.unique(
+            self.action_prbs, axis=0, return_index=True, return_inverse=True)
+        self.action_class = self.action_class.reshape(-1)
+        self.action_representatives = np.sort(self.action_representatives)
+        self.action_mask = np.zeros(len(self.actions_list), dtype=bool)
+        self.action_mask[self.action_representatives] = True
+
+    def evaluateActions(self, action_indices=None) -> sim_kernel.StepResult:
+        """
+            Score actions against the current traffic demands without stepping the environment
+
+            Runs the simulated throughput model and the reward of UsersHandler.calculateReward for
+            every action (or the given subset) in one batched kernel call. Nothing is written to
+            disk and no environment state changes. Returns a StepResult with arrays shaped
+            (N, 5) per user and (N,) for the total reward. With the replay backend actions are
+            scored on the mean replayed throughput (no measurement noise), with the SINR backend
+            on the current UE positions.
+        """
+        prbs = self.action_prbs if action_indices is None else self.action_prbs[action_indices]
+        tasks = sorted(self.user_handler.task_queue, key=lambda x: x["user_id"])
+        arrays = sim_kernel.task_arrays(tasks)
+        tpt_bps = None
+        backend = self.gc.io.resolve_backend()
+        if backend == "replay":
+            model = trace_replay.load_replay_model(self.gc.io.replay_table_path)
+            tpt_bps = model.throughput(prbs, arrays["gnb_ids"], noise=False)
+        elif backend == "sinr":
+            positions = np.array([[task["position"]["x"], task["position"]["y"]] for task in tasks])
+            tpt_bps = self.phy_model.throughput(prbs, arrays["gnb_ids"], positions)
+        return sim_kernel.execute_and_reward(prbs, arrays["gnb_ids"], arrays["categories"], arrays["demand"],
+                                             arrays["gen_freq"], utilities.DATA_GATHERING_DURATION,
+                                             self.gc.ue_task_gen_spec["URLLC"]["send_ms"], tpt_bps=tpt_bps)
+
+    def bestAction(self):
+        # Oracle allocation for the current state: (action index, reward)
+        rewards = self.evaluateActions().reward
+        best = int(np.argmax(rewards))
+        return best, float(rewards[best])
+
+    def action_masks(self):
+        # Mask of representative actions (MaskablePPO convention)
+        return self.action_mask
 
     def getState(self, continue_flag=True):
         state = []
@@ -119,16 +212,16 @@ class InterferenceEnvironment(gym.Env):
     def decodeActionAndCalcInterference(self, action_idx):
         # createActionList combines gnb2 (u1, u2) and gnb3 (u3, u4)
         # tuple structure = (u1, u2, u3, u4)
-        u1, u2, u3, u4 = self.actions_list[action_idx]
+        u1, u2, u3, u4 = (int(prb) for prb in self.actions_list[action_idx])
         
         # 2. Calculate gNB1 (User 0) remaining PRBs
         gnb2_prbs_used = u1 + u2
         gnb3_prbs_used = u3 + u4
-        gnb2_interference = max(0, gnb2_prbs_used - 30) # Change "30" depending on interference pattern
-        gnb3_interference = max(0, gnb3_prbs_used - 30) # Change "30" depending on interference pattern
+        gnb2_interference = max(0, gnb2_prbs_used - INTERFERENCE_PRB_THRESHOLD)
+        gnb3_interference = max(0, gnb3_prbs_used - INTERFERENCE_PRB_THRESHOLD)
 
-        u0_available = 52 - gnb2_interference - gnb3_interference
-        u0 = max(8, u0_available) # 8 is minimum amount of PRBs to be allocated and remain connected
+        u0_available = TOTAL_PRB - gnb2_interference - gnb3_interference
+        u0 = max(MIN_USER_PRB, u0_available)
         
         # Format for apply_config
         # Map specific Users to their PRB counts
@@ -139,29 +232,57 @@ class InterferenceEnvironment(gym.Env):
         }
         return allocation_dict
 
+    def qosStats(self) -> QoSStats:
+        # Lifetime statistics including the running episode (a copy, safe to merge)
+        return copy.deepcopy(self.qos_total).merge(self.qos_episode)
+
     def reset(self, seed=None, options=None):
-        self.user_handler.initUsers()
+        super().reset(seed=seed)
+        info = {}
+        if self.qos_episode.steps:
+            # Summary of the episode that just ended, then start a new one
+            info["qos_episode"] = self.qos_episode.summary()
+            self.qos_total.merge(self.qos_episode)
+            self.qos_episode.reset()
+        if seed is not None:
+            self.user_handler.seed(seed)
+        if self.scenarios is not None:
+            # Scenario options["scenario"], else seed % n_scenarios, else the next one in order
+            k = (options or {}).get("scenario")
+            if k is None:
+                k = seed if seed is not None else self.next_scenario
+            k %= len(self.scenarios)
+            self.next_scenario = k + 1
+            self.user_handler.loadScenario(self.scenarios, k)
+            info["scenario"] = k
+        else:
+            self.user_handler.initUsers()
         #self.userHandler.user_initialize()
         continue_flag, self.state = self.getState()
         # Convert state dictionary to numpy array
-        return self.state, {}
+        return self.state, info
 
     def step(self, action):
         # CHANGED: Use the new decoder
         action_dict = self.decodeActionAndCalcInterference(action)
         
-        apply_config(action_dict, self.path_loss_config)
-        reward = self.user_handler.executeTasks()
+        apply_config(action_dict, self.path_loss_config, io=self.gc.io)
+        reward = self.user_handler.executeTasks(phy=self.phy_model)
+        info = self.user_handler.stepInfo()
+        prb = [action_dict[gnb_id][user_id] for user_id, gnb_id in self.user_gnb]
+        info.update(self.qos_episode.update(info, prb))
         continue_flag, self.state = self.getState()
         
         # Standard Gym Return
-        return self.state, reward, not continue_flag, False, {}
+        return self.state, reward, not continue_flag, False, info
     
     def render(self, mode='human'):
         # Render the environment (optional)
         pass
         
 if __name__ == '__main__':
+    import tqdm
+
     env = InterferenceEnvironment(Config())
     for i in tqdm.tqdm(range(5000)):
         env.reset()
@@ -0,0 +1,160 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+from gymnasium.vector import AsyncVectorEnv, SyncVectorEnv
+
+import utilities
+from file_protocol import t_quantile_975
+from environment import InterferenceEnvironment
+from utilities import Config
+
+# Batched multi-seed evaluation of a saved PPO checkpoint
+#   python evaluate.py --checkpoint ./Experiment/1/model_session_9.zip --seeds 5 --episodes 20 --n_envs 10
+
+EPISODE_STEPS = 100 # Same episode length as training (TimeLimit in run_experiment)
+
+
+def make_env(rank, io=None, scenario_path=None):
+    io = utilities.IOContext.from_globals() if io is None else io
+    def _init():
+        # Every env simulates through its own allocation file, in-process or in a worker
+        config = Config()
+        config.io = io.worker(f"eval_{rank}")
+        config.scenario_path = scenario_path # reset seed k -> scenario k % n_scenarios
+        # No TimeLimit: episodes are cut by the harness, so the vector env never autoresets mid-wave
+        return InterferenceEnvironment(config)
+    return _init
+
+
+def load_policy(checkpoint, device="cpu"):
+    # Imported lazily so building environments never requires torch
+    from stable_baselines3 import PPO
+    return PPO.load(checkpoint, device=device)
+
+
+def confidence_interval(values):
+    # 95% Student-t interval of the mean, the sample counts here (seeds x episodes) are small
+    values = np.asarray(values, dtype=float)
+    mean = float(values.mean())
+    if len(values) < 2:
+        return mean, [mean, mean]
+    half_width = float(t_quantile_975(len(values) - 1) * values.std(ddof=1) / np.sqrt(len(values)))
+    return mean, [mean - half_width, mean + half_width]
+
+
+def evaluate_checkpoint(checkpoint, n_seeds=5, n_episodes=10, n_envs=8, episode_steps=EPISODE_STEPS,
+                        deterministic=True, parallel=False, base_seed=0, model=None, scenario_path=None) -> dict:
+    """
+        Runs n_seeds x n_episodes episodes of a checkpoint over a vector of environments
+
+        Episodes are scheduled in waves of n_envs, every env gets an explicit reset seed so a
+        given (seed, episode) pair always replays the same traffic. Observations of all envs are
+        batched into one policy.predict call per step. With scenario_path the seeds index a
+        pre-generated scenario dataset (scenarios.py) instead of seeding fresh draws.
+    """
+    import torch
+
+    if model is None:
+        model = load_policy(checkpoint)
+    config = Config()
+    categories = [scenario["type"] for scenario in config.user_scenarios]
+    user_ids = [scenario["user_id"] for scenario in config.user_scenarios]
+    n_users = len(user_ids)
+
+    episode_seeds = [base_seed + m * n_episodes + k for m in range(n_seeds) for k in range(n_episodes)]
+    n_envs = max(1, min(n_envs, len(episode_seeds)))
+    env_fns = [make_env(rank, config.io, scenario_path) for rank in range(n_envs)]
+    envs = AsyncVectorEnv(env_fns, context="spawn") if parallel else SyncVectorEnv(env_fns)
+
+    returns = []
+    reward_per_user = np.zeros(n_users)
+    shortfall = np.zeros(n_users)
+    delivery = np.zeros(n_users)
+    samples = 0
+    start = time.perf_counter()
+    try:
+        for wave_start in range(0, len(episode_seeds), n_envs):
+            wave_seeds = episode_seeds[wave_start:wave_start + n_envs]
+            # Pad the last wave with extra episodes that are simulated but not reported
+            active = len(wave_seeds)
+            wave_seeds = wave_seeds + [wave_seeds[-1]] * (n_envs - active)
+            obs, _ = envs.reset(seed=wave_seeds)
+            episode_return = np.zeros(n_envs)
+            for _ in range(episode_steps):
+                with torch.inference_mode():
+                    actions, _ = model.predict(obs, deterministic=deterministic)
+                obs, rewards, _, _, infos = envs.step(actions)
+                episode_return += rewards
+
+                # eMBB: fraction of the requested rate not delivered; mMTC: fraction of bytes delivered in time
+                demand = infos["demand"][:active]
+                bit_rate = infos["bit_rate"][:active]
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    shortfall += np.clip((demand - bit_rate) / demand, 0., 1.).sum(axis=0)
+                    delivery += np.clip(utilities.DATA_GATHERING_DURATION * 1000 / infos["duration"][:active], 0., 1.).sum(axis=0)
+                reward_per_user += infos["reward_per_user"][:active].sum(axis=0)
+                samples += active
+            returns.extend(episode_return[:active].tolist())
+    finally:
+        envs.close()
+    elapsed = time.perf_counter() - start
+
+    mean, ci = confidence_interval(returns)
+    per_seed = {}
+    for m in range(n_seeds):
+        seed_returns = returns[m * n_episodes:(m + 1) * n_episodes]
+        seed_mean, seed_ci = confidence_interval(seed_returns)
+        per_seed[base_seed + m * n_episodes] = {"mean_return": seed_mean, "ci95": seed_ci}
+
+    per_user = {}
+    for idx, (user_id, category) in enumerate(zip(user_ids, categories)):
+        qos = {"category": category, "mean_reward": float(reward_per_user[idx] / samples)}
+        if category.startswith("eMBB"):
+            qos["rate_shortfall"] = float(shortfall[idx] / samples)
+        elif category.startswith("mMTC"):
+            qos["delivery_ratio"] = float(delivery[idx] / samples)
+        per_user[user_id] = qos
+
+    return {
+        "checkpoint": checkpoint,
+        "deterministic": deterministic,
+        "seeds": n_seeds,
+        "episodes_per_seed": n_episodes,
+        "episode_steps": episode_steps,
+        "mean_return": mean,
+        "std_return": float(np.std(returns)),
+        "ci95": ci,
+        "per_seed": per_seed,
+        "per_user": per_user,
+        "wall_time_s": elapsed,
+        "steps_per_s": samples / elapsed,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluate a PPO checkpoint over several seeds and episodes")
+    parser.add_argument("--checkpoint", type=str, required=True, help="Path to a saved PPO model (.zip)")
+    parser.add_argument("--seeds", type=int, default=5, help="Number of seeds (M)")
+    parser.add_argument("--episodes", type=int, default=10, help="Episodes per seed (K)")
+    parser.add_argument("--n_envs", type=int, default=8, help="Environments stepped in one batch")
+    parser.add_argument("--episode_steps", type=int, default=EPISODE_STEPS, help="Steps per episode")
+    parser.add_argument("--base_seed", type=int, default=0, help="First episode seed")
+    parser.add_argument("--parallel", action="store_true", help="Step environments in worker processes")
+    parser.add_argument("--stochastic", action="store_true", help="Sample actions instead of taking the greedy one")
+    parser.add_argument("--scenarios", type=str, default=None, help="Scenario dataset from scenarios.py (.npz)")
+    parser.add_argument("--out", type=str, default="", help="Output JSON (default: next to the checkpoint)")
+    args = parser.parse_args()
+
+    utilities.PRE_TRAIN = True
+    report = evaluate_checkpoint(args.checkpoint, n_seeds=args.seeds, n_episodes=args.episodes, n_envs=args.n_envs,
+                                 episode_steps=args.episode_steps, deterministic=not args.stochastic,
+                                 parallel=args.parallel, base_seed=args.base_seed, scenario_path=args.scenarios)
+
+    out = args.out or os.path.splitext(args.checkpoint)[0] + "_eval.json"
+    with open(out, "w") as file:
+        json.dump(report, file, indent=4)
+    print(f"Mean return {report['mean_return']:.3f} (95% CI {report['ci95'][0]:.3f} .. {report['ci95'][1]:.3f}) "
+          f"over {len(report['per_seed']) * args.episodes} episodes in {report['wall_time_s']:.1f}s -> {out}")
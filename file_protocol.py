@@ -0,0 +1,131 @@
+import json
+import os
+import re
+import time
+
+# Sequence-numbered atomic JSON files shared by the trainer (apply_config / process_tasks),
+# the xApp (apply_config_hw) and the traffic generator (find_ue_ids).
+#
+# On disk every document is {"seq": <n>, "data": <payload>}:
+#   - writers dump to a temporary file in the same directory and os.replace() it over the
+#     target, so readers never observe a truncated or half-written document
+#   - seq increases by one on every write of a file and always comes first, so it can be read
+#     from the first few bytes without parsing the payload
+#   - a replaced file has a new inode / mtime / size, so readers detect "nothing new" with a
+#     single os.stat and only open the file when it actually changed
+
+ALLOC_FILE = "alloc.json"   # trainer -> xApp: PRB ratios per UE
+RES_FILE = "res.json"       # xApp -> trainer: measured throughput per UE
+UE_ID_FILE = "ue_id.json"   # xApp -> traffic generator: which UEs / gNB to drive
+HEADER_BYTES = 32
+_SEQ_PATTERN = re.compile(rb'^\{"seq": (\d+)')
+POLL_INTERVAL = 0.01 # in seconds, a stat() per poll
+
+# Student-t 97.5% quantiles by degrees of freedom (n - 1), the normal 1.96 beyond the table.
+# Here because this is the one module deployed with the xApp (measurement windows) that the
+# trainer side (evaluate.confidence_interval) imports as well.
+T_975 = [12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+         2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+         2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042]
+Z_975 = 1.96
+
+def t_quantile_975(dof):
+    return T_975[dof - 1] if dof <= len(T_975) else Z_975
+
+
+def protocol_paths(io_dir) -> dict:
+    # The three protocol files of one testbed / environment namespace
+    return {"alloc": os.path.join(io_dir, ALLOC_FILE),
+            "res": os.path.join(io_dir, RES_FILE),
+            "ue_id": os.path.join(io_dir, UE_ID_FILE)}
+
+
+def read_seq(path) -> int:
+    # Sequence number of a document, 0 if missing, empty or written without the envelope
+    try:
+        with open(path, "rb") as file:
+            match = _SEQ_PATTERN.match(file.read(HEADER_BYTES))
+    except FileNotFoundError:
+        return 0
+    return int(match.group(1)) if match else 0
+
+
+def read_json(path):
+    """
+        Returns (seq, data)
+
+        Missing or empty files give (0, None). Plain JSON documents from older writers are
+        returned as (0, document).
+    """
+    try:
+        with open(path, "r") as file:
+            content = file.read()
+    except FileNotFoundError:
+        return 0, None
+    if not content.strip():
+        return 0, None
+    document = json.loads(content)
+    if isinstance(document, dict) and "seq" in document and "data" in document:
+        return int(document["seq"]), document["data"]
+    return 0, document
+
+
+def write_json(path, data, seq=None) -> int:
+    # Atomically replace path with data, returns the sequence number that was written
+    if seq is None:
+        seq = read_seq(path) + 1
+    directory = os.path.dirname(os.path.abspath(path))
+    tmp_path = os.path.join(directory, f".{os.path.basename(path)}.{os.getpid()}.tmp")
+    with open(tmp_path, "w") as file:
+        json.dump({"seq": seq, "data": data}, file)
+    os.replace(tmp_path, path)
+    return seq
+
+
+class FileWatcher:
+    """
+        Waits for new versions of one protocol file
+
+        Polls with os.stat only; the file is opened when its (inode, mtime, size) changes.
+    """
+    def __init__(self, path, poll_interval=POLL_INTERVAL) -> None:
+        self.path = path
+        self.poll_interval = poll_interval
+        self._stat_key = None
+        self.seq = read_seq(path)
+
+    def _changed(self) -> bool:
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        key = (st.st_ino, st.st_mtime_ns, st.st_size)
+        if key == self._stat_key:
+            return False
+        self._stat_key = key
+        return True
+
+    def wait_for_seq(self, min_seq, timeout=None, exact=False):
+        """
+            Block until the file holds a document with seq >= min_seq (seq == min_seq if exact)
+
+            Returns (seq, data), or None when timeout (in seconds) expires first. With exact, a
+            document with a higher seq (left over from an earlier numbering) is waited past.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        self._stat_key = None # Always look at the current version once
+        while True:
+            if self._changed():
+                seq = read_seq(self.path)
+                if seq == min_seq or (seq > min_seq and not exact):
+                    seq, data = read_json(self.path)
+                    if seq == min_seq or (seq > min_seq and not exact):
+                        self.seq = seq
+                        return seq, data
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            time.sleep(self.poll_interval)
+
+    def wait_for_next(self, timeout=None):
+        # Next version after the last one this watcher returned (or saw at construction)
+        return self.wait_for_seq(self.seq + 1, timeout)
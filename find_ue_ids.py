@@ -1,21 +1,17 @@
 #!/usr/bin/env python3
 
-import json
+import argparse
 import subprocess
 import time
 import os
 
-def read_json():
-    try:
-        with open("./ue_id.json", "r") as file:
-            content = file.read().strip()
-            if not content:  # Check if file is empty
-                return {}
-            data = json.loads(content)
-            #return data.get("ue_id", None)
-            return data
-    except (FileNotFoundError, json.JSONDecodeError):
-        return None
+import file_protocol
+
+IO_DIR = "." # Namespace of ue_id.json, same directory as the xApp's --io_dir
+IPERF_DURATION_S = 2
+IPERF_RATE = "5M"
+SETTLE_S = 0.2 # in seconds, after killing the previous flows
+MEASURE_TIMEOUT_S = 5
 
 def kill_all_iperf():
     """Kill any running iperf processes to ensure clean state"""
@@ -24,42 +20,54 @@ def kill_all_iperf():
     except:
         pass
 
-def main():
+class IperfTraffic:
+    # One UDP iperf client per UE (10.45.1.<ue>), the testbed traffic source
+    # (testbed_emulator.FakeIperf drives the emulated RAN through the same interface)
+    def command(self, ue):
+        return f"iperf -c 10.45.1.{ue} -u -t {IPERF_DURATION_S} -b {IPERF_RATE}"
+
+    def start(self, ue):
+        return subprocess.Popen(self.command(ue), shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def kill_all(self):
+        kill_all_iperf()
+
+def main(io_dir=IO_DIR, traffic=None, stop=None, settle_s=SETTLE_S):
+    # stop: optional threading.Event ending the loop (the command-line generator runs forever)
+    traffic = IperfTraffic() if traffic is None else traffic
     gnb_to_ues = {
         1: [1],     # gNB1 eMBB users
         2: [2, 3],  # gNB2 eMBB users
         3: [4, 5]   # gNB3 mMTC users
     }
     
-    last_read = read_json()
+    # Every command from the xApp is a new sequence number of ue_id.json
+    watcher = file_protocol.FileWatcher(file_protocol.protocol_paths(io_dir)["ue_id"])
 
     print("=== Traffic Generator Started ===")
     print("Monitoring for UE/slice changes...")
     
-    while True:
-        current_read = read_json()
+    pending = None # Command that arrived while measurement traffic was still running
+    while stop is None or not stop.is_set():
+        update = pending or watcher.wait_for_next(timeout=None if stop is None else 1.0)
+        pending = None
+        if update is None:
+            continue
+        _, current_read = update
         
-        if current_read != last_read and current_read:
+        if current_read:
             # Check if UE_ID present (initialization phase - ONE UE at a time)
             ue_id = current_read.get("ue_id", None)
             if ue_id is not None:
                 print(f"\n[INIT] Starting traffic for UE {ue_id}")
                 
                 # Kill any existing iperf to ensure clean state
-                kill_all_iperf()
-                time.sleep(0.2)
+                traffic.kill_all()
+                time.sleep(settle_s)
                 
                 # Generate traffic for THIS UE ONLY
-                target_ip = f"10.45.1.{ue_id}"
-                command = f"iperf -c {target_ip} -u -t 2 -b 5M"
-                
-                print(f"  Command: {command}")
-                proc = subprocess.Popen(
-                    command, 
-                    shell=True, 
-                    stdout=subprocess.PIPE, 
-                    stderr=subprocess.PIPE
-                )
+                print(f"  Command: {traffic.command(ue_id)}")
+                proc = traffic.start(ue_id)
                 
                 try:
                     stdout, stderr = proc.communicate(timeout=5)
@@ -69,9 +77,7 @@ def main():
                     print(f"  ✗ Command timed out for UE {ue_id}")
                 
                 # Ensure process is dead
-                kill_all_iperf()
-                
-                last_read = current_read
+                traffic.kill_all()
             
             # Check for gNB (measurement phase - multiple UEs)
             gnb_id = current_read.get("gnb", None)
@@ -80,8 +86,8 @@ def main():
                 print(f"\n[MEASURE] Starting traffic for gNB {gnb_id}")
                 
                 # Kill existing iperf
-                kill_all_iperf()
-                time.sleep(0.2)
+                traffic.kill_all()
+                time.sleep(settle_s)
                 
                 ue_list = gnb_to_ues[gnb_id]
                 print(f"  UEs: {ue_list}")
@@ -89,31 +95,29 @@ def main():
                 # Start traffic for all UEs on this gNB
                 processes = []
                 for ue_logical_id in ue_list:
-                    target_ip = f"10.45.1.{ue_logical_id}"
-                    command = f"iperf -c {target_ip} -u -t 2 -b 5M"
-                    
-                    print(f"    Starting traffic to UE {ue_logical_id}: {target_ip}")
-                    proc = subprocess.Popen(
-                        command,
-                        shell=True,
-                        stdout=subprocess.PIPE,
-                        stderr=subprocess.PIPE
-                    )
-                    processes.append(proc)
+                    print(f"    Starting traffic to UE {ue_logical_id}: {traffic.command(ue_logical_id)}")
+                    processes.append(traffic.start(ue_logical_id))
                 
-                # Wait for all processes to complete
+                # Wait for all processes to complete, or for the xApp to move on: its measurement
+                # windows end as soon as they converge, the rest of the traffic is not needed
+                deadline = time.monotonic() + MEASURE_TIMEOUT_S
+                while any(proc.poll() is None for proc in processes) and time.monotonic() < deadline:
+                    pending = watcher.wait_for_next(timeout=file_protocol.POLL_INTERVAL)
+                    if pending is not None:
+                        print(f"    ✓ Measurement of gNB {gnb_id} done, stopping its traffic")
+                        break
                 for i, proc in enumerate(processes):
-                    try:
-                        proc.wait(timeout=5)
-                        print(f"    ✓ UE {ue_list[i]} traffic complete")
-                    except subprocess.TimeoutExpired:
+                    if proc.poll() is None:
                         proc.kill()
-                        print(f"    ✗ UE {ue_list[i]} timed out")
+                        if pending is None:
+                            print(f"    ✗ UE {ue_list[i]} timed out")
+                    elif pending is None:
+                        print(f"    ✓ UE {ue_list[i]} traffic complete")
                 
-                kill_all_iperf()
-                last_read = current_read
-        
-        time.sleep(0.1)  # Reduced sleep for faster response
+                traffic.kill_all()
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="iperf traffic generator driven by the xApp through ue_id.json")
+    parser.add_argument("--io_dir", type=str, default=IO_DIR, help="Directory of ue_id.json")
+    args = parser.parse_args()
+    main(args.io_dir)
@@ -1,43 +1,127 @@
-import numpy as np
-from stable_baselines3 import PPO
-from stable_baselines3.common.monitor import Monitor
-import torch
-import wandb
-from stable_baselines3.common.callbacks import BaseCallback
-from wandb.integration.sb3 import WandbCallback
 import os
+import time
+import uuid
 from gymnasium.wrappers import TimeLimit
 
 from environment import InterferenceEnvironment 
-from utilities import Config
+import utilities
+from utilities import Config, IOContext
 
-class CheckpointCallback(BaseCallback):
-    """
-    Custom callback for saving a model every N steps.
-    """
-    def __init__(self, save_freq: int, save_path: str, verbose: int = 0):
-        super().__init__(verbose)
-        self.save_freq = save_freq
-        self.save_path = save_path
+EXPERIMENT_ROOT = "./Experiment"
+
+# Updated config
+DEFAULT_CONF = {
+    "total_users": 5,           # Updated to match Config.user_scenarios
+    "timesteps_per_session": 5000, # Increased from 20 to 5000 (RL needs data!)
+    "total_sessions": 10,       # 10 sessions * 5000 steps = 50,000 total training steps
+    "algorithm": "PPO",         # "PPO", "DQN_PER" (off-policy, see off_policy.py) or "DQN_PER_ASYNC" (see actor_learner.py)
+    "env_type": "Interference_3gNB",
+    "resume": None,             # True / experiment index to continue a crashed run from its latest checkpoint
+    # PPO hyperparameters
+    "n_steps": 2048,            # Buffer size (standard PPO default)
+    "batch_size": 64,           # Minibatch size
+    "n_epochs": 20,             # How many times to re-use data
+    "learning_rate": 1e-3,      # Learn faster (3e-4)
+    "ent_coef": 0.01,
+    # DQN_PER hyperparameters (learning_rate and batch_size are shared)
+    "buffer_size": 100000,
+    "learning_starts": 500,
+    "utd_ratio": 1,             # Gradient updates per environment step, a whole number or reciprocal (0.25 -> one every 4 steps)
+    "target_update_interval": 500,
+    "exploration_fraction": 0.2,
+    "per_alpha": 0.6,
+    "per_beta": 0.4,
+    "replay_path": None,        # Replay buffer snapshot (.npz) to start from, e.g. from an earlier run
+    # DQN_PER_ASYNC (utd_ratio caps updates per step there, None = train continuously)
+    "episode_steps": 100,
+    "exploration_final_eps": 0.05,
+    "queue_size": 1000,         # Transitions in flight between actor and learner
+    "learner_chunk": 8,         # Gradient updates between two checks of the transition queue
+    "weight_sync_updates": 50,  # Publish weights to the actor every N gradient updates
+    "action_step_size": 4,      # PRB granularity of the action grid
+    "n_envs": 1,                # In-process environments stepped together (PPO n_steps is per environment)
+    "seed": None,               # Policy / environment seed, None: random
+    "io_dir": None,             # I/O namespace (alloc/res/ue_id files) of this run, None: utilities defaults
+    "backend": None,            # hardware / regression / replay / sinr, None: utilities.BACKEND / PRE_TRAIN
+    "qos_log_freq": 0,          # Log per-user / per-gNB QoS statistics every N steps (0: off)
+    "memory_profile_freq": 0,   # Memory snapshots (mem_instrument) every N steps and per session (0: off)
+    "memory_trace_frames": 12,  # tracemalloc frames per allocation for those snapshots (0: RSS / types only)
+    "log_tier": "full",         # full: WandB gradient / parameter histograms, metrics: scalars only, minimal: no WandB callback or TensorBoard
+    "reward_thresholds": [],    # Record wall time / timesteps until the mean episode reward first reaches each of these
+    "target_window": 20,        # Episodes in that mean
+    "wandb_mode": "online",
+}
+
+def allocate_experiment_dir():
+    # mkdir is atomic, so concurrent runs can never claim the same ./Experiment/<i>
+    os.makedirs(EXPERIMENT_ROOT, exist_ok=True)
+    i = 1
+    while True:
+        try:
+            os.makedirs(f"{EXPERIMENT_ROOT}/{i}")
+            return i, f"{EXPERIMENT_ROOT}/{i}"
+        except FileExistsError:
+            i += 1
+
+def resolve_experiment(resume):
+    # conf["resume"]: True -> latest experiment with a run state, int -> ./Experiment/<i>, str -> folder path
+    if resume is True:
+        indices = [int(name) for name in os.listdir(EXPERIMENT_ROOT)
+                   if name.isdigit() and os.path.exists(f"{EXPERIMENT_ROOT}/{name}/run_state.json")]
+        if not indices:
+            raise FileNotFoundError(f"No resumable experiment in {EXPERIMENT_ROOT}")
+        return f"{EXPERIMENT_ROOT}/{max(indices)}"
+    if isinstance(resume, int):
+        return f"{EXPERIMENT_ROOT}/{resume}"
+    return resume
+
+def make_io(conf: dict) -> IOContext:
+    # Per-run files and backend, defaults to the process-wide utilities settings
+    io = IOContext.from_globals()
+    if conf.get("io_dir"):
+        os.makedirs(conf["io_dir"], exist_ok=True)
+        io = IOContext(conf["io_dir"], io.backend, record_path=io.record_path, replay_table_path=io.replay_table_path,
+                       pre_train=io.pre_train)
+    if conf.get("backend"):
+        io.backend = conf["backend"]
+    return io
 
-    def _on_step(self) -> bool:
-        # Save the model periodically (not every single step, which is too much I/O)
-        if self.n_calls % self.save_freq == 0:
-            save_file = os.path.join(self.save_path, f"model_step_{self.n_calls}")
-            self.model.save(save_file)
-            if self.verbose > 0:
-                print(f"Saved model to {save_file}")
-        return True
-    
 def run_experiment(conf: dict):
+    # Training and logging integrations are imported on first use so that the simulator core
+    # (and spawned worker processes that only step environments) load just numpy + gymnasium
+    import wandb
+    from stable_baselines3 import PPO
+    from stable_baselines3.common.monitor import Monitor
+    from wandb.integration.sb3 import WandbCallback
+    from off_policy import PrioritizedDQN, utd_schedule
+    from stable_baselines3.common.vec_env import DummyVecEnv
+    from callbacks import (CheckpointCallback, MemoryCallback, QoSLoggingCallback, TimeToTargetCallback, find_latest_checkpoint,
+                           read_run_state, restore_rng_state, save_checkpoint, write_run_state)
+    from mem_instrument import MB, peak_rss_bytes
+
     project_name = "PRB_ALLOCATION_MULTI_GNB"
+    conf = {**DEFAULT_CONF, **conf}
+    start_time = time.time()
+    if conf["algorithm"] == "DQN_PER_ASYNC":
+        if conf.get("resume"):
+            raise ValueError("resume is not supported for DQN_PER_ASYNC, start a new experiment instead")
+        from actor_learner import run_actor_learner
+        return run_actor_learner(conf)
+    if conf["algorithm"] == "DQN_PER":
+        # Checked before an experiment folder or wandb run exists
+        train_freq, gradient_steps = utd_schedule(conf["utd_ratio"])
     
-    # Setup Experiment Folder
-    i = 1
-    while os.path.exists(f"./Experiment/{i}"):
-        i += 1
-    path = f"./Experiment/{i}"
-    os.makedirs(path, exist_ok=True)
+    if conf.get("resume"):
+        # Continue an existing experiment folder, wandb run and TensorBoard log
+        path = resolve_experiment(conf["resume"])
+        run_state = read_run_state(path)
+        i = run_state["experiment"]
+        print(f"Resuming experiment {path}")
+    else:
+        # Setup Experiment Folder
+        i, path = allocate_experiment_dir()
+        run_state = {"experiment": i, "wandb_run_id": uuid.uuid4().hex[:8], "session": 0}
+        write_run_state(path, run_state)
     os.makedirs(f"{path}/checkpoints", exist_ok=True) # Subfolder for checkpoints
 
     # Init WandB
@@ -45,62 +129,164 @@ def run_experiment(conf: dict):
                      config=conf,
                      sync_tensorboard=True,
                      save_code=True,
-                     mode="online",
-                     name=f"Exp_{i}_Interference",)
+                     mode=conf["wandb_mode"],
+                     name=f"Exp_{i}_Interference",
+                     id=run_state["wandb_run_id"],
+                     resume="allow")
     
     # Initialize Environment
-    env = InterferenceEnvironment(Config())
-    env = TimeLimit(env, max_episode_steps=100) # force episode to end after 100 steps, monitor produces total reward for 100 steps
-    env = Monitor(env) # Wraps env to track rewards for SB3 and WandB
+    io = make_io(conf)
+    if conf["n_envs"] > 1 and io.resolve_backend() == "hardware":
+        raise ValueError("The testbed serves a single environment, n_envs > 1 needs a simulated backend")
+    def make_env(rank):
+        config = Config()
+        config.action_step_size = conf["action_step_size"]
+        # Several environments simulate through their own allocation files
+        config.io = io if conf["n_envs"] == 1 else io.worker(f"env_{rank}")
+        env = InterferenceEnvironment(config)
+        env = TimeLimit(env, max_episode_steps=100) # force episode to end after 100 steps, monitor produces total reward for 100 steps
+        return Monitor(env) # Wraps env to track rewards for SB3 and WandB
+    # DummyVecEnv keeps every environment in this process (RNG state in checkpoints, QoS / memory callbacks)
+    env = make_env(0) if conf["n_envs"] == 1 else DummyVecEnv([lambda rank=rank: make_env(rank) for rank in range(conf["n_envs"])])
 
     # Setup Callbacks
-    # Save model every 1000 steps
-    checkpoint_callback = CheckpointCallback(save_freq=1000, save_path=f"{path}/checkpoints", verbose=1)
-    wandb_callback = WandbCallback(verbose=2, gradient_save_freq=100, model_save_path=f"{path}/wandb_models", log="all")
+    # Save model (and the replay buffer of off-policy runs) every 1000 steps
+    replay_save_path = f"{path}/replay_buffer.npz"
+    checkpoint_callback = CheckpointCallback(save_freq=1000, save_path=f"{path}/checkpoints", verbose=1,
+                                             replay_path=replay_save_path if conf["algorithm"] == "DQN_PER" else None)
+    callbacks = [checkpoint_callback]
+    if conf["log_tier"] == "full":
+        callbacks.insert(0, WandbCallback(verbose=2, gradient_save_freq=100, model_save_path=f"{path}/wandb_models", log="all"))
+    elif conf["log_tier"] == "metrics":
+        callbacks.insert(0, WandbCallback(verbose=2, model_save_path=f"{path}/wandb_models"))
+    elif conf["log_tier"] != "minimal":
+        raise ValueError(f"Unknown log_tier: {conf['log_tier']}")
+    tensorboard_log = None if conf["log_tier"] == "minimal" else f"{path}/tensorboard/"
+    verbose = 0 if conf["log_tier"] == "minimal" else 1
+    if conf["qos_log_freq"]:
+        callbacks.append(QoSLoggingCallback(log_freq=conf["qos_log_freq"]))
+    target_callback = None
+    if conf["reward_thresholds"]:
+        target_callback = TimeToTargetCallback(conf["reward_thresholds"], window=conf["target_window"], start_time=start_time)
+        callbacks.append(target_callback)
     
-    # Initialize PPO Agent
-    # We use MlpPolicy because our state is a vector of numbers (not an image).
-    model = PPO(
-        "MlpPolicy", 
-        env, 
-        n_steps=2048,       # Buffer size (standard PPO default)
-        batch_size=64,      # Minibatch size
-        n_epochs=20,        # How many times to re-use data
-        learning_rate=1e-3, # Learn faster (3e-4) 
-        ent_coef=0.01,
-        verbose=1, 
-        tensorboard_log=f"{path}/tensorboard/"
-    )
+    algorithm_class = {"PPO": PPO, "DQN_PER": PrioritizedDQN}[conf["algorithm"]]
+    checkpoint, learner_state = find_latest_checkpoint(path) if conf.get("resume") else (None, None)
+    if conf.get("resume") and checkpoint is None and run_state["session"] > 0:
+        # Retraining from scratch would silently overwrite the sessions already recorded in run_state
+        raise FileNotFoundError(f"{path} finished {run_state['session']} session(s) but has no loadable checkpoint")
+    if checkpoint is not None:
+        # Restores policy, optimizer and timestep counters, then the RNG streams and session position
+        model = algorithm_class.load(checkpoint, env=env, tensorboard_log=tensorboard_log)
+        restore_rng_state(model, learner_state["rng"])
+        checkpoint_callback.n_calls = learner_state["n_calls"]
+        checkpoint_callback.session = learner_state["session"]
+        checkpoint_callback.session_start_timesteps = learner_state["session_start_timesteps"]
+        print(f"Loaded {checkpoint} at {model.num_timesteps} timesteps (session {learner_state['session']+1})")
+    elif conf["algorithm"] == "DQN_PER":
+        model = PrioritizedDQN(
+            "MlpPolicy",
+            env,
+            learning_rate=conf["learning_rate"],
+            buffer_size=conf["buffer_size"],
+            learning_starts=conf["learning_starts"],
+            batch_size=conf["batch_size"],
+            train_freq=train_freq,
+            gradient_steps=gradient_steps,
+            target_update_interval=conf["target_update_interval"],
+            exploration_fraction=conf["exploration_fraction"],
+            replay_buffer_kwargs={"alpha": conf["per_alpha"], "beta": conf["per_beta"]},
+            beta_timesteps=conf["timesteps_per_session"] * conf["total_sessions"],
+            seed=conf["seed"],
+            verbose=verbose,
+            tensorboard_log=tensorboard_log
+        )
+    else:
+        # Initialize PPO Agent
+        # We use MlpPolicy because our state is a vector of numbers (not an image).
+        model = PPO(
+            "MlpPolicy", 
+            env, 
+            n_steps=conf["n_steps"],
+            batch_size=conf["batch_size"],
+            n_epochs=conf["n_epochs"],
+            learning_rate=conf["learning_rate"],
+            ent_coef=conf["ent_coef"],
+            seed=conf["seed"],
+            verbose=verbose, 
+            tensorboard_log=tensorboard_log
+        )
+
+    if conf["algorithm"] == "DQN_PER":
+        # Own snapshot of this experiment when resuming, otherwise the optional seed buffer
+        replay_load_path = replay_save_path if checkpoint is not None else conf["replay_path"]
+        if replay_load_path and os.path.exists(replay_load_path):
+            count = model.replay_buffer.load(replay_load_path)
+            print(f"Loaded {count} transitions from {replay_load_path}")
+
+    instrument = None
+    if conf["memory_profile_freq"]:
+        from mem_instrument import MemoryInstrument
+        instrument = MemoryInstrument(path, trace_frames=conf["memory_trace_frames"])
+        instrument.snapshot("start") # No logger before the first learn()
+        callbacks.append(MemoryCallback(instrument, snapshot_freq=conf["memory_profile_freq"]))
 
     print(f"Starting training on device: {model.device}")
 
     # Training Loop
     # We train in "Sessions". Each session adds more experiences to the agent.
-    for i in range(conf["total_sessions"]):
+    train_time, start_timesteps = 0., model.num_timesteps
+    for i in range(checkpoint_callback.session, conf["total_sessions"]):
         print(f"--- Starting Session {i+1}/{conf['total_sessions']} ---")
+        # A session interrupted mid-way only trains for what is left of it
+        done_in_session = model.num_timesteps - checkpoint_callback.session_start_timesteps
+        remaining = conf["timesteps_per_session"] - done_in_session
         
         # Train
-        model.learn(
-            total_timesteps=conf["timesteps_per_session"], 
-            callback=[wandb_callback, checkpoint_callback],
-            reset_num_timesteps=False # Keep learning accumulation
-        )
+        if remaining > 0:
+            learn_start = time.time()
+            model.learn(
+                total_timesteps=remaining, 
+                callback=callbacks,
+                reset_num_timesteps=False # Keep learning accumulation
+            )
+            train_time += time.time() - learn_start
         
-        # Save Session Model
-        model.save(path + f"/model_session_{i}")
+        # Save Session Model (resumes at the start of the next session)
+        checkpoint_callback.session = i + 1
+        checkpoint_callback.session_start_timesteps = model.num_timesteps
+        save_checkpoint(model, path + f"/model_session_{i}", checkpoint_callback.learner_state())
+        if conf["algorithm"] == "DQN_PER":
+            model.replay_buffer.save(replay_save_path)
+        run_state["session"] = i + 1
+        write_run_state(path, run_state)
+        if instrument is not None:
+            instrument.snapshot(f"session_{i}", model)
+            model.logger.dump(model.num_timesteps)
         
+    # Final metrics of the run (mean over the last episodes tracked by Monitor)
+    episode_rewards = [info["r"] for info in model.ep_info_buffer]
+    results = {
+        "experiment": path,
+        "num_timesteps": model.num_timesteps,
+        "mean_episode_reward": float(sum(episode_rewards) / len(episode_rewards)) if episode_rewards else None,
+        "episodes": len(episode_rewards),
+        "wall_time_s": time.time() - start_time,
+        "train_time_s": train_time,
+        "steps_per_s": (model.num_timesteps - start_timesteps) / train_time if train_time else None,
+    }
+    if target_callback is not None:
+        results["time_to_target"] = target_callback.results()
+    if instrument is not None:
+        instrument.snapshot("end", model)
+        instrument.close()
+    results["peak_rss_mb"] = peak_rss_bytes() / MB # Of the whole process
     run.finish()
     env.close()
+    return results
 
 if __name__ == "__main__":
-    # Updated config
-    conf = {
-        "total_users": 5,           # Updated to match Config.user_scenarios
-        "timesteps_per_session": 5000, # Increased from 20 to 5000 (RL needs data!)
-        "total_sessions": 10,       # 10 sessions * 5000 steps = 50,000 total training steps
-        "algorithm": "PPO",
-        "env_type": "Interference_3gNB"
-    }
+    conf = dict(DEFAULT_CONF)
     
     # Ensure utilities.PRE_TRAIN is True for simulation!
     import utilities
@@ -0,0 +1,159 @@
+import gc
+import json
+import os
+import resource
+import sys
+import time
+import tracemalloc
+from collections import Counter
+
+import numpy as np
+
+# Opt-in memory instrumentation of long training runs (conf["memory_profile_freq"] in main)
+# A snapshot records RSS, the size of the components known to grow (users_history of every
+# in-process environment, replay / rollout buffers, episode info, policy parameters) and what
+# grew since the previous snapshot: tracemalloc allocation sites and gc-tracked object types.
+# Snapshots are appended to <experiment>/memory.jsonl and mirrored to the SB3 logger (memory/*).
+# tracemalloc slows allocations down noticeably, which is why this is off by default.
+
+TOP_SITES = 10
+TOP_TYPES = 10
+MB = 1024 ** 2
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def rss_bytes() -> int:
+    # Current resident set size (Linux /proc), peak RSS where that is unavailable
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return peak_rss_bytes()
+
+
+def peak_rss_bytes() -> int:
+    # ru_maxrss is in KiB on Linux, in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def deep_sizeof(obj, seen=None) -> int:
+    # Recursive sys.getsizeof over containers, ndarrays counted by their buffers
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes + sys.getsizeof(obj) if obj.base is None else sys.getsizeof(obj)
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(k, seen) + deep_sizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_sizeof(item, seen) for item in obj)
+    return size
+
+
+def buffer_bytes(buffer) -> int:
+    # Bytes held by the ndarray attributes of an SB3 buffer (0 when the model has none)
+    if buffer is None:
+        return 0
+    return sum(value.nbytes for value in vars(buffer).values() if isinstance(value, np.ndarray))
+
+
+def component_sizes(model) -> dict:
+    """
+        Bytes held by the components of a training run that grow or are large
+
+        users_history is estimated from its last entry (every step deep-copies one task queue
+        of the same shape) to keep snapshots cheap on long histories.
+    """
+    envs = [env.unwrapped for env in getattr(model.get_env(), "envs", [])
+            if hasattr(env.unwrapped, "user_handler")]
+    history_entries = sum(len(getattr(env.user_handler, "users_history", [])) for env in envs)
+    history_bytes = sum(len(env.user_handler.users_history) * deep_sizeof(env.user_handler.users_history[-1])
+                        for env in envs if getattr(env.user_handler, "users_history", None))
+    return {
+        "users_history": history_bytes,
+        "users_history_entries": history_entries,
+        "replay_buffer": buffer_bytes(getattr(model, "replay_buffer", None)),
+        "rollout_buffer": buffer_bytes(getattr(model, "rollout_buffer", None)),
+        "ep_info_buffer_entries": len(model.ep_info_buffer or []),
+        "policy_parameters": sum(p.numel() * p.element_size() for p in model.policy.parameters()),
+    }
+
+
+class MemoryInstrument:
+    """
+        Snapshots of process memory, appended to <path>/memory.jsonl
+
+        trace_frames > 0 starts tracemalloc with that many frames per allocation, so growth is
+        attributed to source lines; 0 records RSS, components and object types only. With more
+        than one frame every site is also attributed to the innermost frame of this repository
+        (e.g. the copy.deepcopy caller rather than copy.py).
+    """
+    def __init__(self, path: str, trace_frames: int = 12) -> None:
+        self.out_path = os.path.join(path, "memory.jsonl")
+        self.trace_frames = trace_frames
+        if trace_frames and not tracemalloc.is_tracing():
+            tracemalloc.start(trace_frames)
+        self.last_snapshot = None
+        self.last_types = Counter()
+        self.start_rss = rss_bytes()
+
+    def _traced_growth(self) -> list:
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ])
+        growth = []
+        if self.last_snapshot is not None:
+            group_by = "traceback" if self.trace_frames > 1 else "lineno"
+            for stat in snapshot.compare_to(self.last_snapshot, group_by)[:TOP_SITES]:
+                # Frames run from the oldest to the most recent call
+                frame = stat.traceback[-1]
+                project = [f for f in stat.traceback if f.filename.startswith(PROJECT_DIR)]
+                growth.append({"site": f"{frame.filename}:{frame.lineno}",
+                               "project_site": f"{project[-1].filename}:{project[-1].lineno}" if project else None,
+                               "size_diff_kb": stat.size_diff / 1024,
+                               "size_kb": stat.size / 1024,
+                               "count_diff": stat.count_diff})
+        self.last_snapshot = snapshot
+        return growth
+
+    def _type_growth(self) -> list:
+        types = Counter(type(obj).__name__ for obj in gc.get_objects())
+        growth = [{"type": name, "count_diff": count - self.last_types.get(name, 0), "count": count}
+                  for name, count in types.items()]
+        growth.sort(key=lambda item: item["count_diff"], reverse=True)
+        self.last_types = types
+        return [item for item in growth[:TOP_TYPES] if item["count_diff"] > 0]
+
+    def snapshot(self, label: str, model=None) -> dict:
+        # One record, also written to the logger of model (flushed by the caller's next dump)
+        record = {"label": label, "time": time.time(),
+                  "timesteps": getattr(model, "num_timesteps", None),
+                  "rss_mb": rss_bytes() / MB,
+                  "rss_growth_mb": (rss_bytes() - self.start_rss) / MB,
+                  "peak_rss_mb": peak_rss_bytes() / MB}
+        if tracemalloc.is_tracing():
+            traced, traced_peak = tracemalloc.get_traced_memory()
+            record["traced_mb"], record["traced_peak_mb"] = traced / MB, traced_peak / MB
+            record["top_growth"] = self._traced_growth()
+        record["type_growth"] = self._type_growth()
+        if model is not None:
+            record["components"] = component_sizes(model)
+
+        with open(self.out_path, "a") as file:
+            file.write(json.dumps(record) + "\n")
+        if model is not None:
+            for name in ["rss_mb", "rss_growth_mb", "peak_rss_mb", "traced_mb"]:
+                if name in record:
+                    model.logger.record(f"memory/{name}", record[name])
+            for name, value in record["components"].items():
+                model.logger.record(f"memory/{name}" if name.endswith("entries") else f"memory/{name}_mb",
+                                    value if name.endswith("entries") else value / MB)
+        return record
+
+    def close(self) -> None:
+        if self.trace_frames and tracemalloc.is_tracing():
+            tracemalloc.stop()
@@ -0,0 +1,154 @@
+import argparse
+import os
+
+import numpy as np
+
+import utilities
+
+# Torch-free inference for trained policies.
+# export_policy() dumps the MLP of a stable_baselines3 policy to an uncompressed .npz,
+# NumpyPolicy reproduces its forward pass with NumPy only (memory-mapped weights), so the
+# hardware controller can pick actions without loading torch / stable_baselines3.
+#   python numpy_policy.py --checkpoint ./Experiment/1/model_session_9.zip --verify
+
+ACTIVATIONS = {
+    "identity": lambda x: x,
+    "tanh": np.tanh,
+    "relu": lambda x: np.maximum(x, 0.),
+}
+
+
+def _torch_layers(modules):
+    # Flatten nn.Sequential / nn.Linear modules into [(weight, bias, activation)]
+    import torch.nn as nn
+
+    layers = []
+    for module in modules:
+        if isinstance(module, nn.Linear):
+            layers.append([module.weight.detach().cpu().numpy(),
+                           module.bias.detach().cpu().numpy(), "identity"])
+        elif isinstance(module, nn.Sequential):
+            layers.extend(_torch_layers(module))
+        elif type(module).__name__.lower() in ACTIVATIONS:
+            if not layers:
+                raise ValueError("Activation without a preceding linear layer")
+            layers[-1][2] = type(module).__name__.lower()
+        elif isinstance(module, (nn.Flatten, nn.Identity)):
+            continue
+        else:
+            raise ValueError(f"Unsupported module in policy network: {module}")
+    return layers
+
+
+def policy_layers(policy):
+    """
+        Linear layers of the greedy-action path of an SB3 policy
+
+        ActorCriticPolicy (PPO): mlp_extractor.policy_net followed by action_net -> logits
+        QNetwork policy (DQN): q_net.q_net -> Q-values
+    """
+    if hasattr(policy, "mlp_extractor"):
+        # FlattenExtractor has no parameters, so the features are the raw observation
+        return _torch_layers([policy.mlp_extractor.policy_net, policy.action_net])
+    if hasattr(policy, "q_net"):
+        return _torch_layers([policy.q_net.q_net])
+    raise ValueError(f"Unsupported policy type: {type(policy).__name__}")
+
+
+def export_policy(model, out_path) -> str:
+    # model: a loaded SB3 model (PPO/DQN) or a path to its .zip checkpoint
+    if isinstance(model, str):
+        from stable_baselines3 import PPO
+        model = PPO.load(model, device="cpu")
+
+    layers = policy_layers(model.policy)
+    arrays = {"n_layers": np.array(len(layers)),
+              "activations": np.array([activation for _, _, activation in layers])}
+    for idx, (weight, bias, _) in enumerate(layers):
+        arrays[f"W{idx}"] = np.ascontiguousarray(weight.T, dtype=np.float32) # (in, out) for x @ W
+        arrays[f"b{idx}"] = bias.astype(np.float32)
+
+    # np.savez stores members uncompressed, which keeps them memory-mappable
+    tmp_path = out_path + ".tmp.npz"
+    np.savez(tmp_path, **arrays)
+    os.replace(tmp_path, out_path)
+    return out_path
+
+
+class NumpyPolicy:
+    def __init__(self, layers) -> None:
+        # layers: [(W (in, out), b (out,), activation name)]
+        self.layers = [(W, b, ACTIVATIONS[activation]) for W, b, activation in layers]
+        self.n_actions = self.layers[-1][0].shape[1]
+
+    @classmethod
+    def load(cls, path, mmap=True) -> "NumpyPolicy":
+        arrays = utilities.load_npz_mmap(path) if mmap else dict(np.load(path))
+        n_layers = int(arrays["n_layers"])
+        return cls([(arrays[f"W{idx}"], arrays[f"b{idx}"], str(arrays["activations"][idx]))
+                    for idx in range(n_layers)])
+
+    def logits(self, obs) -> np.ndarray:
+        x = np.asarray(obs, dtype=np.float32)
+        for W, b, activation in self.layers:
+            x = activation(x @ W + b)
+        return x
+
+    def probabilities(self, obs) -> np.ndarray:
+        logits = self.logits(obs)
+        logits = logits - logits.max(axis=-1, keepdims=True)
+        exp = np.exp(logits)
+        return exp / exp.sum(axis=-1, keepdims=True)
+
+    def predict(self, obs, deterministic=True, rng=None):
+        # Same contract as BaseAlgorithm.predict: (actions, state), batched or single observation
+        obs = np.asarray(obs, dtype=np.float32)
+        if deterministic:
+            actions = self.logits(obs).argmax(axis=-1)
+        else:
+            # Inverse-CDF sampling from the categorical distribution
+            rng = np.random if rng is None else rng
+            cdf = np.cumsum(self.probabilities(obs), axis=-1)
+            u = rng.random(cdf.shape[:-1] + (1,)) * cdf[..., -1:]
+            actions = np.minimum((cdf < u).sum(axis=-1), self.n_actions - 1)
+        return actions, None
+
+
+def verify_export(model, numpy_policy, n_obs=1000, atol=1e-5) -> dict:
+    """
+        Compare the NumPy runtime with the torch policy on random observations
+
+        Greedy actions must match exactly (up to float32 ties), action probabilities
+        (PPO) or Q-values (DQN) within atol.
+    """
+    import torch
+
+    obs = np.stack([model.observation_space.sample() for _ in range(n_obs)]).astype(np.float32)
+    with torch.inference_mode():
+        obs_tensor, _ = model.policy.obs_to_tensor(obs)
+        if hasattr(model.policy, "get_distribution"):
+            reference = model.policy.get_distribution(obs_tensor).distribution.probs.cpu().numpy()
+            values = numpy_policy.probabilities(obs)
+        else:
+            reference = model.policy.q_net(obs_tensor).cpu().numpy()
+            values = numpy_policy.logits(obs)
+        greedy, _ = model.predict(obs, deterministic=True)
+    max_abs_error = float(np.abs(values - reference).max())
+    greedy_match = float((numpy_policy.predict(obs)[0] == greedy).mean())
+    return {"n_obs": n_obs, "greedy_match": greedy_match, "max_abs_error": max_abs_error,
+            "ok": bool(max_abs_error <= atol and greedy_match == 1.0)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export a PPO checkpoint to a torch-free NumPy policy")
+    parser.add_argument("--checkpoint", type=str, required=True, help="Path to a saved PPO model (.zip)")
+    parser.add_argument("--out", type=str, default="", help="Output .npz (default: next to the checkpoint)")
+    parser.add_argument("--verify", action="store_true", help="Check the export against the torch policy")
+    args = parser.parse_args()
+
+    from stable_baselines3 import PPO
+    model = PPO.load(args.checkpoint, device="cpu")
+    out = export_policy(model, args.out or os.path.splitext(args.checkpoint)[0] + ".npz")
+    print(f"Exported policy to {out} ({os.path.getsize(out) / 1e3:.1f} kB)")
+    if args.verify:
+        print(verify_export(model, NumpyPolicy.load(out)))
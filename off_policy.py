@@ -0,0 +1,238 @@
+import os
+from typing import NamedTuple
+
+import numpy as np
+import torch as th
+from torch.nn import functional as F
+from stable_baselines3 import DQN
+from stable_baselines3.common.buffers import ReplayBuffer
+
+# Off-policy training mode (conf["algorithm"] = "DQN_PER" in main.run_experiment)
+# Every transition is kept in a prioritized replay buffer and reused utd_ratio times on
+# average, which matters when a hardware step costs more than 10 s. The buffer is saved
+# compactly with every checkpoint and at the end of every session, and can seed later runs.
+
+
+class SumTree:
+    """
+        Binary sum tree over a fixed number of leaves
+
+        Leaves hold priorities, every inner node the sum of its children, so sampling
+        proportionally to priority and updating priorities are both O(log n).
+    """
+    def __init__(self, capacity: int) -> None:
+        self.capacity = 1
+        while self.capacity < capacity:
+            self.capacity *= 2
+        self.tree = np.zeros(2 * self.capacity)
+
+    @property
+    def total(self) -> float:
+        return float(self.tree[1])
+
+    def update(self, leaves, priorities) -> None:
+        nodes = np.asarray(leaves) + self.capacity
+        self.tree[nodes] = priorities
+        nodes = np.unique(nodes // 2)
+        while nodes[0] >= 1:
+            self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+            nodes = np.unique(nodes // 2)
+
+    def get(self, leaves):
+        return self.tree[np.asarray(leaves) + self.capacity]
+
+    def find(self, values):
+        # Leaf index of every prefix-sum value, all values descend the tree together
+        nodes = np.ones(len(values), dtype=np.int64)
+        values = np.array(values, dtype=float)
+        while nodes[0] < self.capacity:
+            left = 2 * nodes
+            go_right = values > self.tree[left]
+            values = np.where(go_right, values - self.tree[left], values)
+            nodes = np.where(go_right, left + 1, left)
+        return nodes - self.capacity
+
+
+class PrioritizedReplayBufferSamples(NamedTuple):
+    observations: th.Tensor
+    actions: th.Tensor
+    next_observations: th.Tensor
+    dones: th.Tensor
+    rewards: th.Tensor
+    discounts: th.Tensor = None
+    weights: th.Tensor = None # Importance-sampling weights, (batch, 1)
+    leaves: np.ndarray = None # Buffer slots, for update_priorities
+
+
+class PrioritizedReplayBuffer(ReplayBuffer):
+    """
+        Proportional prioritized replay (Schaul et al., 2016) on top of the SB3 ReplayBuffer
+
+        New transitions get the current maximum priority. Slot (pos, env) is leaf pos * n_envs + env.
+    """
+    def __init__(self, *args, alpha=0.6, beta=0.4, eps=1e-6, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        assert not self.optimize_memory_usage, "optimize_memory_usage is not supported with prioritized replay"
+        self.alpha = alpha
+        self.beta = beta
+        self.eps = eps
+        self.max_priority = 1.
+        self.tree = SumTree(self.buffer_size * self.n_envs)
+
+    def add(self, obs, next_obs, action, reward, done, infos) -> None:
+        leaves = self.pos * self.n_envs + np.arange(self.n_envs)
+        self.tree.update(leaves, np.full(self.n_envs, self.max_priority ** self.alpha))
+        super().add(obs, next_obs, action, reward, done, infos)
+
+    def sample(self, batch_size: int, env=None) -> PrioritizedReplayBufferSamples:
+        # Stratified sampling: one uniform draw from each of batch_size equal priority segments
+        total = self.tree.total
+        bounds = np.linspace(0., total, batch_size + 1)
+        values = np.random.uniform(bounds[:-1], bounds[1:])
+        leaves = np.minimum(self.tree.find(values), self.size() * self.n_envs - 1)
+        batch_inds, env_indices = leaves // self.n_envs, leaves % self.n_envs
+
+        probabilities = self.tree.get(leaves) / total
+        weights = (self.size() * self.n_envs * probabilities) ** (-self.beta)
+        weights /= weights.max()
+
+        data = (
+            self._normalize_obs(self.observations[batch_inds, env_indices, :], env),
+            self.actions[batch_inds, env_indices, :],
+            self._normalize_obs(self.next_observations[batch_inds, env_indices, :], env),
+            (self.dones[batch_inds, env_indices] * (1 - self.timeouts[batch_inds, env_indices])).reshape(-1, 1),
+            self._normalize_reward(self.rewards[batch_inds, env_indices].reshape(-1, 1), env),
+        )
+        samples = tuple(map(self.to_torch, data))
+        return PrioritizedReplayBufferSamples(*samples, weights=self.to_torch(weights.reshape(-1, 1)), leaves=leaves)
+
+    def update_priorities(self, leaves, td_errors) -> None:
+        priorities = np.abs(td_errors) + self.eps
+        self.max_priority = max(self.max_priority, float(priorities.max()))
+        self.tree.update(leaves, priorities ** self.alpha)
+
+    def save(self, path: str) -> None:
+        """
+            Compact snapshot of the filled part of the buffer, oldest transition first
+
+            Compressed npz, actions stored in the smallest integer type that holds them.
+            Written to a temporary file and renamed like the model checkpoints.
+        """
+        order = np.arange(self.size())
+        if self.full:
+            order = (order + self.pos) % self.buffer_size
+        leaves = order[:, None] * self.n_envs + np.arange(self.n_envs)
+        actions = self.actions[order]
+        if np.issubdtype(actions.dtype, np.integer) and len(actions):
+            actions = actions.astype(np.min_scalar_type(int(actions.max())))
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez_compressed(tmp_path,
+                            observations=self.observations[order],
+                            next_observations=self.next_observations[order],
+                            actions=actions,
+                            rewards=self.rewards[order],
+                            dones=self.dones[order],
+                            timeouts=self.timeouts[order],
+                            priorities=self.tree.get(leaves),
+                            max_priority=np.array(self.max_priority))
+        os.replace(tmp_path, path)
+
+    def load(self, path: str) -> int:
+        # Refill from a snapshot (keeps the newest transitions if it exceeds the capacity), returns the count
+        with np.load(path) as snapshot:
+            count = min(len(snapshot["rewards"]), self.buffer_size)
+            if snapshot["rewards"].shape[1] != self.n_envs:
+                raise ValueError(f"{path} was recorded with {snapshot['rewards'].shape[1]} envs, buffer has {self.n_envs}")
+            start = len(snapshot["rewards"]) - count
+            for name in ["observations", "next_observations", "actions", "rewards", "dones", "timeouts"]:
+                getattr(self, name)[:count] = snapshot[name][start:]
+            priorities = snapshot["priorities"][start:]
+            self.max_priority = float(snapshot["max_priority"])
+        self.tree = SumTree(self.buffer_size * self.n_envs)
+        if count:
+            self.tree.update(np.arange(count * self.n_envs), priorities.reshape(-1))
+        self.pos = count % self.buffer_size
+        self.full = count == self.buffer_size
+        return count
+
+
+def utd_schedule(utd_ratio: float):
+    """
+        Update-to-data ratio -> (train_freq, gradient_steps): 4 -> 4 updates per step, 0.25 -> 1 every 4 steps
+
+        Only whole numbers and their reciprocals can be trained as given, anything else raises
+        ValueError naming the nearest ratio that can, so the logged conf is what actually trains.
+    """
+    if utd_ratio is None or utd_ratio <= 0:
+        raise ValueError(f"utd_ratio must be > 0, got {utd_ratio}")
+    if utd_ratio >= 1:
+        train_freq, gradient_steps = 1, int(round(utd_ratio))
+    else:
+        train_freq, gradient_steps = max(1, int(round(1 / utd_ratio))), 1
+    if not np.isclose(gradient_steps / train_freq, utd_ratio):
+        raise ValueError(f"utd_ratio {utd_ratio} cannot be scheduled, use a whole number or a reciprocal "
+                         f"(nearest: {gradient_steps / train_freq:g})")
+    return train_freq, gradient_steps
+
+
+class PrioritizedDQN(DQN):
+    """
+        DQN trained on a PrioritizedReplayBuffer
+
+        TD losses are weighted by the importance-sampling weights and the new absolute TD
+        errors become the priorities of the sampled transitions. beta is annealed linearly
+        from replay_buffer_kwargs["beta"] to 1 over beta_timesteps environment steps, the
+        whole planned run across sessions (None: the current learn() call).
+    """
+    def __init__(self, *args, beta_timesteps=None, **kwargs) -> None:
+        kwargs.setdefault("replay_buffer_class", PrioritizedReplayBuffer)
+        self.beta_timesteps = beta_timesteps
+        super().__init__(*args, **kwargs)
+
+    def _setup_model(self) -> None:
+        super()._setup_model()
+        # The configured value, not whatever beta the buffer had reached
+        self.beta_start = float(self.replay_buffer_kwargs.get("beta", self.replay_buffer.beta))
+
+    def beta_fraction(self) -> float:
+        if self.beta_timesteps is None:
+            return 1. - self._current_progress_remaining
+        return min(1., self.num_timesteps / max(1, self.beta_timesteps))
+
+    def train(self, gradient_steps: int, batch_size: int = 100) -> None:
+        # Switch to train mode (this affects batch norm / dropout)
+        self.policy.set_training_mode(True)
+        # Update learning rate according to schedule
+        self._update_learning_rate(self.policy.optimizer)
+        self.replay_buffer.beta = self.beta_start + (1. - self.beta_start) * self.beta_fraction()
+
+        losses = []
+        for _ in range(gradient_steps):
+            replay_data = self.replay_buffer.sample(batch_size, env=self._vec_normalize_env)
+            discounts = replay_data.discounts if replay_data.discounts is not None else self.gamma
+
+            with th.no_grad():
+                # 1-step TD target from the greedy action of the target network
+                next_q_values, _ = self.q_net_target(replay_data.next_observations).max(dim=1)
+                next_q_values = next_q_values.reshape(-1, 1)
+                target_q_values = replay_data.rewards + (1 - replay_data.dones) * discounts * next_q_values
+
+            current_q_values = th.gather(self.q_net(replay_data.observations), dim=1, index=replay_data.actions.long())
+
+            # Importance-weighted Huber loss
+            elementwise = F.smooth_l1_loss(current_q_values, target_q_values, reduction="none")
+            loss = (replay_data.weights * elementwise).mean()
+            losses.append(loss.item())
+
+            self.policy.optimizer.zero_grad()
+            loss.backward()
+            th.nn.utils.clip_grad_norm_(self.policy.parameters(), self.max_grad_norm)
+            self.policy.optimizer.step()
+
+            td_errors = (current_q_values - target_q_values).detach().cpu().numpy().reshape(-1)
+            self.replay_buffer.update_priorities(replay_data.leaves, td_errors)
+
+        self._n_updates += gradient_steps
+        self.logger.record("train/n_updates", self._n_updates, exclude="tensorboard")
+        self.logger.record("train/loss", np.mean(losses))
+        self.logger.record("train/per_beta", self.replay_buffer.beta)
@@ -0,0 +1,96 @@
+import argparse
+import json
+import os
+
+import numpy as np
+
+import utilities
+from environment import InterferenceEnvironment
+from utilities import Config
+
+# Exhaustive oracle baseline: at every step score all actions with InterferenceEnvironment.evaluateActions
+# and compare the policy's choice with the best achievable reward (simulation only)
+#   python oracle.py --checkpoint ./Experiment/1/model_session_9.zip --episodes 5
+
+
+class RandomPolicy:
+    def __init__(self, n_actions, seed=None) -> None:
+        self.n_actions = n_actions
+        self.rng = np.random.RandomState(seed)
+
+    def predict(self, obs, deterministic=True):
+        return self.rng.randint(self.n_actions), None
+
+
+def load_any_policy(path):
+    # .npz -> torch-free NumpyPolicy, anything else -> PPO checkpoint
+    if path.endswith(".npz"):
+        from numpy_policy import NumpyPolicy
+        return NumpyPolicy.load(path)
+    from stable_baselines3 import PPO
+    return PPO.load(path, device="cpu")
+
+
+def optimality_gap(env, policy, n_episodes=5, episode_steps=100, seed=0, deterministic=True) -> dict:
+    """
+        Step the environment with a policy and record the per-step optimality gap
+
+        gap = max_a reward(a) - reward(policy action), both computed on the same state before
+        the step is taken. Returns per-step arrays and summary statistics.
+    """
+    gaps, policy_rewards, oracle_rewards, optimal = [], [], [], []
+    oracle_actions, policy_actions = [], []
+    for episode in range(n_episodes):
+        obs, _ = env.reset(seed=seed + episode)
+        for _ in range(episode_steps):
+            rewards = env.evaluateActions().reward
+            best = int(np.argmax(rewards))
+            action, _ = policy.predict(obs, deterministic=deterministic)
+            action = int(action)
+
+            oracle_rewards.append(float(rewards[best]))
+            policy_rewards.append(float(rewards[action]))
+            gaps.append(float(rewards[best] - rewards[action]))
+            optimal.append(bool(np.isclose(rewards[action], rewards[best])))
+            oracle_actions.append(best)
+            policy_actions.append(action)
+            obs, _, _, _, _ = env.step(action)
+
+    gaps = np.asarray(gaps)
+    return {
+        "steps": len(gaps),
+        "mean_gap": float(gaps.mean()),
+        "max_gap": float(gaps.max()),
+        "p95_gap": float(np.percentile(gaps, 95)),
+        "optimal_fraction": float(np.mean(optimal)),
+        "mean_policy_reward": float(np.mean(policy_rewards)),
+        "mean_oracle_reward": float(np.mean(oracle_rewards)),
+        "per_step": {
+            "gap": gaps.tolist(),
+            "policy_action": policy_actions,
+            "oracle_action": oracle_actions,
+            "oracle_allocation": [[int(prb) for prb in env.actions_list[idx]] for idx in oracle_actions],
+        },
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Oracle baseline and optimality gap of a policy")
+    parser.add_argument("--checkpoint", type=str, default="", help="PPO .zip or exported .npz (default: random policy)")
+    parser.add_argument("--episodes", type=int, default=5, help="Number of episodes")
+    parser.add_argument("--episode_steps", type=int, default=100, help="Steps per episode")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the first episode")
+    parser.add_argument("--out", type=str, default="./oracle_gap.json", help="Output JSON")
+    args = parser.parse_args()
+
+    utilities.PRE_TRAIN = True
+    env = InterferenceEnvironment(Config())
+    policy = load_any_policy(args.checkpoint) if args.checkpoint else RandomPolicy(env.action_space.n, args.seed)
+    report = optimality_gap(env, policy, args.episodes, args.episode_steps, args.seed)
+    report["checkpoint"] = args.checkpoint or "random"
+
+    with open(args.out, "w") as file:
+        json.dump(report, file, indent=4)
+    print(f"Optimality gap {report['mean_gap']:.4f} per step (oracle {report['mean_oracle_reward']:.4f}, "
+          f"policy {report['mean_policy_reward']:.4f}, optimal {100 * report['optimal_fraction']:.1f}% of "
+          f"{report['steps']} steps) -> {os.path.abspath(args.out)}")
@@ -0,0 +1,117 @@
+import numpy as np
+
+import utilities
+
+# Physical-layer throughput model (backend="sinr" in process_tasks)
+# Positions -> gNB/UE gain matrix -> per-PRB SINR with interference from aggressor gNBs on the
+# overlapping PRBs of Config.interference_pairs -> capped Shannon throughput summed over the
+# PRBs each UE is scheduled on. Everything broadcasts over a leading (envs,) / (actions,) axis.
+#
+# PRB placement follows the interference model of the environment: gNBs that are not victims
+# place their UEs contiguously from PRB 0 in user order, victim gNBs (gNB1) fill the PRBs that
+# no aggressor currently hits first and only then the interfered ones.
+
+FSPL_CONST_DB = 37.75 # 20log10(4*pi*f_dl/c) + 60 for f_dl = 1842.5 MHz, distance in m
+THERMAL_NOISE_DBM_HZ = -174.
+
+
+def free_space_path_loss(distance):
+    # FSPL in dB, distance in m (clamped to 1 m to avoid log(0) when a UE is on top of its gNB)
+    return 20 * np.log10(np.maximum(distance, 1.0)) + FSPL_CONST_DB
+
+
+class PhyModel:
+    def __init__(self, global_config) -> None:
+        self.gc = global_config
+        phy = global_config.phy
+        self.gnb_ids = sorted(global_config.gnbs)
+        self.gnb_pos = np.array([[global_config.gnbs[g]["pos"]["x"], global_config.gnbs[g]["pos"]["y"]]
+                                 for g in self.gnb_ids])
+        self.row_of = {gnb_id: row for row, gnb_id in enumerate(self.gnb_ids)}
+        self.n_prb = utilities.PRB_PER_GNB
+
+        self.prb_bandwidth = phy["prb_bandwidth_hz"]
+        self.efficiency = phy["efficiency"]
+        self.max_se = phy["max_spectral_efficiency"]
+        # Transmit power is split evenly over all PRBs of a gNB
+        tx_prb_dbm = phy["tx_power_dbm"] - 10 * np.log10(self.n_prb)
+        noise_dbm = THERMAL_NOISE_DBM_HZ + 10 * np.log10(self.prb_bandwidth) + phy["noise_figure_db"]
+        self.tx_prb_mw = 10 ** (tx_prb_dbm / 10)
+        self.noise_mw = 10 ** (noise_dbm / 10)
+
+        # Aggressor PRB -> victim PRB overlap matrices, one per interference pair
+        self.pairs = []
+        for pair in global_config.interference_pairs:
+            overlap = np.zeros((self.n_prb, self.n_prb))
+            overlap[list(pair["aggressor_prbs"]), list(pair["victim_prbs"])] = 1.
+            self.pairs.append((self.row_of[pair["aggressor_gnb"]], self.row_of[pair["victim_gnb"]], overlap))
+        self.victims = {victim for _, victim, _ in self.pairs}
+        assert not self.victims & {aggressor for aggressor, _, _ in self.pairs}, \
+            "Chained interference (a victim gNB that is also an aggressor) is not supported"
+
+    def gains(self, ue_pos):
+        # Linear channel gain of every gNB at every UE, ue_pos (..., users, 2) -> (..., users, gNBs)
+        distance = np.linalg.norm(np.asarray(ue_pos, dtype=float)[..., :, None, :] - self.gnb_pos, axis=-1)
+        return 10 ** (-free_space_path_loss(distance) / 10)
+
+    def _contiguous_masks(self, prb, rows, order):
+        # PRB masks (..., users, PRBs): consecutive UEs of a gNB take consecutive slots of `order`
+        # (order = rank of every PRB in that gNB's filling sequence)
+        start = np.zeros_like(prb)
+        for row in np.unique(rows):
+            users = rows == row
+            start[..., users] = np.cumsum(prb[..., users], axis=-1) - prb[..., users]
+        slot = order[..., None, :] if order.ndim > 1 else order
+        return (slot >= start[..., None]) & (slot < (start + prb)[..., None])
+
+    def throughput(self, prb, gnb_ids, ue_pos):
+        """
+            Throughput in bits/s of every UE
+
+            prb: scheduled PRBs per UE (..., users), gnb_ids: serving gNB per UE (users,),
+            ue_pos: UE positions (..., users, 2). Returns (..., users).
+        """
+        prb = np.asarray(prb, dtype=float)
+        rows = np.array([self.row_of[g] for g in np.asarray(gnb_ids).ravel()])
+        gain = self.gains(ue_pos)
+        shape = np.broadcast_shapes(prb.shape, gain.shape[:-1])
+        prb = np.broadcast_to(prb, shape)
+        gain = np.broadcast_to(gain, shape + gain.shape[-1:])
+
+        # Aggressor gNBs: contiguous from PRB 0
+        masks = self._contiguous_masks(prb, rows, np.arange(self.n_prb))
+        occupancy = np.zeros(shape[:-1] + (len(self.gnb_ids), self.n_prb), dtype=bool)
+        for row in np.unique(rows):
+            if row not in self.victims:
+                occupancy[..., row, :] = masks[..., rows == row, :].any(axis=-2)
+
+        # Interference power on every PRB at every UE (..., users, PRBs), only victim UEs receive any
+        interference = np.zeros(shape + (self.n_prb,))
+        victim_hit = {}
+        for aggressor, victim, overlap in self.pairs:
+            hit = occupancy[..., aggressor, :].astype(float) @ overlap
+            victim_hit[victim] = victim_hit.get(victim, 0.) + hit
+            users = rows == victim
+            interference[..., users, :] += self.tx_prb_mw * gain[..., users, aggressor, None] * hit[..., None, :]
+
+        # Victim gNBs: clean PRBs first (stable, so ties keep PRB order)
+        for victim, hit in victim_hit.items():
+            users = rows == victim
+            if not users.any():
+                continue
+            order = np.argsort(np.argsort(hit > 0, axis=-1, kind="stable"), axis=-1, kind="stable")
+            masks[..., users, :] = self._contiguous_masks(prb[..., users], rows[users], order)
+
+        signal = self.tx_prb_mw * gain[..., np.arange(len(rows)), rows]
+        sinr = signal[..., None] / (self.noise_mw + interference)
+        spectral_eff = np.minimum(self.efficiency * np.log2(1 + sinr), self.max_se)
+        return self.prb_bandwidth * np.sum(spectral_eff * masks, axis=-1)
+
+
+_MODELS = {}
+
+def default_model() -> PhyModel:
+    # Model of the default Config, shared by every simulated step of this process
+    if "default" not in _MODELS:
+        _MODELS["default"] = PhyModel(utilities.Config())
+    return _MODELS["default"]
@@ -0,0 +1,181 @@
+import numpy as np
+
+import utilities
+
+# Streaming per-user / per-gNB QoS statistics (InterferenceEnvironment.qos_episode / qos_total)
+# Constant memory whatever the number of steps: running means and variances (Welford) and
+# log-spaced histograms for the duration / bit rate quantiles, all updated in place from the
+# arrays UsersHandler.stepInfo already returns. Statistics of several environments (or
+# processes) combine with merge(), see callbacks.QoSLoggingCallback.
+
+DURATION_RANGE_MS = (1e0, 1e8)   # Durations outside the range (incl. inf at 0 throughput) fall in the end bins
+BIT_RATE_RANGE = (1e1, 1e9)      # Bytes/s
+HISTOGRAM_BINS = 256             # 8 decades -> bin edges ~7.5% apart, the quantile error bound
+QUANTILES = (0.05, 0.5, 0.95)
+
+
+class RunningMoments:
+    # Elementwise Welford mean / variance over arrays of a fixed shape
+    def __init__(self, shape) -> None:
+        self.count = 0
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)
+
+    def update(self, x) -> None:
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+
+    def merge(self, other: "RunningMoments") -> None:
+        # Chan et al. parallel combination
+        count = self.count + other.count
+        if count == 0:
+            return
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta ** 2 * self.count * other.count / count
+        self.count = count
+
+    @property
+    def std(self):
+        return np.sqrt(self.m2 / max(1, self.count - 1))
+
+
+class LogHistogram:
+    # Quantile sketch: counts on HISTOGRAM_BINS log-spaced bins per element of a fixed shape
+    def __init__(self, shape, value_range, bins=HISTOGRAM_BINS) -> None:
+        self.log_lo, self.log_hi = np.log10(value_range[0]), np.log10(value_range[1])
+        self.bins = bins
+        self.scale = bins / (self.log_hi - self.log_lo)
+        self.counts = np.zeros(tuple(np.atleast_1d(shape)) + (bins,), dtype=np.int64)
+        self.offsets = np.arange(int(np.prod(shape))) * bins
+
+    def update(self, x) -> None:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            idx = (np.log10(x) - self.log_lo) * self.scale
+        # fmax / fmin drop NaN in favour of the bound, +-inf land in the end bins
+        idx = np.fmin(np.fmax(idx, 0.), self.bins - 1).astype(np.int64)
+        # One bin per element, so plain fancy-index increments never collide
+        self.counts.reshape(-1)[self.offsets + idx.reshape(-1)] += 1
+
+    def merge(self, other: "LogHistogram") -> None:
+        self.counts += other.counts
+
+    def quantile(self, q: float):
+        # Interpolated geometrically inside the bin that crosses q, NaN while empty
+        cumulative = np.cumsum(self.counts, axis=-1)
+        total = cumulative[..., -1:]
+        target = q * total
+        idx = np.minimum((cumulative < target).sum(axis=-1), self.bins - 1)
+        below = np.where(idx > 0, np.take_along_axis(cumulative, np.maximum(idx - 1, 0)[..., None], -1)[..., 0], 0)
+        in_bin = np.take_along_axis(self.counts, idx[..., None], -1)[..., 0]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            fraction = np.clip((target[..., 0] - below) / in_bin, 0., 1.)
+            value = 10 ** (self.log_lo + (idx + fraction) / self.scale)
+        return np.where(total[..., 0] > 0, value, np.nan)
+
+
+class QoSStats:
+    """
+        Streaming QoS statistics of one environment over users and gNBs
+
+        A step violates a user's SLA when its clipped reward is below 0 (rate, interval or
+        delivery target missed). Per gNB: allocated PRBs, PRBs lost to interference (victim
+        gNBs, i.e. gNB1 / User 0: PRB_PER_GNB minus the allocation) and the fraction of steps
+        in which any of its users violated its SLA.
+    """
+    def __init__(self, global_config) -> None:
+        scenarios = global_config.user_scenarios
+        self.user_ids = [s["user_id"] for s in scenarios]
+        self.categories = [s["type"] for s in scenarios]
+        user_gnbs = np.array([s["gnb_id"] for s in scenarios])
+        self.gnb_ids = sorted(set(user_gnbs.tolist()))
+        self.membership = (user_gnbs[None, :] == np.array(self.gnb_ids)[:, None]).astype(float)
+        victims = {pair["victim_gnb"] for pair in global_config.interference_pairs}
+        self.is_victim = np.array([gnb_id in victims for gnb_id in self.gnb_ids])
+        self.reset()
+
+    def reset(self) -> None:
+        n_users, n_gnbs = len(self.user_ids), len(self.gnb_ids)
+        # Rows: reward, duration_ms, bit_rate, violation
+        self.user_moments = RunningMoments((4, n_users))
+        # Rows: allocated PRBs, PRB loss, any violation
+        self.gnb_moments = RunningMoments((3, n_gnbs))
+        self.duration_hist = LogHistogram(n_users, DURATION_RANGE_MS)
+        self.bit_rate_hist = LogHistogram(n_users, BIT_RATE_RANGE)
+        self._user_row = np.zeros((4, n_users)) # Update buffers, avoid allocating per step
+        self._gnb_row = np.zeros((3, n_gnbs))
+
+    @property
+    def steps(self) -> int:
+        return self.user_moments.count
+
+    def update(self, info: dict, prb) -> dict:
+        """
+            Adds one step (UsersHandler.stepInfo arrays, PRBs per user in user order)
+
+            Returns the per-step values surfaced in the environment's info dict.
+        """
+        duration = info["duration"]
+        violation = info["reward_per_user"] < 0.
+        prb = np.asarray(prb, dtype=float)
+        user_row, gnb_row = self._user_row, self._gnb_row
+        user_row[0] = info["reward_per_user"]
+        np.minimum(duration, DURATION_RANGE_MS[1], out=user_row[1])
+        user_row[2] = info["bit_rate"]
+        user_row[3] = violation
+        np.dot(self.membership, prb, out=gnb_row[0])
+        gnb_row[1] = self.is_victim * (utilities.PRB_PER_GNB - gnb_row[0])
+        np.dot(self.membership, user_row[3], out=gnb_row[2])
+        np.minimum(gnb_row[2], 1., out=gnb_row[2])
+
+        self.user_moments.update(user_row)
+        self.gnb_moments.update(gnb_row)
+        self.duration_hist.update(duration)
+        self.bit_rate_hist.update(info["bit_rate"])
+        return {"sla_violation": violation, "prb": prb, "gnb_prb_loss": gnb_row[1].copy()}
+
+    def merge(self, other: "QoSStats") -> "QoSStats":
+        self.user_moments.merge(other.user_moments)
+        self.gnb_moments.merge(other.gnb_moments)
+        self.duration_hist.merge(other.duration_hist)
+        self.bit_rate_hist.merge(other.bit_rate_hist)
+        return self
+
+    def summary(self) -> dict:
+        # JSON-friendly snapshot, durations in ms and bit rates in Bytes/s
+        user_mean, user_std = self.user_moments.mean, self.user_moments.std
+        duration_q = [self.duration_hist.quantile(q) for q in QUANTILES]
+        bit_rate_q = [self.bit_rate_hist.quantile(q) for q in QUANTILES]
+        users = {}
+        for u, (user_id, category) in enumerate(zip(self.user_ids, self.categories)):
+            users[user_id] = {
+                "category": category,
+                "mean_reward": float(user_mean[0, u]),
+                "mean_duration_ms": float(user_mean[1, u]),
+                "std_duration_ms": float(user_std[1, u]),
+                "mean_bit_rate": float(user_mean[2, u]),
+                "sla_violation_fraction": float(user_mean[3, u]),
+                **{f"duration_ms_p{int(q * 100):02d}": float(duration_q[i][u]) for i, q in enumerate(QUANTILES)},
+                **{f"bit_rate_p{int(q * 100):02d}": float(bit_rate_q[i][u]) for i, q in enumerate(QUANTILES)},
+            }
+        gnbs = {}
+        for g, gnb_id in enumerate(self.gnb_ids):
+            gnbs[gnb_id] = {"mean_prb": float(self.gnb_moments.mean[0, g]),
+                            "mean_prb_loss": float(self.gnb_moments.mean[1, g]),
+                            "sla_violation_fraction": float(self.gnb_moments.mean[2, g])}
+        return {"steps": self.steps, "users": users, "gnbs": gnbs}
+
+    def scalars(self, prefix="qos") -> dict:
+        # Flat {name: value} view of summary() for loggers
+        summary = self.summary()
+        flat = {}
+        for user_id, stats in summary["users"].items():
+            for name, value in stats.items():
+                if name != "category":
+                    flat[f"{prefix}/user{user_id}_{name}"] = value
+        for gnb_id, stats in summary["gnbs"].items():
+            for name, value in stats.items():
+                flat[f"{prefix}/gnb{gnb_id}_{name}"] = value
+        return flat
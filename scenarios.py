@@ -0,0 +1,124 @@
+import argparse
+import os
+
+import numpy as np
+
+import utilities
+from utilities import Config
+from phy_model import free_space_path_loss
+
+# Pre-generated scenario dataset for reproducible, nearly free resets
+# One scenario = initial UE positions and velocities plus the traffic demand of every step,
+# drawn from the same distributions as User / User.generateTask. The dataset is an
+# uncompressed .npz, memory-mapped by every environment that uses it:
+#   python scenarios.py --n_scenarios 10000 --n_steps 101 --out ./scenarios.npz
+# and enabled with Config.scenario_path (InterferenceEnvironment.reset then loads scenario
+# options["scenario"], seed % n_scenarios, or the next one in order).
+
+DEMAND_CATEGORIES = {"eMBB_high": "bit_rate", "eMBB_low": "bit_rate",
+                     "URLLC": "gen_bytes", "mMTC_high": "gen_bytes", "mMTC_low": "gen_bytes"}
+
+
+def position_bounds(gc, gnb_id) -> dict:
+    return {1: gc.gnb1_ue_position_bound, 2: gc.gnb2_ue_position_bound, 3: gc.gnb3_ue_position_bound}[gnb_id]
+
+
+def generate_scenarios(gc, n_scenarios, n_steps, seed=0) -> dict:
+    """
+        Draw n_scenarios scenarios of n_steps task generations for the users of gc
+
+        Returns positions / velocities (S, users, 2), path_loss (S, users) in dB, demand (S, n_steps, users) holding bit_rate
+        (eMBB) or gen_size (URLLC, mMTC) in Bytes, gen_freq (S, n_steps, users, 0 for eMBB) and
+        the topology (user_ids, gnb_ids, categories) the scenarios were drawn for.
+    """
+    rng = np.random.RandomState(seed)
+    n_users = len(gc.user_scenarios)
+    positions = np.zeros((n_scenarios, n_users, 2))
+    velocities = np.zeros((n_scenarios, n_users, 2))
+    demand = np.zeros((n_scenarios, n_steps, n_users), dtype=np.int32)
+    gen_freq = np.zeros((n_scenarios, n_steps, n_users), dtype=np.int16)
+
+    for u, scenario in enumerate(gc.user_scenarios):
+        bound = position_bounds(gc, scenario["gnb_id"])
+        for axis, name in enumerate(["x", "y"]):
+            positions[:, u, axis] = rng.uniform(bound[name]["min"], bound[name]["max"], n_scenarios)
+            velocities[:, u, axis] = rng.uniform(gc.ue_velocity_bound[name]["min"],
+                                                 gc.ue_velocity_bound[name]["max"], n_scenarios)
+        spec = gc.ue_task_gen_spec[scenario["type"]]
+        key = DEMAND_CATEGORIES[scenario["type"]]
+        demand[:, :, u] = rng.randint(int(spec[key]["min"]), int(spec[key]["max"]) + 1, (n_scenarios, n_steps))
+        if key == "gen_bytes":
+            gen_freq[:, :, u] = rng.randint(spec["gen_freq"]["min"], spec["gen_freq"]["max"] + 1, (n_scenarios, n_steps))
+
+    gnb_pos = np.array([[gc.gnbs[s["gnb_id"]]["pos"]["x"], gc.gnbs[s["gnb_id"]]["pos"]["y"]] for s in gc.user_scenarios])
+    path_loss = free_space_path_loss(np.linalg.norm(positions - gnb_pos, axis=-1))
+
+    return {"positions": positions, "velocities": velocities, "path_loss": path_loss,
+            "demand": demand, "gen_freq": gen_freq,
+            "user_ids": np.array([s["user_id"] for s in gc.user_scenarios]),
+            "gnb_ids": np.array([s["gnb_id"] for s in gc.user_scenarios]),
+            "categories": np.array([s["type"] for s in gc.user_scenarios])}
+
+
+def save_scenarios(scenarios: dict, out_path) -> str:
+    # Uncompressed so load_npz_mmap can map it, renamed into place once complete
+    tmp_path = f"{out_path}.{os.getpid()}.tmp.npz"
+    np.savez(tmp_path, **scenarios)
+    os.replace(tmp_path, out_path)
+    return out_path
+
+
+class ScenarioSet:
+    def __init__(self, arrays, gc=None) -> None:
+        # Plain ndarray views of the mapping (np.memmap indexing is several times slower)
+        self.positions = np.asarray(arrays["positions"])
+        self.velocities = np.asarray(arrays["velocities"])
+        self.path_loss = np.asarray(arrays["path_loss"])
+        self.demand = np.asarray(arrays["demand"])
+        self.gen_freq = np.asarray(arrays["gen_freq"])
+        self.user_ids = arrays["user_ids"]
+        if gc is not None:
+            expected = [(s["user_id"], s["gnb_id"], s["type"]) for s in gc.user_scenarios]
+            found = list(zip(arrays["user_ids"].tolist(), arrays["gnb_ids"].tolist(), arrays["categories"].tolist()))
+            if expected != found:
+                raise ValueError(f"Scenario topology {found} does not match Config.user_scenarios {expected}")
+
+    @classmethod
+    def load(cls, path, gc=None) -> "ScenarioSet":
+        return cls(utilities.load_npz_mmap(path), gc)
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    @property
+    def n_steps(self) -> int:
+        return self.demand.shape[1]
+
+    def scenario(self, k: int) -> tuple:
+        # Scenario k as (positions, velocities, path_loss) lists and (steps, users) demand / gen_freq views
+        return (self.positions[k].tolist(), self.velocities[k].tolist(), self.path_loss[k].tolist(),
+                self.demand[k], self.gen_freq[k])
+
+
+_SETS = {}
+
+def load_scenario_set(path, gc=None) -> ScenarioSet:
+    # One mapping per file and process, shared by every environment that replays it
+    if path not in _SETS:
+        _SETS[path] = ScenarioSet.load(path, gc)
+    elif gc is not None:
+        ScenarioSet(utilities.load_npz_mmap(path), gc)
+    return _SETS[path]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a memory-mapped scenario dataset")
+    parser.add_argument("--n_scenarios", type=int, default=10000, help="Number of scenarios")
+    parser.add_argument("--n_steps", type=int, default=101, help="Task generations per scenario (episode steps + 1 for reset)")
+    parser.add_argument("--seed", type=int, default=0, help="Generator seed")
+    parser.add_argument("--out", type=str, default="./scenarios.npz", help="Output dataset (.npz)")
+    args = parser.parse_args()
+
+    out = save_scenarios(generate_scenarios(Config(), args.n_scenarios, args.n_steps, args.seed), args.out)
+    print(f"{args.n_scenarios} scenarios x {args.n_steps} steps written to {os.path.abspath(out)} "
+          f"({os.path.getsize(out) / 1e6:.1f} MB)")
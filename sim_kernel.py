@@ -0,0 +1,181 @@
+from collections import namedtuple
+
+import numpy as np
+
+import utilities
+
+# Vectorized simulator kernel: PRB allocation -> throughput -> task duration -> clipped QoS reward.
+# Every function accepts arrays shaped (users,) or (envs, users) and broadcasts elementwise,
+# reward totals are summed over the last (user) axis.
+
+URLLC = utilities.CATEGORY_ENUM["URLLC"]
+EMBB_HIGH = utilities.CATEGORY_ENUM["eMBB_high"]
+EMBB_LOW = utilities.CATEGORY_ENUM["eMBB_low"]
+MMTC_HIGH = utilities.CATEGORY_ENUM["mMTC_high"]
+MMTC_LOW = utilities.CATEGORY_ENUM["mMTC_low"]
+
+# Linear throughput regressions in Mbps as a function of the allocated PRBs
+SDR_GNB_ID = 1
+SDR_TPT_COEF = (0.4341, 3.4841)      # SDR-based gNB1 (Hardware specific regression)
+VIRTUAL_TPT_COEF = (0.1752, -0.0648) # Virtual gNB2, gNB3 (Software specific regression)
+
+URLLC_SEND_MS = 500.
+
+StepResult = namedtuple("StepResult", ["duration", "bit_rate", "reward_per_user", "reward"])
+
+
+def ratio_to_prb(prb_ratio, prb_per_gnb=utilities.PRB_PER_GNB):
+    # Same truncation as int((prb_ratio / 100.0) * PRB_PER_GNB), ratios are never negative
+    return np.trunc((np.asarray(prb_ratio, dtype=float) / 100.0) * prb_per_gnb)
+
+
+def regression_throughput(prb, gnb_ids):
+    # Returns throughput in bits/s
+    prb = np.asarray(prb, dtype=float)
+    sdr = (SDR_TPT_COEF[0] * prb + SDR_TPT_COEF[1]) * 1e6
+    virtual = (VIRTUAL_TPT_COEF[0] * prb + VIRTUAL_TPT_COEF[1]) * 1e6
+    return np.where(np.asarray(gnb_ids) == SDR_GNB_ID, sdr, virtual)
+
+
+def task_metrics(tpt_bps, demand, duration_s=utilities.DATA_GATHERING_DURATION):
+    """
+        Time needed to deliver one data gathering window worth of traffic
+
+        demand: offered load in Bytes/s (bit_rate for eMBB, gen_size * gen_freq otherwise)
+        Returns (duration in ms, bit rate in Bytes/s)
+    """
+    total_bytes = np.trunc(np.asarray(demand, dtype=float) * duration_s)
+    bit_rate_bytes = np.asarray(tpt_bps, dtype=float) / 8.
+    with np.errstate(divide="ignore", invalid="ignore"):
+        duration = total_bytes / bit_rate_bytes
+    return duration * 1000, bit_rate_bytes
+
+
+def qos_reward(categories, duration_ms, demand, gen_freq=None,
+               duration_s=utilities.DATA_GATHERING_DURATION, send_ms=URLLC_SEND_MS):
+    """
+        Per-user reward clipped to [-1, 0] and the total over users (last axis)
+
+        Mirrors UsersHandler.calculateReward: URLLC is scored on average buffer transmission
+        time, eMBB on achieved bandwidth and mMTC on delivered bytes.
+    """
+    categories = np.asarray(categories)
+    duration_ms = np.asarray(duration_ms, dtype=float)
+    demand = np.asarray(demand, dtype=float)
+    gen_freq = np.ones_like(demand) if gen_freq is None else np.asarray(gen_freq, dtype=float)
+
+    is_urllc = categories == URLLC
+    is_embb = (categories == EMBB_HIGH) | (categories == EMBB_LOW)
+    is_mmtc = (categories == MMTC_HIGH) | (categories == MMTC_LOW)
+    if not np.all(is_urllc | is_embb | is_mmtc):
+        raise ValueError("Invalid category [reward calculation]")
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # URLLC: average interval in ms
+        avg_buffer_transmission_time = duration_ms / (gen_freq * duration_s)
+        m_urllc = (send_ms - avg_buffer_transmission_time) / send_ms
+        # eMBB: average bandwidth in Bytes/sec
+        total_bytes = demand * duration_s * 1.
+        avg_bandwidth = total_bytes / (duration_ms / 1000)
+        m_embb = (avg_bandwidth - demand) / demand
+        # mMTC: delivered bytes over the gathering window
+        expected_bytes = demand * duration_s
+        got_bytes = expected_bytes * (duration_s / (duration_ms / 1000))
+        m_mmtc = (got_bytes - expected_bytes) / expected_bytes
+
+    m = np.where(is_urllc, m_urllc, np.where(is_embb, m_embb, m_mmtc))
+    reward_per_user = np.clip(m, -1.0, 0.)
+    return reward_per_user, reward_per_user.sum(axis=-1)
+
+
+def execute_and_reward(prb, gnb_ids, categories, demand, gen_freq=None,
+                       duration_s=utilities.DATA_GATHERING_DURATION, send_ms=URLLC_SEND_MS,
+                       tpt_bps=None, reference=False, check=False) -> StepResult:
+    """
+        Combined executor + reward kernel for one simulated step
+
+        prb, gnb_ids, categories, demand (and gen_freq for URLLC) are shaped (users,) or
+        (envs, users). tpt_bps overrides the linear regression when another throughput model
+        is used. reference=True runs the original per-user Python loop instead, check=True
+        runs both and asserts they agree.
+    """
+    if reference:
+        return _execute_and_reward_reference(prb, gnb_ids, categories, demand, gen_freq,
+                                             duration_s, send_ms, tpt_bps)
+    if tpt_bps is None:
+        tpt_bps = regression_throughput(prb, gnb_ids)
+    duration, bit_rate = task_metrics(tpt_bps, demand, duration_s)
+    reward_per_user, reward = qos_reward(categories, duration, demand, gen_freq, duration_s, send_ms)
+    result = StepResult(duration, bit_rate, reward_per_user, reward)
+
+    if check:
+        expected = _execute_and_reward_reference(prb, gnb_ids, categories, demand, gen_freq,
+                                                 duration_s, send_ms, tpt_bps)
+        for name, got, ref in zip(StepResult._fields, result, expected):
+            assert np.allclose(got, ref, rtol=1e-9, atol=0., equal_nan=True), \
+                f"Kernel mismatch in {name}: {got} != {ref}"
+    return result
+
+
+def _execute_and_reward_reference(prb, gnb_ids, categories, demand, gen_freq,
+                                  duration_s, send_ms, tpt_bps):
+    # Scalar reference with the exact semantics of process_tasks + calculateReward
+    prb = np.asarray(prb, dtype=float)
+    gnb_ids = np.broadcast_to(gnb_ids, prb.shape)
+    categories = np.broadcast_to(categories, prb.shape)
+    demand = np.broadcast_to(np.asarray(demand, dtype=float), prb.shape)
+    gen_freq = np.broadcast_to(1. if gen_freq is None else np.asarray(gen_freq, dtype=float), prb.shape)
+    if tpt_bps is not None:
+        tpt_bps = np.broadcast_to(np.asarray(tpt_bps, dtype=float), prb.shape)
+
+    duration = np.zeros(prb.shape)
+    bit_rate = np.zeros(prb.shape)
+    reward_per_user = np.zeros(prb.shape)
+    for idx in np.ndindex(prb.shape):
+        if tpt_bps is not None:
+            tpt = float(tpt_bps[idx])
+        elif gnb_ids[idx] == SDR_GNB_ID:
+            tpt = ((SDR_TPT_COEF[0] * prb[idx] + SDR_TPT_COEF[1]) * 1e6)
+        else:
+            tpt = ((VIRTUAL_TPT_COEF[0] * prb[idx] + VIRTUAL_TPT_COEF[1]) * 1e6)
+
+        total_bytes = int(demand[idx] * duration_s)
+        bit_rate[idx] = tpt / 8.
+        duration[idx] = total_bytes / bit_rate[idx] * 1000
+
+        if categories[idx] == URLLC:
+            number_of_sent_buffers = gen_freq[idx] * duration_s
+            m = (send_ms - duration[idx] / number_of_sent_buffers) / send_ms
+        elif categories[idx] in (EMBB_HIGH, EMBB_LOW):
+            avg_bandwidth = demand[idx] * duration_s * 1. / (duration[idx] / 1000)
+            m = (avg_bandwidth - demand[idx]) / demand[idx]
+        elif categories[idx] in (MMTC_HIGH, MMTC_LOW):
+            expected_bytes = demand[idx] * duration_s
+            got_bytes = expected_bytes * (duration_s / (duration[idx] / 1000))
+            m = (got_bytes - expected_bytes) / expected_bytes
+        else:
+            raise ValueError("Invalid category [reward calculation]")
+        reward_per_user[idx] = np.max([-1.0, np.min([0., m])])
+    return StepResult(duration, bit_rate, reward_per_user, reward_per_user.sum(axis=-1))
+
+
+def task_arrays(tasks):
+    """
+        Flatten a task queue into kernel input arrays (in queue order)
+
+        Returns dict with gnb_ids, categories, demand (Bytes/s) and gen_freq
+    """
+    n = len(tasks)
+    gnb_ids = np.empty(n, dtype=np.int64)
+    categories = np.empty(n, dtype=np.int64)
+    demand = np.empty(n, dtype=float)
+    gen_freq = np.ones(n, dtype=float)
+    for idx, task in enumerate(tasks):
+        gnb_ids[idx] = task["gnb_id"]
+        categories[idx] = utilities.CATEGORY_ENUM[task["task_type"]]
+        if task["task_type"] in ["URLLC", "mMTC_low", "mMTC_high"]:
+            gen_freq[idx] = task.get("gen_freq", 1)
+            demand[idx] = task.get("gen_size", 1000) * gen_freq[idx]
+        else:
+            demand[idx] = task["bit_rate"]
+    return {"gnb_ids": gnb_ids, "categories": categories, "demand": demand, "gen_freq": gen_freq}
@@ -0,0 +1,131 @@
+import argparse
+import csv
+import itertools
+import json
+import multiprocessing as mp
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import main
+
+# Local parameter sweep over run_experiment on a single many-core node
+#   python sweep.py --grid '{"learning_rate": [1e-3, 3e-4], "n_epochs": [10, 20]}' --threads_per_job 2
+# Every job runs in its own spawned process pinned to a disjoint CPU set with a matching torch
+# thread count, experiment folders are claimed atomically by main.allocate_experiment_dir.
+
+_WORKER = {}
+THREAD_VARS = ["OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"]
+
+
+def expand_grid(grid: dict, base_conf: dict) -> list:
+    # {"a": [1, 2], "b": [3]} -> [{**base, a: 1, b: 3}, {**base, a: 2, b: 3}]
+    keys = sorted(grid)
+    return [{**base_conf, **dict(zip(keys, values))} for values in itertools.product(*(grid[key] for key in keys))]
+
+
+def cpu_sets(threads_per_job: int, max_jobs=None) -> list:
+    # Split the CPUs this process may run on into disjoint, equally sized sets
+    cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count()))
+    n_sets = max(1, len(cpus) // threads_per_job)
+    if max_jobs is not None:
+        n_sets = min(n_sets, max_jobs)
+    return [cpus[k * threads_per_job:(k + 1) * threads_per_job] or cpus for k in range(n_sets)]
+
+
+def _init_worker(slots) -> None:
+    # Runs once per pool process, before torch is imported (main keeps training imports lazy).
+    # numpy is already loaded by then, its BLAS thread count comes from run_sweep's environment.
+    rank, cpus = slots.get()
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+    _WORKER.update({"rank": rank, "cpus": cpus, "slots": slots})
+
+    import utilities
+    utilities.PRE_TRAIN = True
+
+
+def _run_job(conf: dict, release_slot=False) -> dict:
+    import torch
+    torch.set_num_threads(len(_WORKER["cpus"]))
+    # Workers share the working directory, so each one simulates in its own I/O namespace
+    conf = {**conf, "io_dir": conf.get("io_dir") or f"./io_sweep_{_WORKER['rank']}"}
+    try:
+        results = main.run_experiment(conf)
+    finally:
+        if release_slot:
+            # This worker exits after the job, the process replacing it takes over its CPUs
+            _WORKER["slots"].put((_WORKER["rank"], _WORKER["cpus"]))
+    results.update({"worker": _WORKER["rank"], "cpus": " ".join(map(str, _WORKER["cpus"]))})
+    return results
+
+
+def run_sweep(confs: list, threads_per_job=1, max_jobs=None, results_path=None, fresh_processes=False) -> list:
+    # fresh_processes: one new process per job (per-job peak RSS, no state carried between jobs)
+    slots_cpus = cpu_sets(threads_per_job, max_jobs)
+    context = mp.get_context("spawn")
+    slots = context.Queue()
+    for rank, cpus in enumerate(slots_cpus):
+        slots.put((rank, cpus))
+
+    print(f"Running {len(confs)} configurations on {len(slots_cpus)} workers x {threads_per_job} CPU(s)")
+    rows = []
+    # Spawned workers import numpy while unpickling their first call, before _init_worker, so the
+    # BLAS / OpenMP pools are sized from the environment they inherit from this process
+    saved_env = {var: os.environ.get(var) for var in THREAD_VARS}
+    os.environ.update({var: str(threads_per_job) for var in THREAD_VARS})
+    try:
+        with ProcessPoolExecutor(max_workers=len(slots_cpus), mp_context=context,
+                                 initializer=_init_worker, initargs=(slots,),
+                                 max_tasks_per_child=1 if fresh_processes else None) as pool:
+            futures = {pool.submit(_run_job, conf, fresh_processes): conf for conf in confs}
+            for future in as_completed(futures):
+                conf = futures[future]
+                try:
+                    row = {**conf, **future.result(), "status": "ok"}
+                except Exception as e:
+                    row = {**conf, "status": f"failed: {e}"}
+                print(f"[sweep] {row.get('experiment', '-')}: {row['status']}, "
+                      f"mean episode reward {row.get('mean_episode_reward')}")
+                rows.append(row)
+                if results_path:
+                    write_results(rows, results_path)
+    finally:
+        for var, value in saved_env.items():
+            if value is None:
+                os.environ.pop(var, None)
+            else:
+                os.environ[var] = value
+    return rows
+
+
+def write_results(rows: list, results_path: str) -> None:
+    columns = []
+    for row in rows:
+        columns.extend(key for key in row if key not in columns)
+    with open(results_path + ".tmp", "w", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+    os.replace(results_path + ".tmp", results_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parallel local sweep over run_experiment configurations")
+    parser.add_argument("--grid", type=str, required=True, help="JSON dict of lists, or path to a JSON file")
+    parser.add_argument("--threads_per_job", type=int, default=1, help="CPUs (and torch threads) per job")
+    parser.add_argument("--max_jobs", type=int, default=None, help="Upper bound on concurrent jobs")
+    parser.add_argument("--wandb_mode", type=str, default="offline", help="online / offline / disabled")
+    parser.add_argument("--out", type=str, default="", help="Results CSV (default: ./Experiment/sweep_<time>.csv)")
+    args = parser.parse_args()
+
+    if os.path.exists(args.grid):
+        with open(args.grid, "r") as file:
+            grid = json.load(file)
+    else:
+        grid = json.loads(args.grid)
+    confs = expand_grid(grid, {**main.DEFAULT_CONF, "wandb_mode": args.wandb_mode})
+    os.makedirs(main.EXPERIMENT_ROOT, exist_ok=True)
+    out = args.out or f"{main.EXPERIMENT_ROOT}/sweep_{time.strftime('%Y%m%d_%H%M%S')}.csv"
+    run_sweep(confs, args.threads_per_job, args.max_jobs, out)
+    print(f"Results written to {out}")
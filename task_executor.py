@@ -3,54 +3,75 @@ import subprocess
 import threading
 import time
 import os
+import numpy as np
+
 import utilities
+import sim_kernel
+import file_protocol
+import trace_replay
+import phy_model
+
+def wait_for_results(io, alloc_seq):
+    """
+        Blocks until res.json holds the results of allocation alloc_seq and returns them
+
+        Only the exact sequence number counts; TimeoutError after utilities.DATA_GATHERING_TIMEOUT.
+    """
+    done = file_protocol.FileWatcher(io.res_path).wait_for_seq(alloc_seq, timeout=utilities.DATA_GATHERING_TIMEOUT, exact=True)
+    if done is None:
+        raise TimeoutError(f"No results for allocation {alloc_seq} in {io.res_path} "
+                           f"after {utilities.DATA_GATHERING_TIMEOUT} s, is the xApp running?")
+    return done[1]
+
+def apply_measurements(tasks, dl_thp):
+    # Measured throughput (kbps per user id) replaces the regression, durations follow from the same kernel
+    measured = [task for task in tasks if task["user_id"] in dl_thp]
+    if not measured:
+        return
+    arrays = sim_kernel.task_arrays(measured)
+    tpt_bps = np.array([dl_thp[task["user_id"]] * 1e3 for task in measured], dtype=float)
+    duration, bit_rate_bytes = sim_kernel.task_metrics(tpt_bps, arrays["demand"], utilities.DATA_GATHERING_DURATION)
+    for idx, task in enumerate(measured):
+        task["metrics"]["bit_rate"] = float(bit_rate_bytes[idx])    # Bytes / Sec
+        task["metrics"]["duration"] = float(duration[idx])
 
 # Main function to process all tasks simultaneously
-def process_tasks(tasks, pre_train=False):
+def process_tasks(tasks, pre_train=False, backend=None, rng=None, io=None, phy=None):
     output_store = []
     start_time = 0.
     
     # List to store all threads
     threads = []
-    
-    if not pre_train:
+
+    # Files and throughput source (live testbed, linear regressions, replayed hardware recordings
+    # or SINR model) of the calling environment, process-wide defaults otherwise
+    io = utilities.IOContext.from_globals() if io is None else io
+    if backend is None:
+        backend = io.resolve_backend(pre_train)
+    if backend not in ("hardware", "regression", "replay", "sinr"):
+        raise ValueError(f"Unknown task executor backend: {backend}")
+
+    if backend == "hardware":
         print("INFO: Applying the config and reading from the metrics")
-        time.sleep(10)
-        # Wait until the file is not empty
-        path_metric_json = "/home/oai/oran-sc-ric/xApps/python/res.json"
-        while os.stat(path_metric_json).st_size == 0:
-            time.sleep(1)
-        # Reading the metrics json
-        with open(path_metric_json, "r") as file:
-            metrics = json.load(file)
-        for task in tasks:
-            id = task["user_id"]
-            for item in metrics:
-                if item["id"] == id:
-                    task["metrics"]["bit_rate"] = (item["dl_thp"] * 1e3) / 8    # Bytes / Sec
-                    if task["task_type"] in ["URLLC", "mMTC_high", "mMTC_low"]:
-                        gen_freq = task["gen_freq"]
-                        gen_size = task["gen_size"]
-                        total_bytes = int(gen_size * gen_freq * utilities.DATA_GATHERING_DURATION)
-                        duration = total_bytes / task["metrics"]["bit_rate"]
-                        task["metrics"]["duration"] = duration * 1000
-                    
-                    elif task["task_type"] == "eMBB_high" or task["task_type"] == "eMMB_low":
-                        total_bytes = int(task["bit_rate"] * utilities.DATA_GATHERING_DURATION)
-                        duration = total_bytes / task["metrics"]["bit_rate"]
-                        task["metrics"]["duration"] = duration * 1000
-        #print(tasks)
-        # Empty the file
-        #with open(path_metric_json, "w") as file:
-            #file.write("")
+        # Wait until the xApp publishes the results for the allocation we just wrote
+        # (res.json carries the sequence number of the allocation it measured)
+        alloc_seq = file_protocol.read_seq(io.alloc_path)
+        metrics = wait_for_results(io, alloc_seq)
+        dl_thp = {item["id"]: item["dl_thp"] for item in metrics}
+        if io.record_path:
+            _, prb_alloc = file_protocol.read_json(io.alloc_path)
+            alloc_map = {item["id"]: item["max_prb_ratio"] for item in prb_alloc or [] if "max_prb_ratio" in item}
+            trace_replay.record_step(io.record_path, alloc_seq, tasks, alloc_map, dl_thp)
+
+        apply_measurements(tasks, dl_thp)
     
     else:
         # Reading the PRB allocation json
         try:
-            with open(utilities.ALLOCATION_SAVE_PATH, "r") as file:
-                prb_alloc = json.load(file)
-        except (FileNotFoundError, json.JSONDecodeError):
-            prb_alloc = []
+            _, prb_alloc = file_protocol.read_json(io.alloc_path)
+        except json.JSONDecodeError:
+            prb_alloc = None
+        prb_alloc = prb_alloc or []
         
         # Convert list to dictionary for faster lookup: {user_id: ratio}
         alloc_map = {}
@@ -58,68 +79,45 @@ def process_tasks(tasks, pre_train=False):
             if "id" in item and "max_prb_ratio" in item:
                 alloc_map[item["id"]] = item["max_prb_ratio"]
 
-        for task in tasks:
-            user_id = task["user_id"]
-            gnb_id = task["gnb_id"]
-
-            # Find PRBs assigned to this user
-            prb_ratio = alloc_map.get(user_id, 0) # Default to 0 if not found
-            prb = int((prb_ratio / 100.0) * utilities.PRB_PER_GNB)
-            
-            tpt_bps = 0.0
-
-            # SDR-based gNB1 (Hardware specific regression)
-            if gnb_id == 1:
-                tpt_bps = ((0.4341 * prb + 3.4841) * 1e6)
-            # Virtual gNB2, gNB3 (Software specific regression)
-            else:
-                tpt_bps = ((0.1752 * prb - 0.0648) * 1e6)
-
-            # Calculate duration/latency
-            if task["task_type"] in ["URLLC", "mMTC_low", "mMTC_high"]:
-                gen_freq = task.get("gen_freq", 1)
-                gen_size = task.get("gen_size", 1000)
-
-                total_bytes = int(gen_size * gen_freq * utilities.DATA_GATHERING_DURATION)
-                bit_rate_bytes = tpt_bps / 8.
-                duration = total_bytes / bit_rate_bytes
-                task["metrics"]["duration"] = duration * 1000
-                task["metrics"]["bit_rate"] = bit_rate_bytes
-                # Retrive path loss for corresponding task/UE
-                # path_loss = task["path_loss"]
-                # Compute SINR in dB
-                # p_tx_dbm = 23
-                # n0_dbm = 0
-                # sinr_db = p_tx_dbm - path_loss - n0_dbm
-                # Convert SINR to linear scale
-                #sinr_linear = 10 ** (sinr_db / 10)
-                # Adjust Throughput using SINR/Shannon-Hartley Theorem ideal max for speed of channel
-                # Capacity = Bandwidth * log_2(1 + SINR)
-                # adjusted_tpt_byte_ps = bit_rate * math.log2(1 + sinr_linear)
-            elif task["task_type"] == "eMBB_low" or task["task_type"] == "eMBB_high":
-                total_bytes = int(task["bit_rate"] * utilities.DATA_GATHERING_DURATION)
-                bit_rate_bytes = tpt_bps / 8.
-                duration = total_bytes / bit_rate_bytes
-                task["metrics"]["duration"] = duration * 1000
-                task["metrics"]["bit_rate"] = bit_rate_bytes
+        # Find PRBs assigned to each user and run the whole queue through the vectorized kernel
+        arrays = sim_kernel.task_arrays(tasks)
+        prb_ratio = np.array([alloc_map.get(task["user_id"], 0) for task in tasks], dtype=float) # Default to 0 if not found
+        prb = sim_kernel.ratio_to_prb(prb_ratio)
+
+        if backend == "replay":
+            # Measured mean throughput per (gNB, PRB) with sampled measurement noise
+            model = trace_replay.load_replay_model(io.replay_table_path)
+            tpt_bps = model.throughput(prb, arrays["gnb_ids"], rng)
+        elif backend == "sinr":
+            # Per-PRB SINR from the UE positions with interference on overlapping PRBs, with the
+            # calling environment's model (its Config) or the default Config's
+            positions = np.array([[task["position"]["x"], task["position"]["y"]] for task in tasks])
+            phy = phy_model.default_model() if phy is None else phy
+            tpt_bps = phy.throughput(prb, arrays["gnb_ids"], positions)
+        else:
+            # SDR-based gNB1 and virtual gNB2, gNB3 use their own linear regressions
+            tpt_bps = sim_kernel.regression_throughput(prb, arrays["gnb_ids"])
+
+        # Calculate duration/latency
+        duration, bit_rate_bytes = sim_kernel.task_metrics(tpt_bps, arrays["demand"], utilities.DATA_GATHERING_DURATION)
+        if utilities.KERNEL_CHECK:
+            sim_kernel.execute_and_reward(prb, arrays["gnb_ids"], arrays["categories"], arrays["demand"],
+                                          arrays["gen_freq"], utilities.DATA_GATHERING_DURATION,
+                                          tpt_bps=tpt_bps, check=True)
+        for idx, task in enumerate(tasks):
+            task["metrics"]["duration"] = float(duration[idx])
+            task["metrics"]["bit_rate"] = float(bit_rate_bytes[idx])
 
     
-def execute_tasks(task_queue, pre_train=False):
+def execute_tasks(task_queue, pre_train=False, backend=None, rng=None, io=None, phy=None):
     # Process all tasks in the task queue
-    process_tasks(task_queue, pre_train=pre_train)
+    process_tasks(task_queue, pre_train=pre_train, backend=backend, rng=rng, io=io, phy=phy)
 
 if __name__ == "__main__":
 
-    # Open and load the existing JSON data
-    with open(utilities.ALLOCATION_SAVE_PATH, 'r') as file:
-        data = json.load(file)
-
-    # Add the new key-value pair
-    data.append({"version": 1})
-
-    # Write the updated data back to the JSON file
-    with open(utilities.ALLOCATION_SAVE_PATH, 'w') as file:
-        json.dump(data, file, indent=4)
+    # Re-publish the existing allocation under a new sequence number so the xApp measures it again
+    _, data = file_protocol.read_json(utilities.ALLOCATION_SAVE_PATH)
+    file_protocol.write_json(utilities.ALLOCATION_SAVE_PATH, data)
 
     # Sample task queue -- Unit Test (not actual used)
     ''' Updated values to match task definition
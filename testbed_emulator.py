@@ -0,0 +1,335 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import types
+
+import numpy as np
+
+import utilities
+import sim_kernel
+import file_protocol
+from utilities import Config
+
+# Local testbed emulator: the trainer <-> xApp <-> traffic generator loop on one CPU-only machine
+# Stands in for the parts of the lab that are not in this repo:
+#   - lib.xAppBase with the E2SM-KPM / E2SM-RC subset apply_config_hw.MyXapp uses: style-5
+#     subscriptions emitting DRB.UEThpDl (kbps) every report period, slice-level PRB quota control
+#   - the RAN behind them (EmulatedRan): a UE's throughput is its offered load, capped by the
+#     sim_kernel regression at its PRB quota, with multiplicative measurement noise
+#   - iperf (FakeIperf), plugged into find_ue_ids.main in place of the subprocess clients
+# The unmodified xApp and traffic generator then run in threads against an io_dir namespace
+# and an InterferenceEnvironment steps them through backend="hardware":
+#   python testbed_emulator.py --steps 10 --time_scale 0.25
+# time_scale shrinks report periods, iperf durations and settle delays (1 = lab timing).
+
+E2_NODE_IDS = ["gnbd_001_001_000001_0", "gnbd_001_001_000002_0", "gnbd_001_001_000003_0"] # gNB1, gNB2, gNB3
+MEASUREMENT_NOISE = 0.05  # Relative std of every throughput report
+IDLE_KBPS = 0.5           # Report scale of a UE without traffic (below the xApp's 3 kbps idle threshold)
+CONTROL_LATENCY_S = 0.005 # RC control round trip
+READY_TIMEOUT_S = 120.    # UE mapping of the xApp, in wall-clock seconds
+
+_RAN = None # RAN the fake xAppBase instances attach to, see install()
+
+
+def parse_rate(rate: str) -> float:
+    # iperf -b syntax: "5M" -> 5e6 bits/s
+    units = {"K": 1e3, "M": 1e6, "G": 1e9}
+    return float(rate[:-1]) * units[rate[-1].upper()] if rate[-1].upper() in units else float(rate)
+
+
+class EmulatedRan:
+    """
+        Per-UE PRB quotas, active traffic flows and the KPM report loop of three gNBs
+
+        RAN UE ids are the trainer user ids (0..4); testbed UE numbers (ue_id.json, iperf
+        10.45.1.<n>) are one higher, like on the lab testbed.
+    """
+    def __init__(self, global_config, time_scale=1., seed=None, control_latency_s=CONTROL_LATENCY_S) -> None:
+        self.time_scale = time_scale
+        self.control_latency_s = control_latency_s * time_scale
+        self.gnb_of_ue = {s["user_id"]: s["gnb_id"] for s in global_config.user_scenarios}
+        self.quota = {ue: 100 for ue in self.gnb_of_ue} # max_prb_ratio
+        self.flows = {}                                 # ue -> (end time, offered bits/s)
+        self.subscriptions = []
+        self.rng = np.random.RandomState(seed)
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._report_loop, name="kpm_reports", daemon=True)
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        if self.thread.is_alive():
+            self.thread.join(timeout=5)
+
+    def set_quota(self, ue, max_prb_ratio) -> None:
+        time.sleep(self.control_latency_s)
+        with self.lock:
+            self.quota[ue] = max_prb_ratio
+
+    def start_flow(self, ue, duration_s, rate_bps) -> float:
+        end = time.monotonic() + duration_s
+        with self.lock:
+            self.flows[ue] = (end, rate_bps)
+        return end
+
+    def stop_flow(self, ue) -> None:
+        with self.lock:
+            self.flows.pop(ue, None)
+
+    def stop_all_flows(self) -> None:
+        with self.lock:
+            self.flows.clear()
+
+    def capacity_bps(self, ues) -> np.ndarray:
+        # Throughput the quota allows, same regression as the simulated backend
+        prb = sim_kernel.ratio_to_prb([self.quota[ue] for ue in ues])
+        return sim_kernel.regression_throughput(prb, [self.gnb_of_ue[ue] for ue in ues])
+
+    def expected_kbps(self, ue, rate_bps) -> float:
+        # Noise-free report of a UE sending rate_bps under its current quota
+        return float(min(rate_bps, self.capacity_bps([ue])[0]) / 1e3)
+
+    def subscribe(self, e2_node_id, report_period_ms, ue_ids, callback) -> int:
+        with self.lock:
+            self.subscriptions.append({"node": e2_node_id, "period": report_period_ms / 1e3 * self.time_scale,
+                                       "ues": list(ue_ids), "callback": callback, "due": time.monotonic()})
+            return len(self.subscriptions) - 1
+
+    def indication(self, ue_ids, now) -> dict:
+        # KPM style-5 indication body as returned by extract_meas_data
+        with self.lock:
+            offered = [self.flows[ue][1] if ue in self.flows and self.flows[ue][0] > now else 0. for ue in ue_ids]
+            capacity = self.capacity_bps(ue_ids)
+        kbps = np.minimum(offered, capacity) / 1e3 * (1 + MEASUREMENT_NOISE * self.rng.randn(len(ue_ids)))
+        kbps = np.where(np.array(offered) > 0, np.maximum(kbps, 0.), np.abs(self.rng.randn(len(ue_ids))) * IDLE_KBPS)
+        return {"ueMeasData": {ue: {"measData": {"DRB.UEThpDl": [float(value)]}} for ue, value in zip(ue_ids, kbps)}}
+
+    def _report_loop(self) -> None:
+        # One thread delivers every indication in due order, like the single RMR receive loop
+        while not self.stopped.is_set():
+            with self.lock:
+                pending = sorted(self.subscriptions, key=lambda sub: sub["due"])
+            if not pending:
+                self.stopped.wait(0.01)
+                continue
+            sub = pending[0]
+            delay = sub["due"] - time.monotonic()
+            if delay > 0:
+                self.stopped.wait(delay)
+                continue
+            sub["due"] += sub["period"]
+            sub["callback"](sub["node"], self.subscriptions.index(sub), None, self.indication(sub["ues"], time.monotonic()))
+
+
+class FakeE2smKpm:
+    def __init__(self, ran: EmulatedRan) -> None:
+        self.ran = ran
+
+    def subscribe_report_service_style_5(self, e2_node_id, report_period, ue_ids, metric_names,
+                                         granul_period, subscription_callback):
+        assert list(metric_names) == ["DRB.UEThpDl"], f"Only DRB.UEThpDl is emulated, got {metric_names}"
+        self.ran.subscribe(e2_node_id, report_period, ue_ids, subscription_callback)
+
+    def extract_meas_data(self, indication_msg):
+        return indication_msg
+
+
+class FakeE2smRc:
+    def __init__(self, ran: EmulatedRan) -> None:
+        self.ran = ran
+        self.ran_func_id = None
+
+    def set_ran_func_id(self, ran_func_id) -> None:
+        self.ran_func_id = ran_func_id
+
+    def control_slice_level_prb_quota(self, e2_node_id, ue_id, min_prb_ratio, max_prb_ratio,
+                                      dedicated_prb_ratio, ack_request=1):
+        gnb = E2_NODE_IDS.index(e2_node_id) + 1
+        if self.ran.gnb_of_ue.get(ue_id) != gnb:
+            raise ValueError(f"UE {ue_id} is not attached to {e2_node_id}")
+        self.ran.set_quota(ue_id, max_prb_ratio)
+
+
+class xAppBase:
+    # Subset of lib.xAppBase.xAppBase: E2SM modules, running flag, start decorator, signal handler
+    def __init__(self, config, http_server_port, rmr_port) -> None:
+        if _RAN is None:
+            raise RuntimeError("testbed_emulator.install() has not been called")
+        self.running = True
+        self.e2sm_kpm = FakeE2smKpm(_RAN)
+        self.e2sm_rc = FakeE2smRc(_RAN)
+
+    @staticmethod
+    def start_function(function):
+        def start(self, *args, **kwargs):
+            try:
+                return function(self, *args, **kwargs)
+            finally:
+                self.running = False
+        return start
+
+    def signal_handler(self, sig, frame) -> None:
+        self.running = False
+
+
+class FakeFlow:
+    # Popen-like handle of one emulated iperf client
+    def __init__(self, ran, ue, end, command) -> None:
+        self.ran, self.ue, self.end, self.command = ran, ue, end, command
+
+    def wait(self, timeout=None):
+        remaining = self.end - time.monotonic()
+        if timeout is not None and remaining > timeout:
+            time.sleep(timeout)
+            raise subprocess.TimeoutExpired(self.command, timeout)
+        time.sleep(max(0., remaining))
+        return 0
+
+    def poll(self):
+        return None if time.monotonic() < self.end and self.ue in self.ran.flows else 0
+
+    def communicate(self, timeout=None):
+        self.wait(timeout)
+        return b"", b""
+
+    def kill(self) -> None:
+        self.ran.stop_flow(self.ue)
+
+
+class FakeIperf:
+    # find_ue_ids traffic source: UDP flows into the emulated RAN instead of iperf processes
+    def __init__(self, ran: EmulatedRan, duration_s=None, rate=None) -> None:
+        import find_ue_ids
+        self.ran = ran
+        self.duration_s = (find_ue_ids.IPERF_DURATION_S if duration_s is None else duration_s) * ran.time_scale
+        self.rate = find_ue_ids.IPERF_RATE if rate is None else rate
+
+    def command(self, ue):
+        return f"iperf -c 10.45.1.{ue} -u -t {self.duration_s:g} -b {self.rate} (emulated)"
+
+    def start(self, ue):
+        ran_ue = ue - 1 # testbed UE number -> RAN UE id
+        return FakeFlow(self.ran, ran_ue, self.ran.start_flow(ran_ue, self.duration_s, parse_rate(self.rate)), self.command(ue))
+
+    def kill_all(self) -> None:
+        self.ran.stop_all_flows()
+
+
+def install(ran: EmulatedRan):
+    """
+        Registers the fake lib.xAppBase and returns the apply_config_hw module built on it
+
+        Every MyXapp created afterwards talks to ran.
+    """
+    global _RAN
+    _RAN = ran
+    lib = sys.modules.get("lib") or types.ModuleType("lib")
+    base = types.ModuleType("lib.xAppBase")
+    base.xAppBase = xAppBase
+    lib.xAppBase = base
+    if "apply_config_hw" in sys.modules and sys.modules["apply_config_hw"].xAppBase is not xAppBase:
+        raise RuntimeError("apply_config_hw was already imported against the real lib")
+    sys.modules.setdefault("lib", lib)
+    sys.modules["lib.xAppBase"] = base
+    import apply_config_hw
+    return apply_config_hw
+
+
+def run_emulated(n_steps=10, io_dir="./io_emulator", time_scale=0.25, seed=0, control_latency_s=CONTROL_LATENCY_S,
+                 **xapp_kwargs) -> dict:
+    """
+        Maps the UEs, then steps an InterferenceEnvironment n_steps times through the xApp
+
+        Returns the xApp's UE mapping, per-step wall-clock times and the largest relative error
+        between the measured and the noise-free emulated throughput of every UE. xapp_kwargs go
+        to MyXapp (e.g. ci_target=0 for full-length measurement windows, pipelined=True).
+        control_latency_s is the lab-time RC control round trip.
+    """
+    import find_ue_ids
+    from environment import InterferenceEnvironment
+
+    os.makedirs(io_dir, exist_ok=True)
+    paths = file_protocol.protocol_paths(io_dir)
+    config = Config()
+    ran = EmulatedRan(config, time_scale=time_scale, seed=seed, control_latency_s=control_latency_s)
+    apply_config_hw = install(ran)
+    xapp = apply_config_hw.MyXapp("", 0, 0, io_dir=io_dir, **xapp_kwargs)
+    stop = threading.Event()
+    traffic = FakeIperf(ran)
+    threads = [threading.Thread(target=find_ue_ids.main, args=(io_dir, traffic, stop, find_ue_ids.SETTLE_S * time_scale),
+                                name="traffic", daemon=True),
+               threading.Thread(target=xapp.start, args=(E2_NODE_IDS, 0), name="xapp", daemon=True)]
+    ran.start()
+    for thread in threads:
+        thread.start()
+
+    step_s, errors, reports = [], [], []
+    attribution_ok = True
+    try:
+        if not xapp.ready.wait(READY_TIMEOUT_S):
+            raise RuntimeError("xApp did not finish the UE mapping")
+        expected_map = {user_id + apply_config_hw.UE_NUMBER_OFFSET: user_id for user_id in ran.gnb_of_ue}
+
+        config.io = utilities.IOContext(io_dir, backend="hardware")
+        env = InterferenceEnvironment(config)
+        env.reset(seed=seed)
+        rng = np.random.RandomState(seed)
+        offered_bps = parse_rate(traffic.rate)
+        for _ in range(n_steps):
+            start = time.perf_counter()
+            env.step(int(rng.randint(env.action_space.n)))
+            step_s.append(time.perf_counter() - start)
+            # The quotas of this step are still in place: compare against the noise-free throughput
+            _, results = file_protocol.read_json(paths["res"])
+            for item in results:
+                expected = ran.expected_kbps(item["id"], offered_bps)
+                errors.append(abs(item["dl_thp"] - expected) / expected)
+                reports.append(item["reports"])
+                attribution_ok &= item["gnb"] == ran.gnb_of_ue[item["id"]] and item["applied"]
+    finally:
+        xapp.running = False
+        stop.set()
+        for thread in threads:
+            thread.join(timeout=5)
+        ran.stop()
+
+    return {"user_map": {int(k): v for k, v in xapp.user_map.items()},
+            "mapping_ok": xapp.user_map == expected_map,
+            "steps": len(step_s),
+            "step_s": step_s,
+            "mean_step_s": float(np.mean(step_s)) if step_s else None,
+            "max_rel_error": float(max(errors)) if errors else None,
+            "mean_reports": float(np.mean(reports)) if reports else None,
+            "attribution_ok": attribution_ok,
+            "time_scale": time_scale}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run trainer, xApp and traffic generator against an emulated testbed")
+    parser.add_argument("--steps", type=int, default=10, help="Environment steps after the UE mapping")
+    parser.add_argument("--io_dir", type=str, default="./io_emulator", help="Protocol file namespace")
+    parser.add_argument("--time_scale", type=float, default=0.25, help="Emulated time / lab time (1: lab timing)")
+    parser.add_argument("--seed", type=int, default=0, help="Action and noise seed")
+    parser.add_argument("--ci_target", type=float, default=None, help="xApp measurement CI target (default: the xApp's)")
+    parser.add_argument("--control_latency", type=float, default=CONTROL_LATENCY_S, help="RC control round trip in lab seconds")
+    parser.add_argument("--pipelined", action="store_true", help="Run the xApp in pipelined mode")
+    parser.add_argument("--out", type=str, default="", help="Write the report as JSON")
+    args = parser.parse_args()
+
+    xapp_kwargs = {} if args.ci_target is None else {"ci_target": args.ci_target}
+    report = run_emulated(args.steps, args.io_dir, args.time_scale, args.seed, args.control_latency,
+                          pipelined=args.pipelined, **xapp_kwargs)
+    if args.out:
+        with open(args.out, "w") as file:
+            json.dump(report, file, indent=4)
+    print(f"Mapping {'ok' if report['mapping_ok'] else 'WRONG'} {report['user_map']}, "
+          f"attribution {'ok' if report['attribution_ok'] else 'WRONG'}, "
+          f"{report['steps']} steps, {report['mean_step_s']:.2f} s/step, max measurement error {report['max_rel_error']:.1%}, "
+          f"{report['mean_reports']:.1f} reports per UE")
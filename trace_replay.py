@@ -0,0 +1,153 @@
+import argparse
+import json
+import os
+
+import numpy as np
+
+import utilities
+
+# Trace-driven throughput backend for process_tasks (backend="replay").
+# Hardware steps can be recorded (utilities.RECORD_PATH) as JSON lines:
+#   {"seq": 12, "ues": [{"id": 0, "gnb_id": 1, "max_prb_ratio": 61, "prb": 31, "dl_thp": 17000.0}, ...]}
+# build_replay_table() condenses any number of recordings into a small lookup table:
+#   mean throughput per (gNB, PRB count), interpolated between measured PRB counts and
+#   extrapolated with a per-gNB linear fit, plus quantiles of the multiplicative measurement noise.
+#   python trace_replay.py --recordings ./recordings.jsonl --out ./replay_table.npz
+
+NOISE_QUANTILES = 129
+MIN_TPT_BPS = 1e3 # Floor for sampled throughput so durations stay finite
+
+
+def record_step(path, seq, tasks, alloc_map, dl_thp) -> None:
+    # Append one measured hardware step (called by process_tasks when utilities.RECORD_PATH is set)
+    ues = []
+    for task in tasks:
+        if task["user_id"] not in dl_thp:
+            continue
+        prb_ratio = alloc_map.get(task["user_id"], 0)
+        ues.append({"id": task["user_id"],
+                    "gnb_id": task["gnb_id"],
+                    "max_prb_ratio": prb_ratio,
+                    "prb": int((prb_ratio / 100.0) * utilities.PRB_PER_GNB),
+                    "dl_thp": dl_thp[task["user_id"]]})
+    with open(path, "a") as file:
+        file.write(json.dumps({"seq": seq, "ues": ues}) + "\n")
+
+
+def load_recordings(paths) -> dict:
+    # {gnb_id: (prb array, throughput array in bits/s)}
+    samples = {}
+    for path in paths:
+        with open(path, "r") as file:
+            for line in file:
+                if not line.strip():
+                    continue
+                for ue in json.loads(line)["ues"]:
+                    samples.setdefault(int(ue["gnb_id"]), []).append((int(ue["prb"]), float(ue["dl_thp"]) * 1e3))
+    return {gnb_id: (np.array([p for p, _ in rows]), np.array([t for _, t in rows]))
+            for gnb_id, rows in samples.items()}
+
+
+def build_replay_table(paths, out_path, prb_per_gnb=utilities.PRB_PER_GNB, n_quantiles=NOISE_QUANTILES) -> dict:
+    samples = load_recordings(paths)
+    if not samples:
+        raise ValueError(f"No measurements found in {paths}")
+    gnb_ids = np.array(sorted(samples))
+    prb_grid = np.arange(prb_per_gnb + 1)
+    mean_tpt = np.zeros((len(gnb_ids), len(prb_grid)))
+    counts = np.zeros((len(gnb_ids), len(prb_grid)), dtype=np.int64)
+    noise = np.ones((len(gnb_ids), n_quantiles))
+
+    for row, gnb_id in enumerate(gnb_ids):
+        prb, tpt = samples[gnb_id]
+        observed = np.unique(prb)
+        means = np.array([tpt[prb == p].mean() for p in observed])
+        counts[row, observed] = [np.sum(prb == p) for p in observed]
+
+        # Piecewise-linear between measured PRB counts, linear fit outside the measured range
+        curve = np.interp(prb_grid, observed, means)
+        if len(observed) >= 2:
+            slope, intercept = np.polyfit(prb, tpt, 1)
+            outside = (prb_grid < observed[0]) | (prb_grid > observed[-1])
+            curve[outside] = slope * prb_grid[outside] + intercept
+        mean_tpt[row] = np.maximum(curve, MIN_TPT_BPS)
+
+        # Empirical multiplicative noise around the per-PRB mean
+        ratios = tpt / mean_tpt[row, prb]
+        noise[row] = np.quantile(ratios, np.linspace(0., 1., n_quantiles))
+
+    table = {"gnb_ids": gnb_ids, "prb_grid": prb_grid, "mean_tpt_bps": mean_tpt,
+             "noise_quantiles": noise, "counts": counts}
+    # Through a file handle, np.savez would otherwise append .npz to any other out_path
+    with open(out_path, "wb") as file:
+        np.savez(file, **table)
+    return table
+
+
+class ReplayModel:
+    def __init__(self, table) -> None:
+        self.gnb_ids = np.asarray(table["gnb_ids"])
+        self.mean_tpt_bps = np.asarray(table["mean_tpt_bps"])
+        self.noise_quantiles = np.asarray(table["noise_quantiles"])
+        self.max_prb = self.mean_tpt_bps.shape[1] - 1
+        # gNB id -> table row through the sorted ids, any integer id can be looked up
+        self.order = np.argsort(self.gnb_ids)
+        self.sorted_ids = self.gnb_ids[self.order]
+
+    @classmethod
+    def load(cls, path) -> "ReplayModel":
+        return cls(utilities.load_npz_mmap(path))
+
+    def rows(self, gnb_ids) -> np.ndarray:
+        gnb_ids = np.asarray(gnb_ids)
+        position = np.clip(np.searchsorted(self.sorted_ids, gnb_ids), 0, len(self.sorted_ids) - 1)
+        missing = self.sorted_ids[position] != gnb_ids
+        if np.any(missing):
+            raise ValueError(f"No recordings for gNBs {np.unique(gnb_ids[missing])}, "
+                             f"the replay table covers {self.sorted_ids.tolist()}")
+        return self.order[position]
+
+    def throughput(self, prb, gnb_ids, rng=None, noise=True):
+        """
+            Sampled throughput in bits/s for PRB counts on the given gNBs
+
+            Shapes broadcast like sim_kernel.regression_throughput, (users,) or (envs, users)
+        """
+        rows = self.rows(gnb_ids)
+        prb_idx = np.clip(np.asarray(prb, dtype=int), 0, self.max_prb)
+        rows, prb_idx = np.broadcast_arrays(rows, prb_idx)
+        tpt = self.mean_tpt_bps[rows, prb_idx]
+        if noise:
+            # Inverse-CDF sample of the noise factor from the stored quantiles
+            rng = np.random if rng is None else rng
+            position = rng.random(tpt.shape) * (self.noise_quantiles.shape[1] - 1)
+            low = np.floor(position).astype(int)
+            high = np.minimum(low + 1, self.noise_quantiles.shape[1] - 1)
+            weight = position - low
+            factor = (1 - weight) * self.noise_quantiles[rows, low] + weight * self.noise_quantiles[rows, high]
+            tpt = tpt * factor
+        return np.maximum(tpt, MIN_TPT_BPS)
+
+
+_MODELS = {}
+
+def load_replay_model(path) -> ReplayModel:
+    # Cached per process, the table is memory-mapped and shared between workers
+    if path not in _MODELS:
+        _MODELS[path] = ReplayModel.load(path)
+    return _MODELS[path]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the replay lookup table from recorded hardware steps")
+    parser.add_argument("--recordings", type=str, nargs="+", required=True, help="JSONL recordings (utilities.RECORD_PATH)")
+    parser.add_argument("--out", type=str, default=utilities.REPLAY_TABLE_PATH, help="Output table (.npz)")
+    args = parser.parse_args()
+
+    table = build_replay_table(args.recordings, args.out)
+    for row, gnb_id in enumerate(table["gnb_ids"]):
+        measured = np.flatnonzero(table["counts"][row])
+        print(f"gNB{gnb_id}: {table['counts'][row].sum()} samples over PRBs {measured.min()}..{measured.max()}, "
+              f"noise p5/p95 {np.quantile(table['noise_quantiles'][row], 0.05):.2f}/"
+              f"{np.quantile(table['noise_quantiles'][row], 0.95):.2f}")
+    print(f"Replay table written to {os.path.abspath(args.out)} ({os.path.getsize(args.out) / 1e3:.1f} kB)")
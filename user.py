@@ -1,50 +1,75 @@
 import numpy as np
 from datetime import datetime as T
 import copy
-import math
+import sys
 
-import wandb
 import utilities
+import sim_kernel
+from phy_model import free_space_path_loss
 
 from task_executor import execute_tasks
 
 class User:
     # Define user QoS and which gNB connected to
-    def __init__(self, id: int, category: str, position: dict, gnb_id: int, GlobalConfig: dict) -> None:
+    def __init__(self, id: int, category: str, position: dict, gnb_id: int, GlobalConfig: dict, rng=None) -> None:
         assert isinstance(id, int)
         self.id = id
         assert category in ['URLLC', 'eMBB_high', 'eMBB_low', 'mMTC_high', 'mMTC_low']
         self.category = category
         self.gc = GlobalConfig
+        self.rng = np.random if rng is None else rng # Per-environment RandomState so seeded resets are reproducible
         
         self.history = []
         self.gnb_id = gnb_id # Track which gNB user belongs to
 
         if self.gnb_id == 1:
-            self.position = {"x": np.random.uniform(self.gc.gnb1_ue_position_bound["x"]["min"], 
+            self.position = {"x": self.rng.uniform(self.gc.gnb1_ue_position_bound["x"]["min"], 
                                                     self.gc.gnb1_ue_position_bound["x"]["max"]),
-                            "y": np.random.uniform(self.gc.gnb1_ue_position_bound["y"]["min"],
+                            "y": self.rng.uniform(self.gc.gnb1_ue_position_bound["y"]["min"],
                                                     self.gc.gnb1_ue_position_bound["y"]["max"])}
         elif self.gnb_id == 2:
-            self.position = {"x": np.random.uniform(self.gc.gnb2_ue_position_bound["x"]["min"], 
+            self.position = {"x": self.rng.uniform(self.gc.gnb2_ue_position_bound["x"]["min"], 
                                                     self.gc.gnb2_ue_position_bound["x"]["max"]),
-                            "y": np.random.uniform(self.gc.gnb2_ue_position_bound["y"]["min"],
+                            "y": self.rng.uniform(self.gc.gnb2_ue_position_bound["y"]["min"],
                                                     self.gc.gnb2_ue_position_bound["y"]["max"])}
         else: # self.gnb_id == 3
-            self.position = {"x": np.random.uniform(self.gc.gnb3_ue_position_bound["x"]["min"], 
+            self.position = {"x": self.rng.uniform(self.gc.gnb3_ue_position_bound["x"]["min"], 
                                                     self.gc.gnb3_ue_position_bound["x"]["max"]),
-                            "y": np.random.uniform(self.gc.gnb3_ue_position_bound["y"]["min"],
+                            "y": self.rng.uniform(self.gc.gnb3_ue_position_bound["y"]["min"],
                                                     self.gc.gnb3_ue_position_bound["y"]["max"])}
             
-        self.velocity = {"x": np.random.uniform(self.gc.ue_velocity_bound["x"]["min"],
+        self.velocity = {"x": self.rng.uniform(self.gc.ue_velocity_bound["x"]["min"],
                                                 self.gc.ue_velocity_bound["x"]["max"]),
-                         "y": np.random.uniform(self.gc.ue_velocity_bound["y"]["min"],
+                         "y": self.rng.uniform(self.gc.ue_velocity_bound["y"]["min"],
                                                 self.gc.ue_velocity_bound["y"]["max"])}
     
         self.path_loss = 0.
         self.calculatePathLoss()
         self.metrics_last_step = {}
         self.time = T.now()
+        self.demand_sequence = None # Set by loadScenario, replaces the random task draws
+        self.step_idx = 0
+
+    # Overwrites the initial conditions with those of a pre-generated scenario (scenarios.py)
+    # demand / gen_freq hold one value per task generation, read in order by generateTask
+    def loadScenario(self, position, velocity, path_loss, demand, gen_freq) -> None:
+        self.position = {"x": position[0], "y": position[1]}
+        self.velocity = {"x": velocity[0], "y": velocity[1]}
+        self.path_loss = path_loss # Precomputed with calculatePathLoss' formula
+        self.demand_sequence = demand
+        self.gen_freq_sequence = gen_freq
+        self.step_idx = 0
+        self.history = []
+        self.metrics_last_step = {}
+        self.time = T.now()
+
+    # Next (gen_freq, gen_size, bit_rate) of the loaded scenario, wraps around past its end
+    def scenarioDemand(self) -> tuple:
+        t = self.step_idx % len(self.demand_sequence)
+        self.step_idx += 1
+        if self.category in ['eMBB_high', 'eMBB_low']:
+            return None, None, int(self.demand_sequence[t])
+        return int(self.gen_freq_sequence[t]), int(self.demand_sequence[t]), None
 
     # Calculate path loss in dB based on the distance between the user and the gNB
     def calculatePathLoss(self) -> None:
@@ -59,11 +84,9 @@ class User:
         #
         # 60 is a conversion factor given distance is expressed in m, not km
         #
-        # For f_dl = 1842.5 MHz, c = 299,792,458 m/s this reduces to:
-        distance = max(distance, 1.0) # Avoid log(0) errors if user on top of gNB
-        
-        path_loss = 20 * math.log10(distance) + 37.75 # Changed from 1805MHz value ~ 37.58
-        self.path_loss = path_loss
+        # For f_dl = 1842.5 MHz, c = 299,792,458 m/s this reduces to 20log10(d_m) + 37.75
+        # (shared with the SINR model, see phy_model.free_space_path_loss)
+        self.path_loss = float(free_space_path_loss(distance))
     
     # Updates the position of the user based on the velocity and the elapsed time
     # The user is bounded by its gNB's global configuration dimensions
@@ -82,9 +105,9 @@ class User:
                     self.position["x"] = new_x
                     self.position["y"] = new_y
                 else:
-                    self.velocity = {"x": np.random.uniform(self.gc.ue_velocity_bound["x"]["min"],
+                    self.velocity = {"x": self.rng.uniform(self.gc.ue_velocity_bound["x"]["min"],
                                                             self.gc.ue_velocity_bound["x"]["max"]),
-                                    "y": np.random.uniform(self.gc.ue_velocity_bound["y"]["min"],
+                                    "y": self.rng.uniform(self.gc.ue_velocity_bound["y"]["min"],
                                                         self.gc.ue_velocity_bound["y"]["max"])}
             elif self.gnb_id == 2:
                 if self.gc.gnb2_ue_position_bound["x"]["min"] <= new_x <= self.gc.gnb2_ue_position_bound["x"]["max"] and \
@@ -93,9 +116,9 @@ class User:
                     self.position["x"] = new_x
                     self.position["y"] = new_y
                 else:
-                    self.velocity = {"x": np.random.uniform(self.gc.ue_velocity_bound["x"]["min"],
+                    self.velocity = {"x": self.rng.uniform(self.gc.ue_velocity_bound["x"]["min"],
                                                             self.gc.ue_velocity_bound["x"]["max"]),
-                                    "y": np.random.uniform(self.gc.ue_velocity_bound["y"]["min"],
+                                    "y": self.rng.uniform(self.gc.ue_velocity_bound["y"]["min"],
                                                         self.gc.ue_velocity_bound["y"]["max"])}
             else: # self.gnb_id == 3
                 if self.gc.gnb3_ue_position_bound["x"]["min"] <= new_x <= self.gc.gnb3_ue_position_bound["x"]["max"] and \
@@ -104,9 +127,9 @@ class User:
                     self.position["x"] = new_x
                     self.position["y"] = new_y
                 else:
-                    self.velocity = {"x": np.random.uniform(self.gc.ue_velocity_bound["x"]["min"],
+                    self.velocity = {"x": self.rng.uniform(self.gc.ue_velocity_bound["x"]["min"],
                                                             self.gc.ue_velocity_bound["x"]["max"]),
-                                    "y": np.random.uniform(self.gc.ue_velocity_bound["y"]["min"],
+                                    "y": self.rng.uniform(self.gc.ue_velocity_bound["y"]["min"],
                                                         self.gc.ue_velocity_bound["y"]["max"])}
         self.calculatePathLoss()
 
@@ -118,33 +141,35 @@ class User:
         gen_size = None
         bit_rate = None
 
-        if self.category == 'URLLC':
-            gen_freq = np.random.randint(self.gc.ue_task_gen_spec["URLLC"]["gen_freq"]["min"],
+        if self.demand_sequence is not None:
+            gen_freq, gen_size, bit_rate = self.scenarioDemand()
+        elif self.category == 'URLLC':
+            gen_freq = self.rng.randint(self.gc.ue_task_gen_spec["URLLC"]["gen_freq"]["min"],
                                          self.gc.ue_task_gen_spec["URLLC"]["gen_freq"]["max"]+1)
             assert isinstance(gen_freq, int)
-            gen_size = np.random.randint(self.gc.ue_task_gen_spec["URLLC"]["gen_bytes"]["min"],
+            gen_size = self.rng.randint(self.gc.ue_task_gen_spec["URLLC"]["gen_bytes"]["min"],
                                          self.gc.ue_task_gen_spec["URLLC"]["gen_bytes"]["max"]+1)
             assert isinstance(gen_size, int)
         elif self.category == 'eMBB_high':
-            bit_rate = np.random.randint(self.gc.ue_task_gen_spec["eMBB_high"]["bit_rate"]["min"],
+            bit_rate = self.rng.randint(self.gc.ue_task_gen_spec["eMBB_high"]["bit_rate"]["min"],
                                          self.gc.ue_task_gen_spec["eMBB_high"]["bit_rate"]["max"]+1)
             assert isinstance(bit_rate, int)
         elif self.category == 'eMBB_low':
-            bit_rate = np.random.randint(self.gc.ue_task_gen_spec["eMBB_low"]["bit_rate"]["min"],
+            bit_rate = self.rng.randint(self.gc.ue_task_gen_spec["eMBB_low"]["bit_rate"]["min"],
                                          self.gc.ue_task_gen_spec["eMBB_low"]["bit_rate"]["max"]+1)
             assert isinstance(bit_rate, int)
         elif self.category == 'mMTC_high':
-            gen_freq = np.random.randint(self.gc.ue_task_gen_spec["mMTC_high"]["gen_freq"]["min"],
+            gen_freq = self.rng.randint(self.gc.ue_task_gen_spec["mMTC_high"]["gen_freq"]["min"],
                                          self.gc.ue_task_gen_spec["mMTC_high"]["gen_freq"]["max"]+1)
             assert isinstance(gen_freq, int)
-            gen_size = np.random.randint(self.gc.ue_task_gen_spec["mMTC_high"]["gen_bytes"]["min"],
+            gen_size = self.rng.randint(self.gc.ue_task_gen_spec["mMTC_high"]["gen_bytes"]["min"],
                                          self.gc.ue_task_gen_spec["mMTC_high"]["gen_bytes"]["max"]+1)
             assert isinstance(gen_size, int)
         elif self.category == 'mMTC_low':
-            gen_freq = np.random.randint(self.gc.ue_task_gen_spec["mMTC_low"]["gen_freq"]["min"],
+            gen_freq = self.rng.randint(self.gc.ue_task_gen_spec["mMTC_low"]["gen_freq"]["min"],
                                          self.gc.ue_task_gen_spec["mMTC_low"]["gen_freq"]["max"]+1)
             assert isinstance(gen_freq, int)
-            gen_size = np.random.randint(self.gc.ue_task_gen_spec["mMTC_low"]["gen_bytes"]["min"],
+            gen_size = self.rng.randint(self.gc.ue_task_gen_spec["mMTC_low"]["gen_bytes"]["min"],
                                          self.gc.ue_task_gen_spec["mMTC_low"]["gen_bytes"]["max"]+1)
             assert isinstance(gen_size, int)
         else:
@@ -168,6 +193,11 @@ class User:
 class UsersHandler:
     def __init__(self, GlobalConfig: dict, save=False, path_to_save="") -> None:
         self.gc = GlobalConfig
+        self.rng = np.random.RandomState()
+        self.last_reward_per_user = None
+
+    def seed(self, seed=None) -> None:
+        self.rng.seed(seed)
 
     def initUsers(self) -> None:
         self.users = []
@@ -180,25 +210,66 @@ class UsersHandler:
                 category=scenario["type"],
                 position=scenario["pos"],
                 gnb_id=scenario["gnb_id"],
-                GlobalConfig=self.gc
+                GlobalConfig=self.gc,
+                rng=self.rng
             )
             self.users.append(new_user)
 
+    def loadScenario(self, scenarios, k: int) -> None:
+        # Reset to scenario k of a scenarios.ScenarioSet, reusing the existing User objects
+        if not getattr(self, "users", None):
+            self.initUsers()
+        self.task_queue = []
+        self.users_history = []
+        positions, velocities, path_loss, demand, gen_freq = scenarios.scenario(k)
+        for u, user in enumerate(self.users):
+            user.loadScenario(positions[u], velocities[u], path_loss[u], demand[:, u], gen_freq[:, u])
+
     def generateTasks(self) -> list:
         self.task_queue = []
         for user in self.users:
             self.task_queue.append(user.generateTask())
         return self.task_queue
     
-    def executeTasks(self) -> float:
-        # Pass the queue to the Physics/Network Simulator
-        execute_tasks(self.task_queue, pre_train=utilities.PRE_TRAIN)
+    def executeTasks(self, phy=None) -> float:
+        # Pass the queue to the Physics/Network Simulator (phy: SINR model of the calling environment)
+        execute_tasks(self.task_queue, pre_train=self.gc.io.pre_train, rng=self.rng, io=self.gc.io, phy=phy)
         
         # Save history for offline training data
         self.users_history.append(copy.deepcopy(self.task_queue))
         return self.calculateReward()
 
     def calculateReward(self) -> float:
+        tasks = [user.task for user in self.users]
+        arrays = sim_kernel.task_arrays(tasks)
+        duration = np.array([task["metrics"]["duration"] for task in tasks], dtype=float)
+        reward_per_user, reward = sim_kernel.qos_reward(arrays["categories"], duration, arrays["demand"],
+                                                        arrays["gen_freq"], utilities.DATA_GATHERING_DURATION,
+                                                        self.gc.ue_task_gen_spec["URLLC"]["send_ms"])
+        if utilities.KERNEL_CHECK:
+            assert np.isclose(reward, self.calculateRewardReference(), rtol=1e-9, equal_nan=True)
+        self.last_reward_per_user = reward_per_user
+        self.last_duration = duration
+        self.last_bit_rate = np.array([task["metrics"]["bit_rate"] for task in tasks], dtype=float)
+        self.last_demand = arrays["demand"]
+        reward = float(reward)
+
+        # wandb is only imported by the training entry points, never by the simulator core
+        wandb = sys.modules.get("wandb")
+        if wandb is not None and wandb.run is not None:
+            wandb.log({"reward": reward})
+        # print(reward)
+        return reward
+
+    def stepInfo(self) -> dict:
+        # Per-user metrics of the last executed step, in user order (Bytes/s and ms)
+        return {"reward_per_user": self.last_reward_per_user,
+                "bit_rate": self.last_bit_rate,
+                "demand": self.last_demand,
+                "duration": self.last_duration}
+
+    def calculateRewardReference(self) -> float:
+        # Original per-user loop, kept to cross-check the vectorized kernel (utilities.KERNEL_CHECK)
         reward = 0.
         for user in self.users:
             if user.category == 'URLLC':
@@ -220,7 +291,4 @@ class UsersHandler:
                 reward += np.max([ -1.0, np.min([0., m])])
             else:
                 raise ValueError("Invalid category [reward calculation]")
-        if wandb.run is not None:
-            wandb.log({"reward": reward})
-        # print(reward)
         return reward
@@ -1,9 +1,95 @@
+import os
+
+import file_protocol
+
 ALLOCATION_SAVE_PATH = './alloc.json' # Change when move to real environment
+HW_RES_PATH = '/home/oai/oran-sc-ric/xApps/python/res.json' # Results written by the xApp
 DATA_GATHERING_DURATION = 1  # in seconds
 DATA_GATHERING_TIMEOUT = 50  # in seconds
 NUM_RETRIES = 5
 PRE_TRAIN = True
 PRB_PER_GNB = 52
+KERNEL_CHECK = False # Cross-check the vectorized simulator kernel against the scalar reference
+BACKEND = None # "hardware", "regression", "replay" or "sinr", None follows PRE_TRAIN (regression / hardware)
+RECORD_PATH = None # Append measured hardware steps to this JSONL file (trace_replay.build_replay_table input)
+REPLAY_TABLE_PATH = './replay_table.npz'
+ACTION_TABLE_DIR = './action_tables' # Memory-mapped action table cache (action_table.load_or_build)
+CATEGORY_ENUM = {"URLLC": 0, "eMBB_high": 1, "eMBB_low": 2, "mMTC_high": 3, "mMTC_low": 4}
+
+def load_npz_mmap(path) -> dict:
+    """
+        Memory-map every array of an uncompressed .npz (np.savez) read-only
+
+        np.load ignores mmap_mode for archives, but members written with ZIP_STORED are
+        plain .npy files at a fixed offset, so they can be mapped directly. Processes that
+        load the same file share its physical pages.
+    """
+    import struct
+    import zipfile
+    import numpy as np
+
+    arrays = {}
+    with zipfile.ZipFile(path) as archive, open(path, "rb") as raw:
+        for info in archive.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError(f"{path}: {info.filename} is compressed and cannot be memory-mapped")
+            # Local file header: 30 fixed bytes, then file name and extra field
+            raw.seek(info.header_offset)
+            name_len, extra_len = struct.unpack("<HH", raw.read(30)[26:30])
+            raw.seek(info.header_offset + 30 + name_len + extra_len)
+            version = np.lib.format.read_magic(raw)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(raw)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(raw)
+            name = info.filename[:-4] if info.filename.endswith(".npy") else info.filename
+            if int(np.prod(shape)) == 0:
+                arrays[name] = np.empty(shape, dtype=dtype)
+                continue
+            arrays[name] = np.memmap(path, dtype=dtype, mode="r", shape=shape,
+                                     order="F" if fortran_order else "C", offset=raw.tell())
+    return arrays
+
+class IOContext:
+    """
+        Files, backend and testbed endpoint of one environment
+
+        io_dir is the namespace for alloc.json / res.json / ue_id.json (file_protocol); for
+        the hardware backend it is the directory shared with the xApp (apply_config_hw.py
+        --io_dir). Explicit paths override the namespace. backend None follows pre_train
+        (regression / hardware), which is fixed when the context is built.
+    """
+    def __init__(self, io_dir=".", backend=None, alloc_path=None, res_path=None, ue_id_path=None,
+                 record_path=None, replay_table_path=None, pre_train=True) -> None:
+        paths = file_protocol.protocol_paths(io_dir)
+        self.io_dir = io_dir
+        self.backend = backend
+        self.alloc_path = alloc_path or paths["alloc"]
+        self.res_path = res_path or paths["res"]
+        self.ue_id_path = ue_id_path or paths["ue_id"]
+        self.record_path = record_path
+        self.replay_table_path = replay_table_path or REPLAY_TABLE_PATH
+        self.pre_train = pre_train
+
+    @classmethod
+    def from_globals(cls) -> "IOContext":
+        # Process-wide defaults (module constants above), what every environment used before
+        return cls(backend=BACKEND, alloc_path=ALLOCATION_SAVE_PATH, res_path=HW_RES_PATH,
+                   record_path=RECORD_PATH, replay_table_path=REPLAY_TABLE_PATH, pre_train=PRE_TRAIN)
+
+    def worker(self, name) -> "IOContext":
+        # Same backend and testbed, private allocation (and recording) file for one of several local envs
+        record_path = None if self.record_path is None else f"{os.path.splitext(self.record_path)[0]}_{name}.jsonl"
+        return IOContext(self.io_dir, self.backend,
+                         alloc_path=os.path.join(os.path.dirname(self.alloc_path), f"alloc_{name}.json"),
+                         res_path=self.res_path, ue_id_path=self.ue_id_path,
+                         record_path=record_path, replay_table_path=self.replay_table_path, pre_train=self.pre_train)
+
+    def resolve_backend(self, pre_train=None) -> str:
+        if self.backend is not None:
+            return self.backend
+        pre_train = self.pre_train if pre_train is None else pre_train
+        return "regression" if pre_train else "hardware"
 
 class Config:
     def __init__(self):
@@ -71,7 +157,25 @@ class Config:
                                  "mMTC_low": {"gen_freq": {"min": 4, "max": 4}, "gen_bytes": {"min": 25e3, "max": 50e3}}   # Need to update
                                 }
         
-        self.category_enum = {"URLLC": 0, "eMBB_high": 1, "eMBB_low": 2, "mMTC_high": 3, "mMTC_low": 4}
+        self.category_enum = dict(CATEGORY_ENUM)
+
+        # Per-environment files and backend (replace with IOContext(io_dir=...) to isolate an environment)
+        self.io = IOContext.from_globals()
+
+        # Pre-generated scenario dataset (scenarios.py), None draws fresh users on every reset
+        self.scenario_path = None
+
+        # Physical-layer model (phy_model.PhyModel, backend="sinr")
+        # 52 PRBs x 12 subcarriers x 15 kHz ~ 10 MHz, spectral efficiency capped at 64QAM 948/1024
+        # tx_power_dbm = 0 puts gNB1 close to its measured SDR regression at full allocation
+        self.phy = {"tx_power_dbm": 0., "noise_figure_db": 9., "prb_bandwidth_hz": 180e3,
+                    "efficiency": 0.75, "max_spectral_efficiency": 5.55}
+
+        # Action space grid (see InterferenceEnvironment.createActionList)
+        # step = 1 --> ~500,000 actions, step = 2 --> ~36,000 actions, step = 4 --> ~3,000 actions
+        self.action_step_size = 4
+        self.action_min_prb = 8
+        self.action_max_prb = 52
         self.total_ue_num = len(self.user_scenarios)
         
         self.data_gathering_duration = 10  # in seconds